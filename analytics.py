@@ -0,0 +1,315 @@
+import os
+import numpy as np
+
+# https://numpy.org/doc/stable/user/absolute_beginners.html
+# The portfolio view works on whole columns at once (one array each for quantities,
+# purchase prices and current prices) instead of a Python dict per lot,
+# so views of portfolios with thousands of lots stay quick
+
+# Lots with a bar of their own on the portfolio page at each end (gains and losses),
+# the rest share one 'others' bar and are listed on demand, 0 gives every lot a bar
+PORTFOLIO_TOP_N = int(os.environ.get("PORTFOLIO_TOP_N", 20))
+
+# Lots in each page of /portfolio/<portfolio_name>/lots
+LOTS_PER_PAGE = 50
+
+
+def unique_ids(symbols, dates):
+    """E.g. AAPL20210808, used to link each bar to its share route"""
+    # isoformat() is several times quicker than strftime() for the same YYYYMMDD digits
+    return [symbol + day.isoformat().replace("-", "") for symbol, day in zip(symbols, dates)]
+
+
+def net_changes(quantities, cost_bases, current_prices):
+    """Value today and $ change in value of each lot, as arrays"""
+    current_values = np.asarray(current_prices, dtype=np.float64) * np.asarray(quantities, dtype=np.float64)
+    return current_values, current_values - np.asarray(cost_bases, dtype=np.float64)
+
+
+def ranked(net_change, top_n):
+    """
+    Indices of the top_n biggest gains and top_n biggest losses, each biggest first,
+    and a boolean mask of the lots left over. Everything is ranked when there are no more than 2 * top_n lots
+    """
+
+    n = len(net_change)
+    if not top_n or n <= 2 * top_n:
+        # Biggest gain first, a stable sort keeps ties in the order they were given
+        return np.argsort(-net_change, kind="stable"), None, np.zeros(n, dtype=bool)
+
+    # https://numpy.org/doc/stable/reference/generated/numpy.argpartition.html
+    # Only the top_n at each end are found and sorted, the lots in between stay unsorted
+    gainers = np.argpartition(-net_change, top_n - 1)[:top_n]
+    rest = np.ones(n, dtype=bool)
+    rest[gainers] = False
+    remaining = np.flatnonzero(rest)
+    losers = remaining[np.argpartition(net_change[remaining], top_n - 1)[:top_n]]
+    rest[losers] = False
+
+    gainers = gainers[np.argsort(-net_change[gainers], kind="stable")]
+    losers = losers[np.argsort(-net_change[losers], kind="stable")]
+    return gainers, losers, rest
+
+
+def portfolio_model(symbols, dates, quantities, cost_bases, current_prices, purchase_overall=None, top_n=None):
+    """
+    Computes everything portfolio.html needs from column arrays of lots,
+    cost_bases being quantity * purchase price of each lot.
+    purchase_overall can be passed in when the database has already summed it.
+    With top_n only the top_n biggest gains and losses get a bar of their own,
+    the rest are summed into one 'others' bar
+
+    Returns a dict of:
+    x - the bar elements sorted by $ change, biggest gain first, each with
+        'unique_id', 'flex' (bar size from 0 to 1 relative to the largest gain/loss)
+        and 'contribution' (% contribution to net profit of the portfolio)
+    others - None or the 'count', 'flex', 'contribution' and 'position' (index in x it goes before)
+             of the lots without a bar
+    net_overall, net_overallpercent, current_overall, purchase_overall - the totals
+    top_n - what it was computed with
+    """
+
+    cost_bases = np.asarray(cost_bases, dtype=np.float64)
+
+    # Value today less what was paid to get $ change in value of each lot
+    current_values, net_change = net_changes(quantities, cost_bases, current_prices)
+
+    # Totals
+    current_overall = float(current_values.sum())
+    if purchase_overall is None:
+        purchase_overall = float(cost_bases.sum())
+    net_overall = current_overall - purchase_overall
+    net_overallpercent = round((net_overall / purchase_overall) * 100, 2)
+
+    # Largest gain or loss to use as a parent to scale from,
+    # only the extreme is needed so there's no sort involved
+    magnitude = np.abs(net_change)
+    y = magnitude.max()
+
+    # Flex values from 0 to 1 so each bar's size relative to the parent is the same
+    # as its $ gain/loss relative to the parent. Flex values cannot be negative
+    if y > 0:
+        flex = np.round(magnitude / y, 4)
+    else:
+        flex = np.zeros_like(magnitude)
+
+    # Contribution of each purchase to net profit of the portfolio as a percentage,
+    # net change for the purchase over overall purchase price.
+    # Its sign also separates gain from loss elements in the html
+    contribution = np.round((net_change / purchase_overall) * 100, 2)
+
+    gainers, losers, rest = ranked(net_change, top_n)
+    shown = gainers if losers is None else np.concatenate([gainers, losers])
+
+    # Only the lots with a bar need their ids
+    shown = shown.tolist()
+    ids = unique_ids([symbols[i] for i in shown], [dates[i] for i in shown])
+    flex = flex[shown].tolist()
+    contribution_shown = contribution[shown].tolist()
+
+    x = [{'unique_id': unique_id, 'flex': f, 'contribution': c}
+         for unique_id, f, c in zip(ids, flex, contribution_shown)]
+
+    # The lots in between sit between the gainers and losers as one bar of their summed change,
+    # which can be bigger than the parent
+    others = None
+    if rest.any():
+        others_change = float(net_change[rest].sum())
+        others = {
+            "count": int(rest.sum()),
+            "flex": round(abs(others_change) / float(y), 4) if y > 0 else 0.0,
+            "contribution": round(others_change / purchase_overall * 100, 2),
+            "position": len(gainers),
+        }
+
+    return {
+        "x": x,
+        "others": others,
+        "net_overall": net_overall,
+        "net_overallpercent": net_overallpercent,
+        "current_overall": current_overall,
+        "purchase_overall": purchase_overall,
+        "top_n": top_n,
+    }
+
+
+def others_page(symbols, dates, quantities, cost_bases, current_prices, purchase_overall, top_n, page, per_page):
+    """
+    One page of the lots portfolio_model() put in the 'others' bar, biggest gain first.
+    Returns ([{'unique_id', 'symbol', 'date', 'net_change', 'contribution'}, ...], number of lots in others)
+    """
+
+    _, net_change = net_changes(quantities, cost_bases, current_prices)
+    _, _, rest = ranked(net_change, top_n)
+
+    # Sorting only the others is left to when someone opens them
+    remaining = np.flatnonzero(rest)
+    remaining = remaining[np.argsort(-net_change[remaining], kind="stable")]
+    chosen = remaining[(page - 1) * per_page:page * per_page].tolist()
+
+    ids = unique_ids([symbols[i] for i in chosen], [dates[i] for i in chosen])
+    lots = [{"unique_id": unique_id, "symbol": symbols[i], "date": dates[i].isoformat(),
+             "net_change": round(float(net_change[i]), 2),
+             "contribution": round(float(net_change[i] / purchase_overall * 100), 2)}
+            for unique_id, i in zip(ids, chosen)]
+    return lots, len(remaining)
+
+
+def dashboard_model(portfolio_names, symbols, quantities, cost_bases, prices):
+    """
+    Value, cost basis and profit of every portfolio for the index page, from one row per
+    (portfolio, symbol held) with the symbol None for an empty portfolio.
+    prices is {symbol: price}, a portfolio holding a symbol without a price has no value
+
+    Returns a dict of:
+    portfolios - one dict per portfolio in the order first given with 'name', 'value', 'cost',
+                 'net', 'net_percent' (value and the rest None when it can't be valued) and 'empty'
+    total_value, total_cost, total_net, total_net_percent - over the portfolios that could be valued
+    """
+
+    # https://numpy.org/doc/stable/reference/generated/numpy.unique.html
+    # Each row's portfolio as a number so the sums per portfolio are one bincount each
+    names, first, row_portfolio = np.unique(portfolio_names, return_index=True, return_inverse=True)
+    n = len(names)
+
+    held = np.array([symbol is not None for symbol in symbols], dtype=bool)
+    price = np.array([prices.get(symbol, np.nan) if symbol is not None else 0.0 for symbol in symbols],
+                     dtype=np.float64)
+    quantities = np.array([quantity or 0 for quantity in quantities], dtype=np.float64)
+    cost_bases = np.array([float(cost or 0) for cost in cost_bases], dtype=np.float64)
+
+    values = np.bincount(row_portfolio, weights=quantities * price, minlength=n)
+    costs = np.bincount(row_portfolio, weights=cost_bases, minlength=n)
+    lots = np.bincount(row_portfolio, weights=held, minlength=n)
+
+    # A missing price makes its portfolio's value nan
+    valued = ~np.isnan(values)
+    nets = values - costs
+    percents = np.round(np.divide(nets * 100, costs, out=np.zeros(n), where=costs > 0), 2)
+
+    portfolios = []
+    for i in np.argsort(first, kind="stable").tolist():
+        ok = bool(valued[i])
+        portfolios.append({
+            "name": names[i],
+            "value": float(values[i]) if ok else None,
+            "cost": float(costs[i]),
+            "net": float(nets[i]) if ok else None,
+            "net_percent": float(percents[i]) if ok else None,
+            "empty": lots[i] == 0,
+        })
+
+    total_value = float(values[valued].sum())
+    total_cost = float(costs[valued].sum())
+    total_net = total_value - total_cost
+
+    return {
+        "portfolios": portfolios,
+        "total_value": total_value,
+        "total_cost": total_cost,
+        "total_net": total_net,
+        "total_net_percent": round(total_net / total_cost * 100, 2) if total_cost > 0 else 0.0,
+    }
+
+
+def value_series(symbols, dates, quantities, cost_bases, sessions, closes):
+    """
+    Daily market value and cost basis of a portfolio's lots over sessions, a sorted list of dates.
+    closes is {symbol: {day: close or None}}, days without a close carry the last one forward.
+    Lots count from their purchase date, lots bought before the first session count from it.
+    Returns (market_values, cost_bases) arrays with one entry per session
+    """
+
+    n_days = len(sessions)
+    held = sorted(set(symbols))
+    row_of = {symbol: i for i, symbol in enumerate(held)}
+
+    # One row of closes per symbol, one column per session
+    column_of = {day: j for j, day in enumerate(sessions)}
+    prices = np.full((len(held), n_days), np.nan)
+    for symbol, by_day in closes.items():
+        if symbol not in row_of:
+            continue
+        known = [(column_of[day], close) for day, close in by_day.items() if close is not None and day in column_of]
+        if known:
+            columns, values = zip(*known)
+            prices[row_of[symbol], list(columns)] = values
+
+    # https://stackoverflow.com/a/41191127
+    # Forward fill each row: every column takes the index of the last column with a close,
+    # then a backward fill covers a lot bought before its first stored close
+    columns = np.arange(n_days)
+    last = np.where(np.isnan(prices), 0, columns)
+    np.maximum.accumulate(last, axis=1, out=last)
+    prices = prices[np.arange(len(held))[:, None], last]
+    first = np.where(np.isnan(prices), n_days - 1, columns)
+    first = np.minimum.accumulate(first[:, ::-1], axis=1)[:, ::-1]
+    prices = np.nan_to_num(prices[np.arange(len(held))[:, None], first])
+
+    # Each lot is added on the session it was bought, a running sum along the days gives
+    # the shares of each symbol held and the cost basis on every day
+    day_of = np.searchsorted(np.array(sessions, dtype="datetime64[D]"), np.array(dates, dtype="datetime64[D]"))
+    in_range = day_of < n_days
+    rows = np.array([row_of[symbol] for symbol in symbols], dtype=np.intp)[in_range]
+    day_of = day_of[in_range]
+
+    shares = np.zeros((len(held), n_days))
+    np.add.at(shares, (rows, day_of), np.asarray(quantities, dtype=np.float64)[in_range])
+    np.cumsum(shares, axis=1, out=shares)
+
+    cost = np.zeros(n_days)
+    np.add.at(cost, day_of, np.asarray(cost_bases, dtype=np.float64)[in_range])
+    np.cumsum(cost, out=cost)
+
+    return (shares * prices).sum(axis=0), cost
+
+
+def chart_points(series, width=600, height=200):
+    """
+    Scales one or more equal length series into 'x,y x,y ...' strings for SVG polylines
+    sharing one y axis, y grows downwards in SVG so the largest value is at the top
+    """
+
+    stacked = np.asarray(series, dtype=np.float64)
+    low, high = stacked.min(), stacked.max()
+    span = high - low if high > low else 1.0
+
+    n = stacked.shape[1]
+    xs = np.linspace(0, width, n) if n > 1 else np.array([width / 2])
+    ys = height - (stacked - low) / span * height
+
+    return [" ".join(f"{x:.1f},{y:.1f}" for x, y in zip(xs.tolist(), row.tolist())) for row in ys]
+
+
+def history_model(sessions, market_values, cost_bases):
+    """
+    Computes everything history.html needs from a portfolio's daily series
+
+    Returns a dict of:
+    value_points, cost_points - SVG polyline points of market value and cost basis
+    rows - the last session of every month, newest first, each with
+           'date', 'value', 'cost', 'net' and 'net_percent'
+    start, end - first and last session
+    """
+
+    market_values = np.asarray(market_values, dtype=np.float64)
+    cost_bases = np.asarray(cost_bases, dtype=np.float64)
+    value_points, cost_points = chart_points([market_values, cost_bases])
+
+    # Last session of each month, where the month changes from one session to the next
+    months = np.array(sessions, dtype="datetime64[M]")
+    month_ends = np.flatnonzero(np.append(months[1:] != months[:-1], True))
+
+    net = market_values - cost_bases
+    net_percent = np.round(np.divide(net * 100, cost_bases, out=np.zeros_like(net), where=cost_bases > 0), 2)
+
+    rows = [{"date": sessions[i], "value": market_values[i], "cost": cost_bases[i],
+             "net": net[i], "net_percent": net_percent[i]} for i in month_ends[::-1].tolist()]
+
+    return {
+        "value_points": value_points,
+        "cost_points": cost_points,
+        "rows": rows,
+        "start": sessions[0],
+        "end": sessions[-1],
+    }
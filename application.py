@@ -1,9 +1,30 @@
+import io
 import os
 import re
-
-from flask import Flask, flash, render_template, redirect, request, session
-from flask_session import Session
-from functions import error_page, login_required, lookup, usd, scan, latestprice, db_commit, db_select
+import click
+import queries
+
+from flask import Flask, Response, flash, jsonify, make_response, render_template, redirect, request, session, \
+                  stream_with_context, url_for
+from functions import error_page, login_required, lookup, usd, scan, latestprice, latestprices, db_commit, db_select, \
+                      check_purchase, HISTORY_DAYS
+from db import close_db, remember_writes
+from history import backfill
+from analytics import portfolio_model, history_model, others_page, dashboard_model, PORTFOLIO_TOP_N, \
+                      LOTS_PER_PAGE
+from valuation import portfolio_series
+from snapshots import load_snapshot, build_snapshot, pricing_key, save_model, invalidate
+from migrate import upgrade, check_plans
+from imports import import_trades
+from exports import EXPORT_FORMATS
+from caching import cache_policy, static_url, etag, holdings_etag, not_modified, with_etag
+from quotes import quote_versions, quote_stats, cached_quotes
+from iex import UpstreamUnavailable, QuotaExceeded, get_client
+from quota import set_caller, quota_stats, counters as quota_counters, INTERACTIVE
+from sessions import init_sessions, sweep
+from symbols import get_index, refresh_symbols
+from misses import misses
+from metrics import init_metrics, exposition, authorized
 from werkzeug.security import check_password_hash, generate_password_hash
 from werkzeug.exceptions import default_exceptions, HTTPException, InternalServerError
 from datetime import datetime, date, time, timedelta
@@ -19,33 +40,44 @@ app = Flask(__name__)
 app.config["TEMPLATES_AUTO_RELOAD"] = True
 
 # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-# https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Pragma
-# https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Expires
 # https://flask.palletsprojects.com/en/2.0.x/api/#flask.Flask.after_request
-# Ensure responses aren't cached in the headers of the response after every API request
-# Pragma is deprecated in HTTP 1.1 but used for backwards compatibility with HTTP 1.0
-# Setting value of 0 in expires means everything inside is now considered stale
-@app.after_request
-def after_request(response):
-    response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    response.headers["Expires"] = 0
-    response.headers["Pragma"] = "no-cache"
-    return response
+# Fingerprinted static files are cached for good, portfolio pages are revalidated
+# with ETags and everything else isn't stored, see caching.py
+app.after_request(cache_policy)
 
 # https://stackoverflow.com/questions/3948975/why-store-sessions-on-the-server-instead-of-inside-a-cookie
-# https://flask-session.readthedocs.io/en/latest/#configuration
-
 # We configure session to be non-permanent (default true)
-# Configure session to use filesystem (instead of signed cookies) 
-# Create Session object by passing it the application
+# Sessions are stored in postgres so every dyno and worker shares them,
+# SESSION_BACKEND can switch to signed cookies or the filesystem, see sessions.py
 app.config["SESSION_PERMANENT"] = False
-app.config["SESSION_TYPE"] = "filesystem"
-Session(app)
+init_sessions(app)
+
+# Upstream calls made while serving a page are someone waiting, they come before
+# background refreshes and count towards the user's own share of the IEX quota, see quota.py
+@app.before_request
+def mark_interactive():
+    set_caller(INTERACTIVE, session.get("user_id"))
+
+# Database queries, IEX calls and template renders are timed for each request,
+# sent back in a Server-Timing header and served from /metrics, see metrics.py
+init_metrics(app)
+
+# https://flask.palletsprojects.com/en/2.0.x/appcontext/#storing-data
+# Each request borrows one pooled database connection on its first query,
+# hand it back to the pool once the request is finished
+app.teardown_appcontext(close_db)
+
+# Reads may go to replicas (DATABASE_REPLICA_URLS), a request that wrote something
+# keeps the browser's next few seconds of reads on the primary, see db.py
+app.after_request(remember_writes)
 
 # https://flask.palletsprojects.com/en/2.0.x/templating/#registering-filters
 # This filter is now registered for use in templates
 app.jinja_env.filters["usd"] = usd
 
+# Templates link static files with static_url('styles.css') to get a fingerprinted url
+app.jinja_env.globals["static_url"] = static_url
+
 # https://flask.palletsprojects.com/en/2.0.x/cli/
 # Used while creating offline, now a Heroku config var
 """
@@ -74,8 +106,7 @@ def index():
         if not portfolio_name:
             return error_page("Select a portfolio", 403)
         
-        portfolio = db_select("SELECT portfolio_name FROM shares WHERE id=(%s) AND \
-                            portfolio_name=(%s) GROUP BY portfolio_name;", (id, portfolio_name))
+        portfolio = db_select(queries.PORTFOLIO_HAS_SHARES, (id, portfolio_name))
         
         # If the user clicked a portfolio that has no shares
         if not portfolio:
@@ -87,17 +118,28 @@ def index():
 
     # request.method=="GET"
     else:
-        # Check for any portfolio existing in portfolios table
-        portfolios = db_select("SELECT portfolio_name FROM portfolios WHERE id=(%s);", (id,))
+        # Every portfolio and what it holds in one grouped query however many portfolios there are
+        holdings = db_select(queries.PORTFOLIO_HOLDINGS, (id,))
 
-        # Create boolean variable
-        no_portfolios = False
+        if not holdings:
+            return render_template("index.html", no_portfolios=True)
 
-        if not portfolios:
-            no_portfolios = True
+        # One batched lookup for the symbols held across all portfolios
+        symbols = [row[1] for row in holdings if row[1]]
+        try:
+            prices = {symbol: data["price"] for symbol, data in latestprices(symbols).items()} if symbols else {}
+        except UpstreamUnavailable:
+            # The portfolios are still listed, valued with whatever quotes are cached
+            prices = cached_quotes(symbols)
+
+        # Value, cost basis and profit of each portfolio, see analytics.py
+        model = dashboard_model(portfolio_names=[row[0] for row in holdings],
+                                symbols=[row[1] for row in holdings],
+                                quantities=[row[2] for row in holdings],
+                                cost_bases=[row[3] for row in holdings],
+                                prices=prices)
 
-        return render_template("index.html", portfolios=portfolios, 
-                                no_portfolios=no_portfolios)
+        return render_template("index.html", no_portfolios=False, **model)
 
 @app.route("/register", methods=["GET", "POST"])
 def register():
@@ -245,130 +287,153 @@ def portfolio(portfolio_name):
     """
 
     id = session["user_id"]
-    today = date.today()
 
-    shares = db_select(
-    """
-    SELECT symbol, SUM(purchase_quantity) AS sum_shares, purchase_price, purchase_date
-    FROM shares WHERE id=(%s) AND portfolio_name=(%s)
-    GROUP BY symbol, purchase_price, purchase_date;
-    """, 
-    (id, portfolio_name))
+    # The lots and the last computed page are kept in a snapshot, see snapshots.py
+    snapshot = load_snapshot(id, portfolio_name)
 
-    names = db_select("SELECT portfolio_name FROM portfolios WHERE id=(%s)", (id,))
+    if snapshot is None:
+        names = db_select(queries.PORTFOLIO_NAMES, (id,))
+        if not names:
+            flash("No portfolios detected - you have been redirected here automatically.", "primary")
+            return redirect("/create")
 
-    if not names:
-        flash("No portfolios detected - you have been redirected here automatically.", "primary")
-        return redirect("/create")
-    if not shares:
+    # Built from the shares table the first view after the holdings change
+    elif snapshot["symbols"] is None:
+        snapshot = build_snapshot(id, portfolio_name, snapshot["holdings_version"])
+
+    if not snapshot:
         flash(f"No shares detected in {portfolio_name} - you have been redirected here \
                 automatically.", "primary")
         return redirect("/add")
 
-    # https://blog.scottlogic.com/2020/10/09/charts-with-flexbox.html
-
-    x = []
-
-    # We want percentage and $ value
-    purchase_overall = 0
-    current_overall = 0
-
-    for row in shares:
-
-        date_nospace = row[3].strftime("%Y%m%d")
-        # E.g. AAPL20210808
-        unique_id = row[0] + date_nospace
-        # Unique ID used:
-        # 1. As a href to a share route for a more explicit breakdown
-        # and also the ability to delete this single purchase from their portfolio
-        # 2. As a variable name for session to store current_price rather than calling API again
-        
-        # https://stackoverflow.com/a/27611281
-
-        # Try to see if this variable is in session
-        try:
-            # The data we are using only updates once per day (current price) which is slow enough
-            # to not affect the user when storing and reusing it in session
-            current_price = session[unique_id + '_current']
-        
-        except KeyError:
-            # We are looking up symbols that exist in the database and have been validated before
-            data = latestprice(row[0])
-            # just to be sure
-            if not data:
-                return error_page(f"Symbol: {row[0]} has no latest price data", 403)
-            
-            # Get the latest price cast as float
-            current_price = float(data["price"])
+    # The page only changes when the holdings or the quotes they are priced with change,
+    # if the browser already has this version say so instead of recomputing it
+    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/ETag
+    symbols = snapshot["symbols"]
+    version = snapshot["holdings_version"]
+    priced_with = pricing_key(symbols, quote_versions(symbols))
+    if priced_with:
+        etag = holdings_etag(id, portfolio_name, version, priced_with)
+        if not_modified(etag):
+            return with_etag(make_response("", 304), etag)
 
-            # store in session
-            session[unique_id + '_current'] = current_price
+    # Nothing has moved since the page was last computed
+    model = snapshot["model"]
+    if not (priced_with and snapshot["priced_with"] == priced_with and model.get("top_n") == PORTFOLIO_TOP_N):
 
-        # Cast as float
-        purchase_price = float(row[2])
+        # https://blog.scottlogic.com/2020/10/09/charts-with-flexbox.html
 
-        # (Difference in price) * Quantity
-        # to get $ change in value
-        net_change = (current_price - purchase_price)*row[1]
+        current_prices, missing = lot_prices(symbols)
+        if missing:
+            return error_page(f"Symbol: {missing} has no latest price data", 403)
 
-        # The html will need all of the values in z
-        # the values for 'contribution' and 'flex' are changed further down
+        # The bar elements and totals are computed over columns of the lots, see analytics.py
         # 'flex' is used to give the flex value of each element in the horizontal stacked bar chart
         # 'contribution' is the contribution of that purchase to the whole portfolio as a percentage.
         # It also separates a gain from a loss because flex cannot take negative values
-        
-        z = [{'unique_id': unique_id, 'flex': net_change, 'contribution': net_change}]
+        # Only the prices are new, the quantities and cost bases come from the snapshot.
+        # Past PORTFOLIO_TOP_N gains and losses the lots share one 'others' bar
+        model = portfolio_model(symbols=symbols,
+                                dates=snapshot["dates"],
+                                quantities=snapshot["quantities"],
+                                cost_bases=snapshot["cost_bases"],
+                                current_prices=current_prices,
+                                purchase_overall=snapshot["purchase_overall"],
+                                top_n=PORTFOLIO_TOP_N)
+
+        # Tagged with the quotes it was actually priced with
+        priced_with = pricing_key(symbols, quote_versions(symbols))
+        if priced_with:
+            save_model(portfolio_name, snapshot, priced_with, model)
 
-        x += z
+    # portfolio_name is the argument passed to this route /portfolio/<portfolio_name>
+    response = make_response(render_template("portfolio.html", portfolio_name=portfolio_name, str=str, **model))
 
-        # Totals
-        current_overall += current_price*row[1]
-        purchase_overall += purchase_price*row[1]
+    return with_etag(response, holdings_etag(id, portfolio_name, version, priced_with))
 
-    net_overall = current_overall - purchase_overall
-    net_overallpercent = round((net_overall/purchase_overall)*100, 2)
+def lot_prices(symbols):
+    """
+    Latest price of each of a snapshot's lots, resolved in one batched lookup
+    instead of one request per lot. Returns (prices, None) or (None, a symbol without a price)
+    """
 
-    # https://stackoverflow.com/a/73050
-    # https://stackoverflow.com/a/46013151
-    # Sort x by 'flex' values which is the net_change $ values for now
-    x = sorted(x, key=lambda a: a["flex"], reverse=True)
+    prices = latestprices(symbols)
 
-    # x when sorted 
-    # [{'unique_id': 'a', 'flex': 16 ...}, ... ,'flex': 10, ...},  ..9},  ..5},  ..-14}]
-    
-    # Finding largest element to use as a parent to scale from
-    # must be either the first or the last element of the list when sorted
-    i = len(x) - 1
-    
-    if x[0]["flex"] >= abs(x[i]["flex"]):
-        y = abs(x[0]["flex"])
-    else:
-        y = abs(x[i]["flex"])
+    current_prices = []
+    for symbol in symbols:
+        # We are looking up symbols that exist in the database and have been validated before
+        data = prices.get(symbol)
+        # just to be sure
+        if not data:
+            return None, symbol
+        current_prices.append(data["price"])
+    return current_prices, None
 
-    # Iterate over the list x:
+@app.route("/portfolio/<portfolio_name>/lots")
+@login_required
+def portfolio_lots(portfolio_name):
+    """
+    JSON pages of the purchases in the portfolio page's 'others' bar, biggest gain first,
+    fetched by portfolio.js when the bar is clicked
+    """
 
-    # Prep j['flex'] for our html as a flex value ranging from 0 to 1,
-    # so j's bar size on the page relative to the parent is the same as it's $ gain/loss relative to the parent.
-    # Flex values cannot be negative so make j['flex'] values positive if negative
+    id = session["user_id"]
 
-    # Prep j['contribution'] for our hover animation in css shown on the page.
-    # On hover we want to show the percentage contribution of that share to net profit of the portfolio.
-    # j['contribution'] is also used to differentiate between gain and loss elements.
-    # To get a purchase's contribution to net profit of a portfolio as a percentage:
-    # divide net change for individual purchase over overall purchase price
-    for j in x:
+    try:
+        page = max(int(request.args.get("page", 1)), 1)
+    except ValueError:
+        return jsonify(error="page must be a number"), 400
 
-        j["contribution"] = round((j["contribution"]/purchase_overall)*100, 2)
+    snapshot = load_snapshot(id, portfolio_name)
+    if snapshot is not None and snapshot["symbols"] is None:
+        snapshot = build_snapshot(id, portfolio_name, snapshot["holdings_version"])
+    if not snapshot:
+        return jsonify(error=f"No shares detected in {portfolio_name}"), 404
 
-        if j["flex"] > 0:
-            j["flex"] = round((j["flex"]/y), 4)
-        else:
-            j["flex"] = -1 * round((j["flex"]/y), 4)
+    # portfolio.js reads the error out of the JSON, the app wide handlers would answer with a page
+    try:
+        current_prices, missing = lot_prices(snapshot["symbols"])
+    except QuotaExceeded:
+        return jsonify(error="Too many prices have been looked up recently, please try again in a minute"), 429
+    except UpstreamUnavailable:
+        return jsonify(error="Prices can't be fetched right now, please try again in a minute"), 503
+    if missing:
+        return jsonify(error=f"Symbol: {missing} has no latest price data"), 503
+
+    lots, total = others_page(snapshot["symbols"], snapshot["dates"], snapshot["quantities"],
+                              snapshot["cost_bases"], current_prices, snapshot["purchase_overall"],
+                              PORTFOLIO_TOP_N, page, LOTS_PER_PAGE)
+    for lot in lots:
+        lot["link"] = url_for("share", portfolio_name=portfolio_name, unique_id=lot["unique_id"])
+        lot["net_change_usd"] = usd(lot["net_change"])
+
+    return jsonify(lots=lots, page=page, pages=max(-(-total // LOTS_PER_PAGE), 1), total=total)
+
+@app.route("/portfolio/<portfolio_name>/history")
+@login_required
+def portfolio_history(portfolio_name):
+    """
+    Shows the market value of the portfolio at the close of every trading day
+    since its first purchase, against what was paid for the shares held on that day
+    """
 
-    # portfolio_name is the argument passed to this route /portfolio/<portfolio_name>
-    return render_template("portfolio.html", x=x, portfolio_name=portfolio_name, str=str,
-                            net_overall=net_overall, net_overallpercent=net_overallpercent,
-                            current_overall=current_overall, purchase_overall=purchase_overall)
+    id = session["user_id"]
+
+    shares = db_select(queries.PORTFOLIO_LOTS, (id, portfolio_name))
+    if not shares:
+        flash(f"No shares detected in {portfolio_name} - you have been redirected here \
+                automatically.", "primary")
+        return redirect("/add")
+
+    # The series is stored and only extended by the days closed since the last view, see valuation.py
+    sessions, market_values, cost_bases = portfolio_series(id, portfolio_name,
+                                                           [(row[0], row[1], row[2], row[3]) for row in shares])
+    if not sessions:
+        flash("The history of a portfolio starts once the market has closed on its first purchase.", "primary")
+        return redirect(f"/portfolio/{portfolio_name}")
+
+    return render_template("history.html", portfolio_name=portfolio_name,
+                           **history_model(sessions, market_values, cost_bases))
 
 @app.route("/delete", methods=["GET", "POST"])
 @login_required
@@ -377,7 +442,7 @@ def delete():
 
     id = session["user_id"]
 
-    names = db_select("SELECT portfolio_name FROM portfolios WHERE id = (%s)", (id,))
+    names = db_select(queries.PORTFOLIO_NAMES, (id,))
 
     # User redirected from this page if he has no portfolios to delete
     if not names:
@@ -393,7 +458,8 @@ def delete():
             return error_page("Select the portfolios you want to delete", 403)
 
         # For each selected portfolio, delete the corresponding rows in portfolio
-        # This delete query will cascade to the shares table deleting any row there with this portfolio_name
+        # This delete query will cascade to the shares table deleting any row there with this portfolio_name,
+        # and to its snapshot and history
         for portfolio in portfolios:
             db_commit("DELETE FROM portfolios WHERE id = (%s) AND portfolio_name = (%s)", (id, portfolio))
             flash(f"{portfolio} was successfully deleted!", "success")
@@ -419,9 +485,8 @@ def add():
 
     # https://iexcloud.io/docs/api/#historical-prices
     # Iexcloud API only offers historical data less than 5 years on paid plans
-    # 365 * 5 = 1825
     # https://docs.python.org/3/library/datetime.html#timedelta-objects
-    min_date = today - timedelta(days=1825)
+    min_date = today - timedelta(days=HISTORY_DAYS)
 
     id = session["user_id"]
 
@@ -433,7 +498,13 @@ def add():
 
         if not portfolio_name:
             return error_page("Choose a portfolio to add shares to", 403)
-        
+
+        # The form can be posted with any name, shares can only go in the user's own portfolios
+        rows = db_select("SELECT portfolio_name FROM portfolios WHERE id=(%s) AND portfolio_name=(%s);",
+                         (id, portfolio_name))
+        if not rows:
+            return error_page("Choose one of your portfolios to add shares to", 403)
+
         # Internet explorer doesn't support input="date", degrades to input="text"
         # Native case with input="date"
         # https://stackoverflow.com/questions/10434599/get-the-data-received-in-a-flask-request
@@ -443,50 +514,12 @@ def add():
             # Fallback for Iex browsers
             purchase_date = request.form["fallback_purchasedate"]
 
-        if not purchase_date:
-            return error_page("Enter a date", 403)
-        
-        try:
-            # Convert string input to a date object so we can compare
-            parsed_datetime = datetime.strptime(purchase_date, "%Y-%m-%d")
-            parsed_date = parsed_datetime.date()
-        # Error check mainly for Internet explorer users when having to type a date
-        except ValueError:
-           return error_page("Date input must be valid and YYYY-MM-DD format")
-
-        # Prevent the user from entering a date out of these bounds, today and 5 years ago
-        if parsed_date < min_date:
-            return error_page("This application is limited to only support historical \
-                                price queries up to 5 years (1825 days) past", 403)
-        if parsed_date > today:
-            return error_page("You've entered a date in the future", 403)
-
-        if not symbol:
-            return error_page("Enter a symbol", 403)
-        if not purchase_quantity:
-            return error_page("Enter a quantity", 403)
-
-        # https://pynative.com/python-check-user-input-is-number-or-string/
-        try:
-            # If casting as int fails we get a value error which means 
-            # the input must be a float or a string
-            # No error means the input was an integer or string of an integer
-            val = int(purchase_quantity)
-        except ValueError:
-            try:
-                # cast as float
-                val = float(purchase_quantity)
-                # No error means the input was a float
-                return error_page("Quantity must be an integer", 403)
-            # By elimination the input is a string
-            except ValueError:
-                return error_page("Quantity must be in decimal digits, 403")
-        
-        # convert to int after error checks
-        purchase_quantity = int(purchase_quantity)
+        # The same checks are used for every row of a CSV import
+        error, purchase = check_purchase(symbol, purchase_quantity, purchase_date, today)
+        if error:
+            return error_page(*error)
 
-        if purchase_quantity < 1:
-            return error_page("Quantity must be a non-zero positive number", 403)
+        upper_symbol, purchase_quantity, parsed_date = purchase
 
         # lookup() and scan()'s use here:
         # Checks the symbol exists at IEX, whilst checking there is a price for the 
@@ -494,8 +527,6 @@ def add():
 
         # only call API after all other checks so we are more efficient
 
-        upper_symbol = symbol.upper()
-        
         data = scan(upper_symbol, parsed_date)
 
         if not data:
@@ -518,6 +549,9 @@ def add():
         """,
         (upper_symbol, purchase_quantity, purchase_price, scan_date, portfolio_name, id))
 
+        # The portfolio page is built from the new lots on its next view
+        invalidate(id, [portfolio_name])
+
         flash(f"{purchase_quantity} shares of {upper_symbol} bought on \U0001F4C5 {scan_date}, \
                 saved to {portfolio_name}!", "success")
 
@@ -530,7 +564,7 @@ def add():
 
     # request.method =="GET"
     else:
-        names = db_select("SELECT portfolio_name FROM portfolios WHERE id=(%s)", (id,))
+        names = db_select(queries.PORTFOLIO_NAMES, (id,))
 
         # User restricted from adding shares to portfolios if he has no portfolios
         if not names:
@@ -539,6 +573,66 @@ def add():
         else:
             return render_template("add.html", today=today, min_date=min_date, names=names)
 
+@app.route("/symbols")
+def symbols():
+    """
+    JSON autocomplete of the /add form's symbol box, the symbols starting with ?prefix=
+    and their company names. Answered from the symbol list in memory, see symbols.py
+    """
+
+    prefix = request.args.get("prefix", "").strip().upper()[:10]
+    index = get_index()
+
+    # The same for everyone until the list is next refreshed
+    list_etag = etag("symbols", index.refreshed_at, prefix)
+    if not_modified(list_etag):
+        return with_etag(make_response("", 304), list_etag)
+
+    matches = index.complete(prefix) if prefix else []
+    return with_etag(jsonify(symbols=[{"symbol": symbol, "name": name} for symbol, name in matches]), list_etag)
+
+@app.route("/import", methods=["GET", "POST"])
+@login_required
+def bulk_import():
+    """Add many purchases at once from an uploaded CSV file"""
+
+    id = session["user_id"]
+
+    names = db_select(queries.PORTFOLIO_NAMES, (id,))
+
+    # Purchases can only go into portfolios the user has created
+    if not names:
+        flash("No portfolios detected - you have been redirected here automatically.", "primary")
+        return redirect("/create")
+
+    if request.method == "POST":
+
+        # https://flask.palletsprojects.com/en/2.0.x/patterns/fileuploads/
+        upload = request.files.get("trades")
+
+        if not upload or not upload.filename:
+            return error_page("Choose a CSV file to import", 403)
+
+        # Decode the upload as it is read rather than loading it into memory first
+        # utf-8-sig drops the byte order mark spreadsheet programs add
+        lines = io.TextIOWrapper(upload.stream, encoding="utf-8-sig", newline="")
+
+        try:
+            inserted, errors = import_trades(id, lines, {row[0] for row in names})
+        except UnicodeDecodeError:
+            return error_page("The file must be a CSV saved as UTF-8", 403)
+
+        if inserted:
+            flash(f"{inserted} purchases imported!", "success")
+
+        if not errors:
+            return redirect("/")
+
+        return render_template("import.html", inserted=inserted, errors=errors)
+
+    else:
+        return render_template("import.html")
+
 @app.route("/portfolio/<portfolio_name>/share/<unique_id>", methods=["GET", "POST"])
 @login_required
 def share(portfolio_name, unique_id):
@@ -573,13 +667,7 @@ def share(portfolio_name, unique_id):
     purchase_date = a[1][:4] + '-' + a[1][4:-2] + '-' + a[1][-2:]
 
     # Both Get and post need access to this query
-    rows = db_select("""
-    SELECT symbol, SUM(purchase_quantity), purchase_price, purchase_date
-    FROM shares
-    WHERE id=(%s) AND symbol=(%s) AND purchase_date=(%s) AND portfolio_name=(%s)
-    GROUP BY symbol, purchase_price, purchase_date;
-    """,
-    (id, symbol, date_input, portfolio_name))
+    rows = db_select(queries.SHARE_LOT, (id, symbol, date_input, portfolio_name))
 
     if not rows:
         return error_page(f"{portfolio_name} has no record of \
@@ -597,6 +685,8 @@ def share(portfolio_name, unique_id):
             purchase_price=(%s) AND purchase_date=(%s) AND portfolio_name=(%s);
             """,
             (id, symbol, rows[0][2], date_input, portfolio_name))
+
+            invalidate(id, [portfolio_name])
             
             flash(f"Deleted all {symbol} shares bought on \U0001F4C5 {purchase_date} from \
                     {portfolio_name}!", "success")
@@ -606,22 +696,20 @@ def share(portfolio_name, unique_id):
     # GET    
     else:
         
-        # Try fetch current price from session
-        try:
-            current_price = session[unique_id + '_current']
+        # Same as /portfolio, nothing to recompute if the purchase and its quote haven't changed
+        versions = quote_versions([symbol])
+        if versions:
+            etag = holdings_etag(id, portfolio_name, rows, versions[symbol])
+            if not_modified(etag):
+                return with_etag(make_response("", 304), etag)
 
-        # Doesn't exist in session
-        except KeyError:
-            # Get current price using latestprice()
-            data = latestprice(symbol)
+        # Get current price using latestprice(), shared with the portfolio view through the quote cache
+        data = latestprice(symbol)
 
-            if not data:
-                return error_page(f"Symbol: {symbol} has no latest price data", 403)
-            
-            current_price = float(data["price"])
+        if not data:
+            return error_page(f"Symbol: {symbol} has no latest price data", 403)
 
-            # store current price in session
-            session[unique_id + '_current'] = current_price
+        current_price = float(data["price"])
 
         # Cast as a float to subtract from current_price next line
         purchase_price = float(rows[0][2])
@@ -629,10 +717,10 @@ def share(portfolio_name, unique_id):
         # Net profit for individual purchase
         dollar_change = (current_price - purchase_price) * rows[0][1]
 
-        # Percent Change for individual purchase
-        percent_change = round(dollar_change / (purchase_price * rows[0][1]) * 100, 2)
+        # Percent Change for individual purchase against its cost basis
+        percent_change = round(dollar_change / float(rows[0][4]) * 100, 2)
 
-        return render_template("share.html",
+        response = make_response(render_template("share.html",
                                 symbol=symbol,
                                 purchase_date=purchase_date, 
                                 portfolio_name=portfolio_name,
@@ -641,7 +729,63 @@ def share(portfolio_name, unique_id):
                                 percent_change=percent_change,
                                 current_price=current_price,
                                 purchase_price=purchase_price,
-                                quantity=rows[0][1])
+                                quantity=rows[0][1]))
+
+        versions = quote_versions([symbol])
+        return with_etag(response, holdings_etag(id, portfolio_name, rows, versions.get(symbol)))
+
+def export_response(id, portfolio_name, fmt, filename):
+    """Streams an export of the user's holdings as a file download"""
+
+    if fmt not in EXPORT_FORMATS:
+        return error_page("Exports are available as csv or jsonl", 404)
+
+    generate, mimetype = EXPORT_FORMATS[fmt]
+
+    # https://flask.palletsprojects.com/en/2.0.x/patterns/streaming/
+    # Rows are sent as they are read from the database rather than built up first
+    return Response(stream_with_context(generate(id, portfolio_name)), mimetype=mimetype,
+                    headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'})
+
+@app.route("/portfolio/<portfolio_name>/export.<fmt>")
+@login_required
+def portfolio_export(portfolio_name, fmt):
+    """Download every purchase in a portfolio with current prices"""
+
+    id = session["user_id"]
+
+    names = db_select(queries.PORTFOLIO_NAMES, (id,))
+    if portfolio_name not in [row[0] for row in names]:
+        return error_page(f"You don't have a portfolio called {portfolio_name}", 404)
+
+    return export_response(id, portfolio_name, fmt, portfolio_name)
+
+@app.route("/account/export.<fmt>")
+@login_required
+def account_export(fmt):
+    """Download every purchase in every portfolio of the account with current prices"""
+    return export_response(session["user_id"], None, fmt, "myportfolios")
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus metrics of this worker process"""
+
+    # Not for users, only a scraper given METRICS_TOKEN can read it
+    if not authorized(request):
+        return error_page("Not Found", 404)
+
+    gauges = {}
+    for name, value in quote_stats().items():
+        gauges[f"app_quote_cache_{name}"] = ("Quote cache counter of this process", value)
+    for name, value in get_client().stats().items():
+        gauges[f"app_iex_{name}"] = ("IEX client counter of this process", int(value))
+    for (priority, outcome), count in quota_counters.items():
+        gauges[f"app_iex_quota_{priority}_{outcome}"] = ("IEX quota calls of this process", count)
+    for name, value in misses.stats().items():
+        gauges[f"app_negative_cache_{name}"] = ("Negative cache counter of this process", value)
+    gauges["app_symbols_loaded"] = ("Symbols in this process' symbol list", len(get_index()))
+
+    return Response(exposition(gauges), mimetype="text/plain; version=0.0.4")
 
 @app.route("/account", methods=["GET", "POST"])
 @login_required
@@ -654,7 +798,8 @@ def account():
 
         # Portfolios and shares tables have foreign keys with ON CASCADE DELETE
         # Referencing the users table as the root,
-        # so we can delete all account information with this 1 line query
+        # so we can delete all account information with this 1 line query,
+        # portfolio snapshots and histories included
         db_commit("DELETE FROM users WHERE id=(%s)", (id,))
 
         # session still has a user_id
@@ -665,6 +810,80 @@ def account():
     else:
         return render_template("account.html")
 
+# https://flask.palletsprojects.com/en/2.0.x/cli/#custom-commands
+# Run by Heroku's release phase before each deploy, see Procfile
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations from migrations/"""
+    applied = upgrade()
+    for name in applied:
+        click.echo(f"Applied {name}")
+    if not applied:
+        click.echo("Schema is up to date")
+
+@app.cli.command("check-plans")
+def check_plans_command():
+    """EXPLAIN the hot queries and fail if any of them doesn't use its indexes"""
+    failures = check_plans()
+    for name, problem in failures:
+        click.echo(f"{name}: {problem}", err=True)
+    if failures:
+        raise SystemExit(1)
+    click.echo("Every hot query uses its indexes")
+
+# e.g. flask import-trades james trades.csv
+@app.cli.command("import-trades")
+@click.argument("username")
+@click.argument("csv_file", type=click.File("r", encoding="utf-8-sig"))
+def import_trades_command(username, csv_file):
+    """Import purchases from CSV_FILE (portfolio,symbol,quantity,date) for USERNAME"""
+
+    rows = db_select("SELECT id FROM users WHERE username = (%s);", (username.lower(),))
+    if not rows:
+        raise click.ClickException(f"No user called {username}")
+    id = rows[0][0]
+
+    names = db_select(queries.PORTFOLIO_NAMES, (id,))
+    inserted, errors = import_trades(id, csv_file, {row[0] for row in names})
+
+    for line, message in errors:
+        click.echo(f"line {line}: {message}", err=True)
+    click.echo(f"{inserted} purchases imported, {len(errors)} rows skipped")
+
+# e.g. flask backfill AAPL MSFT AMZN
+@app.cli.command("backfill")
+@click.argument("symbols", nargs=-1, required=True)
+def backfill_command(symbols):
+    """Preload 5 years of daily closes for SYMBOLS into the prices table"""
+    failed = []
+    for symbol, count in backfill(symbols).items():
+        if count is None:
+            failed.append(symbol)
+        else:
+            click.echo(f"{symbol}: {count} closes stored")
+    if failed:
+        raise click.ClickException(f"Couldn't fetch {', '.join(failed)} (IEX unavailable or quota used up), "
+                                   "run again for these later")
+
+@app.cli.command("quota")
+def quota_command():
+    """Show the IEX quota and how much of it has been granted and denied"""
+    for name, value in quota_stats().items():
+        click.echo(f"{name}: {value}")
+
+# The worker refreshes the list daily, this can run from the Heroku scheduler instead
+@app.cli.command("refresh-symbols")
+def refresh_symbols_command():
+    """Fetch the symbols IEX supports into the symbol list /add checks against"""
+    click.echo(f"{refresh_symbols()} symbols stored")
+
+# Expired sessions are also swept as sessions are saved, this can run from the Heroku scheduler
+@app.cli.command("sweep-sessions")
+def sweep_sessions_command():
+    """Delete expired sessions from the sessions table"""
+    sweep()
+    click.echo("Expired sessions deleted")
+
 def errorhandler(e):
     """Handle error"""
     if not isinstance(e, HTTPException):
@@ -673,4 +892,16 @@ def errorhandler(e):
 
 # Listen for errors
 for code in default_exceptions:
-    app.errorhandler(code)(errorhandler)
\ No newline at end of file
+    app.errorhandler(code)(errorhandler)
+
+# https://flask.palletsprojects.com/en/2.0.x/errorhandling/#registering
+# IEX being down is on us not the user, say so with a 503 instead of a "no data" 403
+@app.errorhandler(UpstreamUnavailable)
+def upstream_unavailable(e):
+    """Handle IEX being unavailable"""
+    return error_page("Prices can't be fetched right now, please try again in a minute", 503)
+
+@app.errorhandler(QuotaExceeded)
+def quota_exceeded(e):
+    """Handle the IEX quota running out"""
+    return error_page("Too many prices have been looked up recently, please try again in a minute", 429)
@@ -0,0 +1,146 @@
+"""
+Concurrent users one gunicorn worker can serve in each WORKER_MODE (see gunicorn.conf.py)
+
+    python benchmarks/capacity.py [--modes sync,gevent] [--users 1,2,4,8,16,32] [--requests 20]
+                                  [--latency 0.2] [--slo-ms 1000] [--lots 20] [--keep]
+
+Needs DATABASE_URL pointing at a scratch database that has been migrated (flask migrate),
+and gunicorn (plus gevent and psycogreen for the gevent mode) installed.
+For each mode it starts `gunicorn application:app` with a single worker against the fake IEX,
+then has 1, 2, 4, ... users make requests at once, mostly POST /add of purchases.
+The seeded symbols' quotes and closes are deleted before every step so most requests wait on IEX.
+Reports latency percentiles, throughput and errors for every number of users, and the
+most users a worker served with a p95 under --slo-ms and no errors.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import requests
+import subprocess
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS, "..")
+sys.path.insert(0, ROOT)
+
+import fake_iex
+from load_test import client_loop, percentile, seed
+
+# Weights of each kind of request a user makes
+MIX = [("add", 50), ("portfolio", 30), ("share", 20)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Concurrent user capacity of a worker in each mode")
+    parser.add_argument("--modes", default="sync,gevent", help="WORKER_MODEs to measure, comma separated")
+    parser.add_argument("--users", default="1,2,4,8,16,32", help="concurrent users to try, comma separated")
+    parser.add_argument("--requests", type=int, default=20, help="requests per user at each step")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds each fake IEX response takes")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="p95 a worker must stay under")
+    parser.add_argument("--lots", type=int, default=20, help="lots in each user's portfolio")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=21)
+    parser.add_argument("--keep", action="store_true", help="keep the seeded users afterwards")
+    return parser.parse_args()
+
+
+def start_worker(mode, port, iex_port):
+    """Starts gunicorn with one worker in mode, returns the process once it answers"""
+
+    env = dict(os.environ)
+    env.update({
+        "WORKER_MODE": mode,
+        "WEB_CONCURRENCY": "1",
+        "IEX_BASE_URL": f"http://127.0.0.1:{iex_port}/v1",
+        "IEX_QUOTA_MONTHLY": "0",
+        # Every portfolio view reads the quotes table rather than the worker's own cache
+        "QUOTE_CACHE_SIZE": "0",
+    })
+    env.setdefault("API_KEY", "capacity")
+
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "application:app", "--workers", "1",
+                                "--bind", f"127.0.0.1:{port}", "--log-level", "warning"], cwd=ROOT, env=env)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"gunicorn exited with {process.returncode} in {mode} mode")
+        try:
+            requests.get(f"http://127.0.0.1:{port}/login", timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    sys.exit(f"gunicorn didn't start in {mode} mode")
+
+
+def main():
+    args = parse_args()
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("Set DATABASE_URL to a scratch database that has been migrated")
+
+    from werkzeug.security import generate_password_hash
+    from db import db_commit
+
+    iex_server, fake = fake_iex.serve(latency=args.latency)
+
+    user_counts = [int(users) for users in args.users.split(",")]
+    rng = random.Random(args.seed)
+    symbols = ["".join(letters) for letters in product("ABCDEFGHIJKLMNOPQRSTUVWXY", repeat=3)][:500]
+    seeded = seed(args.lots, max(user_counts), symbols, rng, generate_password_hash("loadtest"))
+
+    print(f"1 worker per mode, {args.requests} requests per user, fake IEX latency {args.latency}s, "
+          f"p95 SLO {args.slo_ms:.0f}ms")
+    print(f"{'mode':<8}{'users':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>8}{'errors':>8}")
+
+    capacity = {}
+    try:
+        for mode in args.modes.split(","):
+            process = start_worker(mode, args.port, iex_server.server_port)
+            base = f"http://127.0.0.1:{args.port}"
+            capacity[mode] = 0
+            try:
+                for users in user_counts:
+                    # Cold quotes and closes at every step so each mode waits on the same IEX calls
+                    db_commit("DELETE FROM quotes WHERE symbol = ANY(%s);", (symbols,))
+                    db_commit("DELETE FROM prices WHERE symbol = ANY(%s);", (symbols,))
+                    db_commit("DELETE FROM price_ranges WHERE symbol = ANY(%s);", (symbols,))
+
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=users) as pool:
+                        futures = [pool.submit(client_loop, base, username, portfolio, unique_ids, symbols,
+                                               args.requests, random.Random(args.seed + i), MIX)
+                                   for i, (username, portfolio, unique_ids) in enumerate(seeded[:users])]
+                        results = [result for future in futures for result in future.result()]
+                    elapsed = time.perf_counter() - started
+
+                    times = sorted(seconds * 1000 for _, seconds, _ in results)
+                    errors = sum(1 for _, _, status in results if status >= 400)
+                    p95 = percentile(times, 95)
+                    print(f"{mode:<8}{users:>6}{percentile(times, 50):>10.1f}{p95:>10.1f}"
+                          f"{percentile(times, 99):>10.1f}{len(results) / elapsed:>8.1f}{errors:>8}")
+
+                    if p95 <= args.slo_ms and not errors:
+                        capacity[mode] = users
+                    else:
+                        # More users only makes it worse
+                        break
+            finally:
+                process.terminate()
+                process.wait()
+
+        for mode, users in capacity.items():
+            print(f"{mode}: {users} concurrent users per worker within a {args.slo_ms:.0f}ms p95")
+    finally:
+        if not args.keep:
+            db_commit("DELETE FROM users WHERE username LIKE 'loadtest_%%';", ())
+        iex_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
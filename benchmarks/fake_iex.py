@@ -0,0 +1,193 @@
+"""
+A stand-in for the IEX Cloud endpoints the app calls, for running and benchmarking it offline
+
+    python benchmarks/fake_iex.py [--port 8765] [--latency 0.05] [--jitter 0.02] [--failure-rate 0] [--rate-limit-rate 0]
+
+then start the app with IEX_BASE_URL=http://127.0.0.1:8765/v1
+
+Serves
+    /v1/stock/{symbol}/quote
+    /v1/stock/market/batch?symbols=A,B&types=quote
+    /v1/stock/{symbol}/chart/{range}?chartCloseOnly=true
+    /v1/stock/{symbol}/chart/date/{YYYYMMDD}
+    /v1/ref-data/symbols
+with prices derived from the symbol and date, so every run sees the same ones.
+Chart ranges are a number of weekday sessions ending yesterday (5d is 5 sessions, 1y is 252)
+rather than calendar days, so like IEX's they can start after the day the app picked them for.
+Symbols starting with ZZ don't exist and get a 404, like a typo would. The symbol list
+has every other combination of 1 to 3 letters and a few real tickers (AAPL, MSFT, ...).
+Every response waits latency +- jitter seconds, failure-rate of them are 500s
+and rate-limit-rate of them are 429s.
+GET /__stats returns the number of calls served, POST /__reset zeroes it.
+"""
+
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# Trading sessions in each range history.CHART_RANGES asks for, ending at the last close like IEX's,
+# so a range can reach back less far than the calendar days the app picked it by
+RANGE_SESSIONS = {"5d": 5, "1m": 21, "3m": 63, "6m": 126, "1y": 252, "2y": 504, "5y": 1260}
+
+
+def price(symbol, day=None):
+    """A stable made up price for symbol on day, today's when day is None"""
+    seed = int(hashlib.md5(symbol.encode()).hexdigest()[:8], 16)
+    base = 20 + seed % 480
+    if day is None:
+        day = date.today()
+    # A slow wave so prices move from day to day
+    wobble = ((day.toordinal() * 7 + seed) % 200 - 100) / 1000
+    return round(base * (1 + wobble), 2)
+
+
+def quote(symbol):
+    """The fields of a /quote response the app reads"""
+    return {"symbol": symbol, "latestPrice": price(symbol), "companyName": f"{symbol} Inc."}
+
+
+def symbol_list():
+    """The fields of a /ref-data/symbols response the app reads, every symbol quote() answers for"""
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    symbols = [a + b + c for a in letters for b in [""] + list(letters) for c in [""] + list(letters)
+               if not (b == "" and c != "")] + ["AAPL", "AMZN", "GOOG", "MSFT", "TSLA"]
+    return [{"symbol": s, "name": f"{s} Inc.", "isEnabled": True} for s in symbols if not s.startswith("ZZ")]
+
+
+def chart(symbol, sessions):
+    """Closes for the last sessions weekdays up to yesterday, oldest first"""
+    bars = []
+    day = date.today() - timedelta(days=1)
+    while len(bars) < sessions:
+        if day.weekday() < 5:
+            bars.append({"date": day.isoformat(), "close": price(symbol, day)})
+        day -= timedelta(days=1)
+    return bars[::-1]
+
+
+class FakeIEX:
+    """Request counters and failure settings shared by every handler thread"""
+
+    def __init__(self, latency=0.05, jitter=0.02, failure_rate=0.0, rate_limit_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def count(self):
+        with self.lock:
+            self.calls += 1
+
+
+def make_handler(fake):
+    """Request handler class serving the endpoints from fake's settings"""
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path == "/__reset":
+                with fake.lock:
+                    fake.calls = 0
+                return self.send_json(200, {"calls": 0})
+            self.send_json(404, {})
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/__stats":
+                with fake.lock:
+                    return self.send_json(200, {"calls": fake.calls})
+
+            fake.count()
+            time.sleep(max(fake.latency + random.uniform(-fake.jitter, fake.jitter), 0))
+
+            roll = random.random()
+            if roll < fake.rate_limit_rate:
+                self.send_response(429)
+                self.send_header("Retry-After", "1")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            if roll < fake.rate_limit_rate + fake.failure_rate:
+                return self.send_json(500, {})
+
+            parts = url.path.strip("/").split("/")
+            query = parse_qs(url.query)
+            if parts == ["v1", "ref-data", "symbols"]:
+                return self.send_json(200, symbol_list())
+
+            # v1 stock ...
+            if len(parts) < 3 or parts[0] != "v1" or parts[1] != "stock":
+                return self.send_json(404, {})
+
+            if parts[2:] == ["market", "batch"]:
+                symbols = [s.upper() for s in query.get("symbols", [""])[0].split(",") if s]
+                return self.send_json(200, {s: {"quote": quote(s)} for s in symbols if not s.startswith("ZZ")})
+
+            symbol = parts[2].upper()
+            if symbol.startswith("ZZ"):
+                return self.send_json(404, "Unknown symbol")
+
+            if parts[3:] == ["quote"]:
+                return self.send_json(200, quote(symbol))
+            if len(parts) == 5 and parts[3] == "chart" and parts[4] in RANGE_SESSIONS:
+                return self.send_json(200, chart(symbol, RANGE_SESSIONS[parts[4]]))
+            if len(parts) == 6 and parts[3:5] == ["chart", "date"]:
+                day = datetime.strptime(parts[5], "%Y%m%d").date()
+                if day.weekday() >= 5:
+                    return self.send_json(200, [])
+                return self.send_json(200, [{"date": day.isoformat(), "close": price(symbol, day)}])
+
+            self.send_json(404, {})
+
+    return Handler
+
+
+def serve(port=0, **settings):
+    """Starts the fake on a background thread, returns (server, fake), server.server_port is the port"""
+    fake = FakeIEX(**settings)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake IEX Cloud server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each response takes")
+    parser.add_argument("--jitter", type=float, default=0.02, help="+- seconds added to the latency")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of responses that are 500s")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="share of responses that are 429s")
+    args = parser.parse_args()
+
+    server, fake = serve(args.port, latency=args.latency, jitter=args.jitter,
+                         failure_rate=args.failure_rate, rate_limit_rate=args.rate_limit_rate)
+    print(f"Fake IEX on http://127.0.0.1:{server.server_port}/v1, Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""
+End to end load test of the app against the fake IEX server
+
+    python benchmarks/load_test.py [--sizes 10,100,1000] [--clients 8] [--requests 100]
+                                   [--latency 0.05] [--failure-rate 0] [--keep]
+
+Needs DATABASE_URL pointing at a scratch database that has been migrated (flask migrate),
+API_KEY and IEX_BASE_URL are set here. For every size it seeds one user per client with
+a portfolio of that many lots, serves the app on a local port and has the clients request
+/, /portfolio/<name>, /portfolio/<name>/share/<id> and POST /add concurrently.
+Reports latency percentiles per route, throughput and the IEX calls made per request.
+The quotes of the seeded symbols are cleared before each size so the first views are cold.
+Seeded users (loadtest_*) are deleted at the end unless --keep is given.
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+import argparse
+import requests
+import threading
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import product
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import fake_iex
+
+# Weights of each kind of request a client makes
+MIX = [("portfolio", 50), ("share", 20), ("index", 20), ("add", 10)]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test the app against a fake IEX")
+    parser.add_argument("--sizes", default="10,100,1000", help="lots per portfolio, comma separated")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="requests per client per size")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds each fake IEX response takes")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of fake IEX responses that are 500s")
+    parser.add_argument("--symbols", type=int, default=500, help="distinct symbols lots are drawn from")
+    parser.add_argument("--seed", type=int, default=50)
+    parser.add_argument("--keep", action="store_true", help="keep the seeded users afterwards")
+    return parser.parse_args()
+
+
+def percentile(values, p):
+    """Nearest rank percentile of a sorted list"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def weekday_between(rng, start, end):
+    """A random weekday from start up to end"""
+    day = start + timedelta(days=rng.randrange((end - start).days))
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+def seed(size, clients, symbols, rng, password_hash):
+    """Creates a user and portfolio of size lots per client, returns [(username, portfolio, [unique_id, ...])]"""
+
+    # Imported once the settings are in place, see main()
+    from db import db_select, db_commit, db_commit_many
+
+    today = date.today()
+    seeded = []
+    for client in range(clients):
+        name = f"loadtest_{size}_{client}"
+        db_commit("DELETE FROM users WHERE username = (%s);", (name,))
+        db_commit("INSERT INTO users (username, password) VALUES (%s, %s);", (name, password_hash))
+        id = db_select("SELECT id FROM users WHERE username = (%s);", (name,))[0][0]
+        db_commit("INSERT INTO portfolios (id, portfolio_name) VALUES (%s, %s);", (id, name))
+
+        rows = []
+        for _ in range(size):
+            symbol = rng.choice(symbols)
+            day = weekday_between(rng, today - timedelta(days=700), today - timedelta(days=1))
+            rows.append((symbol, rng.randint(1, 100), fake_iex.price(symbol, day), day, name, id))
+        db_commit_many("""
+        INSERT INTO shares (symbol, purchase_quantity, purchase_price, purchase_date, portfolio_name, id)
+        VALUES %s;
+        """, rows)
+
+        seeded.append((name, name, [symbol + day.isoformat().replace("-", "") for symbol, _, _, day, _, _ in rows]))
+    return seeded
+
+
+def client_loop(base, username, portfolio, unique_ids, symbols, requests_each, rng, mix=MIX):
+    """Logs in then makes requests_each requests from mix, returns [(route, seconds, status)]"""
+
+    http = requests.Session()
+    http.post(f"{base}/login", data={"username": username, "password": "loadtest"})
+
+    routes = [route for route, weight in mix for _ in range(weight)]
+    today = date.today()
+    results = []
+    for _ in range(requests_each):
+        route = rng.choice(routes)
+        started = time.perf_counter()
+        if route == "portfolio":
+            response = http.get(f"{base}/portfolio/{portfolio}")
+        elif route == "share":
+            response = http.get(f"{base}/portfolio/{portfolio}/share/{rng.choice(unique_ids)}")
+        elif route == "index":
+            response = http.get(f"{base}/")
+        else:
+            day = weekday_between(rng, today - timedelta(days=1500), today - timedelta(days=1))
+            response = http.post(f"{base}/add", data={
+                "portfolio_name": portfolio,
+                "symbol": rng.choice(symbols),
+                "purchase_quantity": str(rng.randint(1, 100)),
+                "purchase_date": day.isoformat(),
+                "submit": "single",
+            }, allow_redirects=False)
+        results.append((route, time.perf_counter() - started, response.status_code))
+    return results
+
+
+def main():
+    args = parse_args()
+    if not os.environ.get("DATABASE_URL"):
+        sys.exit("Set DATABASE_URL to a scratch database that has been migrated")
+
+    iex_server, fake = fake_iex.serve(latency=args.latency, failure_rate=args.failure_rate)
+
+    # Settings have to be in place before the app is imported
+    os.environ.setdefault("API_KEY", "loadtest")
+    os.environ["IEX_BASE_URL"] = f"http://127.0.0.1:{iex_server.server_port}/v1"
+    os.environ["IEX_QUOTA_MONTHLY"] = "0"
+    os.environ.setdefault("DB_POOL_MAX", str(args.clients * 2 + 2))
+
+    from werkzeug.serving import make_server
+    from werkzeug.security import generate_password_hash
+    from application import app
+    from db import db_commit
+    from quotes import quote_cache
+
+    # Only the report is printed, not a line per request
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+
+    rng = random.Random(args.seed)
+    symbols = ["".join(letters) for letters in product("ABCDEFGHIJKLMNOPQRSTUVWXY", repeat=3)][:args.symbols]
+    password_hash = generate_password_hash("loadtest")
+
+    print(f"{args.clients} clients x {args.requests} requests per size, fake IEX latency {args.latency}s, "
+          f"failure rate {args.failure_rate}")
+    print(f"{'lots':>6} {'route':<10}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+
+    try:
+        for size in [int(size) for size in args.sizes.split(",")]:
+            seeded = seed(size, args.clients, symbols, rng, password_hash)
+
+            # Cold quotes for every size
+            db_commit("DELETE FROM quotes WHERE symbol = ANY(%s);", (symbols,))
+            quote_cache.entries.clear()
+
+            calls_before = fake.calls
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.clients) as pool:
+                futures = [pool.submit(client_loop, base, username, portfolio, unique_ids, symbols, args.requests,
+                                       random.Random(args.seed + i))
+                           for i, (username, portfolio, unique_ids) in enumerate(seeded)]
+                results = [result for future in futures for result in future.result()]
+            elapsed = time.perf_counter() - started
+            upstream = fake.calls - calls_before
+
+            by_route = defaultdict(list)
+            errors = defaultdict(int)
+            for route, seconds, status in results:
+                by_route[route].append(seconds * 1000)
+                if status >= 400:
+                    errors[route] += 1
+            for route, _ in MIX:
+                times = sorted(by_route[route])
+                print(f"{size:>6} {route:<10}{len(times):>6}{percentile(times, 50):>10.1f}{percentile(times, 95):>10.1f}"
+                      f"{percentile(times, 99):>10.1f}{errors[route]:>8}")
+            print(f"{size:>6} {'total':<10}{len(results):>6}  {len(results) / elapsed:.1f} req/s, "
+                  f"{upstream / len(results):.3f} IEX calls per request")
+    finally:
+        if not args.keep:
+            db_commit("DELETE FROM users WHERE username LIKE 'loadtest_%%';", ())
+        server.shutdown()
+        iex_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Times the portfolio view's computation over large synthetic portfolios
+
+    python benchmarks/portfolio_analytics.py [lots]
+
+Compares analytics.portfolio_model() against the per-row dict loop
+portfolio() used before, and checks both give the template the same values.
+"""
+
+import os
+import sys
+import random
+
+from datetime import date, timedelta
+from timeit import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from analytics import portfolio_model
+
+
+def legacy_model(symbols, dates, quantities, purchase_prices, current_prices):
+    """The loop portfolio() ran before analytics.py"""
+
+    x = []
+    purchase_overall = 0
+    current_overall = 0
+
+    for symbol, day, quantity, purchase_price, current_price in zip(symbols, dates, quantities,
+                                                                     purchase_prices, current_prices):
+        unique_id = symbol + day.strftime("%Y%m%d")
+        net_change = (current_price - purchase_price) * quantity
+        x += [{'unique_id': unique_id, 'flex': net_change, 'contribution': net_change}]
+        current_overall += current_price * quantity
+        purchase_overall += purchase_price * quantity
+
+    net_overall = current_overall - purchase_overall
+    net_overallpercent = round((net_overall / purchase_overall) * 100, 2)
+
+    x = sorted(x, key=lambda a: a["flex"], reverse=True)
+
+    i = len(x) - 1
+    if x[0]["flex"] >= abs(x[i]["flex"]):
+        y = abs(x[0]["flex"])
+    else:
+        y = abs(x[i]["flex"])
+
+    for j in x:
+        j["contribution"] = round((j["contribution"] / purchase_overall) * 100, 2)
+        if j["flex"] > 0:
+            j["flex"] = round((j["flex"] / y), 4)
+        else:
+            j["flex"] = -1 * round((j["flex"] / y), 4)
+
+    return {
+        "x": x,
+        "net_overall": net_overall,
+        "net_overallpercent": net_overallpercent,
+        "current_overall": current_overall,
+        "purchase_overall": purchase_overall,
+    }
+
+
+def synthetic(lots, seed=50):
+    """Random lots spread over 5 years and a few hundred symbols"""
+    rng = random.Random(seed)
+    today = date.today()
+    symbols = [f"S{rng.randrange(500):03d}" for _ in range(lots)]
+    dates = [today - timedelta(days=rng.randrange(1, 1825)) for _ in range(lots)]
+    quantities = [rng.randrange(1, 500) for _ in range(lots)]
+    purchase_prices = [round(rng.uniform(5, 500), 2) for _ in range(lots)]
+    current_prices = [round(price * rng.uniform(0.3, 3), 2) for price in purchase_prices]
+    return symbols, dates, quantities, purchase_prices, current_prices
+
+
+def close(a, b):
+    return abs(a - b) <= 1e-6 * max(1, abs(a), abs(b))
+
+
+def main():
+    lots = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    columns = synthetic(lots)
+
+    symbols, dates, quantities, purchase_prices, current_prices = columns
+    # The database sums quantity * price for each lot
+    cost_bases = [quantity * price for quantity, price in zip(quantities, purchase_prices)]
+    model_columns = (symbols, dates, quantities, cost_bases, current_prices)
+
+    legacy = legacy_model(*columns)
+    vectorized = portfolio_model(*model_columns)
+
+    for key in ("net_overall", "current_overall", "purchase_overall"):
+        assert close(legacy[key], vectorized[key]), key
+    assert legacy["net_overallpercent"] == vectorized["net_overallpercent"]
+    # Lots with near equal changes can swap places through floating point
+    # differences, so compare each lot's values and the order separately
+    def by_lot(x):
+        return sorted(x, key=lambda j: (j["unique_id"], j["contribution"]))
+
+    assert len(legacy["x"]) == len(vectorized["x"])
+    for a, b in zip(by_lot(legacy["x"]), by_lot(vectorized["x"])):
+        assert a["unique_id"] == b["unique_id"]
+        # Rounding of exact halves can differ in the last place
+        assert abs(a["flex"] - b["flex"]) <= 1e-4 and abs(a["contribution"] - b["contribution"]) <= 1e-2
+    signed = [j["contribution"] for j in vectorized["x"]]
+    assert all(a >= b for a, b in zip(signed, signed[1:]))
+
+    runs = 20
+    legacy_time = timeit(lambda: legacy_model(*columns), number=runs) / runs
+    vectorized_time = timeit(lambda: portfolio_model(*model_columns), number=runs) / runs
+
+    print(f"{lots} lots, mean of {runs} runs")
+    print(f"legacy loop:     {legacy_time * 1000:8.2f} ms")
+    print(f"portfolio_model: {vectorized_time * 1000:8.2f} ms ({legacy_time / vectorized_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Counts the IEX calls scan() needs to price a purchase on every day of a year
+
+    python benchmarks/scan_calls.py [year]
+
+Runs offline, the prices table and IEX are replaced by in-memory versions
+where a symbol has a close on every exchange session.
+For comparison it also counts the calls of the weekday heuristic scan() used
+before the trading calendar, which probed IEX one day at a time.
+"""
+
+import os
+import sys
+
+from collections import Counter
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/benchmark")
+
+import functions
+import history
+
+from trading_calendar import get_calendar
+
+calls = 0
+store = {}
+
+
+def fake_fetch_range(symbol, range_name):
+    """Every session in the range has a close"""
+    global calls
+    calls += 1
+    days = dict(history.CHART_RANGES)[range_name]
+    end = date.today() - timedelta(days=1)
+    sessions = get_calendar(end).sessions_between(end - timedelta(days=days), end)
+    return [(day, 100.0) for day in sessions]
+
+
+def fake_stored_closes(symbol, days):
+    return {day: store[day] for day in days if day in store}
+
+
+def fake_save_range(symbol, closes, start):
+    """Days from start to the last close are known, those without a close are None"""
+    end = max(day for day, _ in closes)
+    day = start
+    while day <= end:
+        store.setdefault(day, None)
+        day += timedelta(days=1)
+    store.update(closes)
+
+
+def legacy_calls(purchase_date, today):
+    """Calls the weekday heuristic made, one per day probed until a session with a close"""
+
+    calendar = get_calendar(purchase_date)
+
+    def has_close(day):
+        return day < today and calendar.is_session(day)
+
+    if today == purchase_date and purchase_date.weekday() == 0:
+        offsets = [-3, -4]
+    elif today == purchase_date and purchase_date.weekday() == 5:
+        offsets = [-1, -2]
+    elif today == purchase_date and purchase_date.weekday() == 6:
+        offsets = [-2, -3]
+    elif purchase_date.weekday() == 5:
+        offsets = [-1, 2]
+    elif purchase_date.weekday() == 6:
+        offsets = [1, -2]
+    else:
+        offsets = [0, -1, 1]
+
+    made = 0
+    for offset in offsets:
+        made += 1
+        if has_close(purchase_date + timedelta(days=offset)):
+            break
+    return made
+
+
+def main():
+    year = int(sys.argv[1]) if len(sys.argv) > 1 else date.today().year - 1
+    today = date.today()
+
+    history.fetch_range = fake_fetch_range
+    history.stored_closes = fake_stored_closes
+    history.save_range = fake_save_range
+
+    global calls
+
+    cold = Counter()
+    legacy = Counter()
+    unpriced = 0
+
+    day = date(year, 1, 1)
+    while day.year == year and day < today:
+        # Cold store, every date on its own
+        store.clear()
+        calls = 0
+        if functions.scan("AAPL", day) is None:
+            unpriced += 1
+        cold[calls] += 1
+        legacy[legacy_calls(day, today)] += 1
+        day += timedelta(days=1)
+
+    # Warm store, dates share what earlier dates fetched
+    store.clear()
+    calls = 0
+    day = date(year, 1, 1)
+    while day.year == year and day < today:
+        functions.scan("AAPL", day)
+        day += timedelta(days=1)
+    warm_calls = calls
+
+    days = sum(cold.values())
+    print(f"{days} input dates in {year}")
+    print(f"weekday heuristic: {sum(k * v for k, v in legacy.items())} calls, per date {dict(sorted(legacy.items()))}")
+    print(f"trading calendar, cold store: {sum(k * v for k, v in cold.items())} calls, per date {dict(sorted(cold.items()))}")
+    print(f"trading calendar, warm store: {warm_calls} calls for the whole year")
+    print(f"dates left without a price: {unpriced}")
+
+
+if __name__ == "__main__":
+    main()
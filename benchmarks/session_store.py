@@ -0,0 +1,108 @@
+"""
+Compares the per-request cost of loading and saving a session with each SESSION_BACKEND
+
+    python benchmarks/session_store.py [requests]
+
+Needs DATABASE_URL pointing at a database that has been migrated (flask migrate).
+Each backend serves a logged in user two kinds of request through a bare Flask app:
+a read, which only looks at user_id like most pages, and a write, which flashes a
+message and shows it on the next request like /add and /delete do.
+A Flask app with no session at all gives the baseline that is subtracted.
+"""
+
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from flask import Flask, flash, get_flashed_messages, session
+from flask.sessions import NullSession, SessionInterface
+from flask_session import Session
+
+import sessions
+
+from db import close_db
+
+
+class NoSession(SessionInterface):
+    """Baseline, the cost of a request with no session work"""
+
+    def open_session(self, app, request):
+        return NullSession({"user_id": 1})
+
+    def save_session(self, app, session, response):
+        pass
+
+
+def make_app(backend):
+    app = Flask(__name__)
+    app.config["SESSION_PERMANENT"] = False
+    app.teardown_appcontext(close_db)
+
+    if backend == "none":
+        app.session_interface = NoSession()
+    elif backend == "filesystem":
+        app.config["SESSION_TYPE"] = "filesystem"
+        app.config["SESSION_FILE_DIR"] = tempfile.mkdtemp()
+        Session(app)
+    elif backend == "postgres":
+        app.session_interface = sessions.PostgresSessionInterface()
+    elif backend == "cookie":
+        app.secret_key = "benchmark"
+        app.session_interface = sessions.CompactCookieSessionInterface()
+
+    @app.route("/login")
+    def login():
+        if backend != "none":
+            session["user_id"] = 1
+        return ""
+
+    @app.route("/read")
+    def read():
+        return str(session["user_id"])
+
+    @app.route("/write")
+    def write():
+        if backend != "none":
+            flash("Added!")
+        return ""
+
+    @app.route("/show")
+    def show():
+        return str(get_flashed_messages())
+
+    return app
+
+
+def per_request(client, paths, n):
+    """Mean milliseconds to serve paths in turn n times"""
+    start = time.perf_counter()
+    for _ in range(n):
+        for path in paths:
+            client.get(path)
+    return (time.perf_counter() - start) * 1000 / (n * len(paths))
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    results = {}
+    for backend in ("none", "filesystem", "postgres", "cookie"):
+        client = make_app(backend).test_client()
+        client.get("/login")
+        # Warm up connections and caches
+        per_request(client, ["/read", "/write", "/show"], 50)
+        results[backend] = (per_request(client, ["/read"], n), per_request(client, ["/write", "/show"], n // 2))
+
+    base_read, base_write = results.pop("none")
+    print(f"{n} requests each, ms per request spent on the session (baseline {base_read:.3f} ms read, "
+          f"{base_write:.3f} ms write removed)")
+    print(f"{'backend':<12}{'read':>10}{'write':>10}")
+    for backend, (read, write) in results.items():
+        print(f"{backend:<12}{read - base_read:>10.3f}{write - base_write:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
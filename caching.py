@@ -0,0 +1,125 @@
+import os
+import hashlib
+
+from flask import current_app, request, session, url_for
+
+# https://developer.mozilla.org/en-US/docs/Web/HTTP/Caching
+# Three policies:
+# 1. Static files are linked with a hash of their contents in the url (?v=...),
+#    the url changes whenever the file does so browsers can keep them forever
+# 2. Portfolio and share pages carry an ETag made from the holdings and the quotes
+#    they were priced with, a browser revalidating gets a 304 without the page being recomputed.
+#    The ETag also covers the release, so after a deploy the page is sent again with the new
+#    templates and fingerprinted static urls instead of a 304 keeping the old ones
+# 3. Every other page depends on the session and isn't stored at all
+
+# A year, the longest max-age browsers honour
+IMMUTABLE = "public, max-age=31536000, immutable"
+
+# Stored by the browser only, checked with the server before every reuse
+REVALIDATE = "private, no-cache"
+
+# Ensure responses aren't cached in the headers of the response
+# Pragma is deprecated in HTTP 1.1 but used for backwards compatibility with HTTP 1.0
+# Setting value of 0 in expires means everything inside is now considered stale
+NO_STORE = "no-cache, no-store, must-revalidate"
+
+# (filename, modified time) -> content hash
+_fingerprints = {}
+
+# https://devcenter.heroku.com/articles/dyno-metadata
+# The commit being run, set on Heroku with dyno metadata enabled. Without it only template
+# and static file changes are told apart
+HEROKU_SLUG_COMMIT = os.environ.get("HEROKU_SLUG_COMMIT", "")
+
+# Hash of the release this process serves, see release()
+_release = None
+
+
+def fingerprint(filename):
+    """Short hash of a static file's contents"""
+
+    path = os.path.join(current_app.static_folder, filename)
+    key = (filename, os.path.getmtime(path))
+
+    if key not in _fingerprints:
+        with open(path, "rb") as f:
+            _fingerprints[key] = hashlib.sha256(f.read()).hexdigest()[:12]
+    return _fingerprints[key]
+
+
+def static_url(filename):
+    """url_for('static') with a content hash, used in templates instead of /static/ paths"""
+    return url_for("static", filename=filename, v=fingerprint(filename))
+
+
+def release():
+    """Short hash of the commit, templates and static files, computed once per process"""
+
+    global _release
+
+    if _release is None:
+        digest = hashlib.sha256(HEROKU_SLUG_COMMIT.encode())
+        template_folder = os.path.join(current_app.root_path, current_app.template_folder)
+        for folder in (template_folder, current_app.static_folder):
+            for root, dirs, files in os.walk(folder):
+                dirs.sort()
+                for filename in sorted(files):
+                    path = os.path.join(root, filename)
+                    digest.update(os.path.relpath(path, folder).encode())
+                    with open(path, "rb") as f:
+                        digest.update(f.read())
+        _release = digest.hexdigest()[:12]
+    return _release
+
+
+def etag(*parts):
+    """Weak ETag value of a response from everything it is made from"""
+    return hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+
+
+def holdings_etag(*parts):
+    """
+    etag() of a page from everything it is rendered from,
+    e.g. the user, the holdings rows and the time each quote was fetched, and the release
+    """
+    return etag(release(), *parts)
+
+
+def not_modified(etag):
+    """
+    True if the browser's copy, identified by If-None-Match, is still current.
+    Pages with flashed messages waiting are always rendered so the messages are shown
+    """
+    if session.get("_flashes"):
+        return False
+    return request.if_none_match.contains_weak(etag)
+
+
+def with_etag(response, etag):
+    """Marks a page as revalidatable with its ETag"""
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = REVALIDATE
+    return response
+
+
+def cache_policy(response):
+    """Sets caching headers on every response, registered with after_request"""
+
+    # https://flask.palletsprojects.com/en/2.0.x/api/#flask.Flask.after_request
+    if request.endpoint == "static":
+        if request.args.get("v"):
+            response.headers["Cache-Control"] = IMMUTABLE
+        else:
+            # Unfingerprinted links are revalidated against the Last-Modified send_file sets
+            response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    # The view has chosen its own policy
+    if response.headers.get("ETag"):
+        return response
+
+    response.headers["Cache-Control"] = NO_STORE
+    response.headers["Expires"] = 0
+    response.headers["Pragma"] = "no-cache"
+    return response
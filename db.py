@@ -0,0 +1,362 @@
+import os
+import time
+import uuid
+import random
+import threading
+import psycopg2
+
+from psycopg2 import pool, extras
+from flask import g, has_app_context, has_request_context, request
+from metrics import timed, query_text
+
+# https://devcenter.heroku.com/articles/heroku-postgresql#connecting-in-python
+# Stored as a heroku config var
+DATABASE_URL = os.environ['DATABASE_URL']
+
+# Heroku Postgres requires SSL, a local development database usually doesn't support it
+DATABASE_SSLMODE = os.environ.get("DATABASE_SSLMODE", "require")
+
+# https://www.psycopg.org/docs/pool.html
+# Opening a connection means a TCP connect, a TLS handshake and authentication
+# which costs more than the queries we run, so every process keeps a small pool
+# of open connections and each request borrows one of them.
+# Bounds are heroku config vars so they can be tuned against the plan's connection limit
+DB_POOL_MIN = int(os.environ.get("DB_POOL_MIN", 1))
+DB_POOL_MAX = int(os.environ.get("DB_POOL_MAX", 5))
+
+# Connections idle for longer than this many seconds are checked
+# with SELECT 1 before being handed out, the server may have dropped them
+DB_POOL_CHECK_AFTER = float(os.environ.get("DB_POOL_CHECK_AFTER", 30))
+
+# Seconds a checkout waits for a connection to be handed back when all DB_POOL_MAX are in use.
+# Under gevent workers (see gunicorn.conf.py) many requests share a process and queue here
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+
+# https://www.postgresql.org/docs/current/hot-standby.html
+# Comma separated urls of read replicas. Inside a request db_select() reads from one of them,
+# picked at random per request, and everything else goes to DATABASE_URL (the primary)
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Seconds a replica that couldn't be reached is left out before it is tried again
+REPLICA_RETRY_AFTER = float(os.environ.get("REPLICA_RETRY_AFTER", 30))
+
+# Replicas apply the primary's changes a moment later. A request that changed the user's data sets
+# a cookie and that browser's reads go to the primary for this many seconds, so e.g. the page
+# redirected to after deleting a purchase doesn't show it again. Writes of cached and derived data
+# (quotes, closes, snapshots) pass sticky=False, a replica a moment behind on those is only a cache miss
+READ_YOUR_WRITES = float(os.environ.get("READ_YOUR_WRITES", 5))
+RECENT_WRITE_COOKIE = "recent_write"
+
+# url -> (ThreadedConnectionPool, a semaphore with one slot per connection the pool can hand out)
+_pools = {}
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+# id(conn) -> url of the pool it came from
+_owners = {}
+
+# id(conn) -> time the connection was last returned to the pool
+_last_used = {}
+
+# replica url -> time.monotonic() it can be tried again
+_replica_down = {}
+
+
+def get_pool(url=DATABASE_URL):
+    """Returns (pool, slots) of url for this process, creating them on first use"""
+
+    global _pool_pid
+
+    # gunicorn forks workers from a parent process, a pool inherited through a fork
+    # shares its sockets with the parent so each process must build its own.
+    # The inherited pools are dropped rather than closed because closing would
+    # terminate the parent's connections on the shared sockets.
+    if url not in _pools or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool_pid != os.getpid():
+                _pools.clear()
+                _owners.clear()
+                _last_used.clear()
+                _replica_down.clear()
+                _pool_pid = os.getpid()
+            if url not in _pools:
+                _pools[url] = (pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, url, sslmode=DATABASE_SSLMODE),
+                               threading.BoundedSemaphore(DB_POOL_MAX))
+    return _pools[url]
+
+
+def healthy(conn):
+    """Checks a pooled connection is still usable before it is handed out"""
+
+    if conn.closed:
+        return False
+
+    # Recently used connections are trusted, only check ones that sat idle
+    if time.monotonic() - _last_used.get(id(conn), 0) < DB_POOL_CHECK_AFTER:
+        return True
+
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1;")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def checkout(url=DATABASE_URL):
+    """Takes a healthy connection from the pool of url, the primary unless given"""
+
+    db_pool, slots = get_pool(url)
+
+    # Opening a new connection, checking an idle one or waiting for one shows up as db_connect
+    with timed("db_connect"):
+        # ThreadedConnectionPool raises once DB_POOL_MAX connections are out,
+        # wait for one to be checked in instead
+        if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+            raise psycopg2.OperationalError("Timed out waiting for a database connection")
+
+        try:
+            # Try a few times, each broken connection is discarded and replaced
+            for _ in range(DB_POOL_MAX + 1):
+                conn = db_pool.getconn()
+                if healthy(conn):
+                    _owners[id(conn)] = url
+                    return conn
+                _last_used.pop(id(conn), None)
+                db_pool.putconn(conn, close=True)
+        except psycopg2.Error:
+            slots.release()
+            raise
+
+    slots.release()
+    raise psycopg2.OperationalError("No healthy database connection available")
+
+
+def checkin(conn):
+    """Returns a connection to the pool it came from, ending any transaction left open"""
+
+    db_pool, slots = get_pool(_owners.pop(id(conn), DATABASE_URL))
+
+    try:
+        # A connection the server closed on us is discarded
+        if conn.closed:
+            _last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+            return
+
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            _last_used.pop(id(conn), None)
+            db_pool.putconn(conn, close=True)
+            return
+
+        _last_used[id(conn)] = time.monotonic()
+        db_pool.putconn(conn)
+    finally:
+        slots.release()
+
+
+def get_db():
+    """
+    Returns the connection for the current request.
+    The first query in a request borrows a connection from the pool
+    and every later query in that request reuses it
+    """
+    if "db_conn" not in g:
+        g.db_conn = checkout()
+    return g.db_conn
+
+
+def reads_from_replica():
+    """True if this request's reads can go to a replica"""
+
+    if not DATABASE_REPLICA_URLS or not has_request_context():
+        return False
+    # It has written, or the browser wrote something a moment ago
+    if g.get("wrote"):
+        return False
+    try:
+        return float(request.cookies.get(RECENT_WRITE_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+
+def get_replica_db():
+    """
+    Returns the replica connection for the current request, borrowed on its first read,
+    or None if no replica can be reached
+    """
+
+    if "replica_conn" in g:
+        return g.replica_conn
+
+    now = time.monotonic()
+    replicas = [url for url in DATABASE_REPLICA_URLS if _replica_down.get(url, 0) <= now]
+    # Spread requests over the replicas
+    random.shuffle(replicas)
+    for url in replicas:
+        try:
+            g.replica_conn = checkout(url)
+            return g.replica_conn
+        except psycopg2.OperationalError:
+            _replica_down[url] = now + REPLICA_RETRY_AFTER
+    return None
+
+
+def replica_failed():
+    """Drops the request's replica connection after an error and leaves its replica out for a while"""
+    conn = g.pop("replica_conn", None)
+    if conn is not None:
+        _replica_down[_owners.get(id(conn), "")] = time.monotonic() + REPLICA_RETRY_AFTER
+        checkin(conn)
+
+
+def close_db(e=None):
+    """Gives the request's connections back to the pool, registered with teardown_appcontext"""
+    for name in ("db_conn", "replica_conn"):
+        conn = g.pop(name, None)
+        if conn is not None:
+            checkin(conn)
+
+
+def remember_writes(response):
+    """after_request, sends the browser of a request that wrote the cookie that keeps its reads on the primary"""
+    if DATABASE_REPLICA_URLS and g.get("wrote"):
+        response.set_cookie(RECENT_WRITE_COOKIE, str(time.time() + READ_YOUR_WRITES),
+                            max_age=int(READ_YOUR_WRITES) + 1, httponly=True, samesite="Lax")
+    return response
+
+
+def acquire(read=False, sticky=True):
+    """
+    Returns (connection, borrowed) where borrowed means the caller must check it back in.
+    Reads inside a request may get a replica connection, sticky writes keep the browser on the primary
+    """
+
+    if read and reads_from_replica():
+        conn = get_replica_db()
+        if conn is not None:
+            return conn, False
+
+    # Inside a request (or flask cli command) share the request's connection
+    if has_app_context():
+        if not read and sticky:
+            # Later reads in this request and the browser's next requests go to the primary
+            g.wrote = True
+        return get_db(), False
+    # Outside of flask e.g. scripts, borrow a connection for just this query
+    return checkout(), True
+
+# https://www.psycopg.org/docs/usage.html
+# https://www.freecodecamp.org/news/connect-python-with-sql/
+
+def db_select(query, data, primary=False):
+    """
+    Executes a SELECT query on a pooled connection and returns all rows.
+    Inside a request it reads from a replica when there is one, unless primary is True
+    """
+
+    # Reading from the primary isn't a write, it doesn't keep the browser there
+    conn, borrowed = acquire(read=not primary, sticky=False)
+    try:
+        with timed("db", query_text(query)):
+            # Open a cursor
+            cur = conn.cursor()
+            # Execute SELECT query
+            cur.execute(query, data)
+            # Store the results
+            results = cur.fetchall()
+            cur.close()
+    except psycopg2.Error as e:
+        # The replica went away, read from the primary instead.
+        # Errors the server reports carry a SQLSTATE, a lost connection doesn't
+        if not primary and has_app_context() and g.get("replica_conn") is conn \
+                and (conn.closed or e.pgcode is None):
+            replica_failed()
+            return db_select(query, data, primary=True)
+        # Leave the connection usable for the rest of the request,
+        # a connection the server closed can't be rolled back and is discarded on checkin
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if borrowed:
+            checkin(conn)
+    # Return the results of the query that was called with db_select()
+    return results
+
+
+def db_commit(query, data, sticky=True):
+    """
+    Executes a query on a pooled connection and commits the changes
+    does not return any results.
+    sticky=False for cache writes that shouldn't keep the browser's reads on the primary
+    """
+
+    conn, borrowed = acquire(sticky=sticky)
+    try:
+        with timed("db", query_text(query)):
+            cur = conn.cursor()
+            cur.execute(query, data)
+            # commit changes made from the query (insert, update, delete)
+            conn.commit()
+            cur.close()
+    except psycopg2.Error:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if borrowed:
+            checkin(conn)
+
+
+def db_commit_many(query, rows, page_size=500, sticky=True):
+    """
+    Executes an INSERT ... VALUES %s query for many rows with multi-row
+    statements of page_size rows each and commits them as one transaction.
+    sticky as for db_commit()
+    """
+
+    # https://www.psycopg.org/docs/extras.html#psycopg2.extras.execute_values
+    conn, borrowed = acquire(sticky=sticky)
+    try:
+        with timed("db", query_text(query)):
+            cur = conn.cursor()
+            extras.execute_values(cur, query, rows, page_size=page_size)
+            conn.commit()
+            cur.close()
+    except psycopg2.Error:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        if borrowed:
+            checkin(conn)
+
+
+def db_stream(query, data, batch_size=1000):
+    """
+    Yields the rows of a SELECT query batch_size at a time from a named server-side cursor,
+    so only one batch is held in memory however many rows the query returns
+    """
+
+    # https://www.psycopg.org/docs/usage.html#server-side-cursors
+    # The cursor lives in a transaction on its own pooled connection,
+    # anything committed on the request's connection would close it
+    conn = checkout()
+    try:
+        cur = conn.cursor(name=f"stream_{uuid.uuid4().hex}")
+        cur.itersize = batch_size
+        cur.execute(query, data)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+        cur.close()
+    finally:
+        # Also runs when the client goes away part way and the generator is closed
+        checkin(conn)
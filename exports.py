@@ -0,0 +1,96 @@
+import io
+import csv
+import json
+
+from db import db_select, db_stream
+from functions import latestprices
+from iex import UpstreamUnavailable
+
+# Holdings are streamed out a batch of rows at a time straight from a server-side cursor,
+# so memory stays flat however large the account is.
+# The first four columns match the CSV import so an export can be imported again
+
+EXPORT_COLUMNS = ("portfolio", "symbol", "quantity", "date", "purchase_price", "current_price", "current_value")
+
+# Rows fetched from the database per batch
+EXPORT_BATCH_SIZE = 1000
+
+# Ordered the same way as the shares_owner_portfolio index so no sort is needed
+EXPORT_LOTS = """
+SELECT portfolio_name, symbol, purchase_quantity, purchase_date, purchase_price
+FROM shares WHERE id=(%s) {portfolio_filter}
+ORDER BY portfolio_name, symbol, purchase_date;
+"""
+
+EXPORT_SYMBOLS = """
+SELECT DISTINCT symbol FROM shares WHERE id=(%s) {portfolio_filter};
+"""
+
+
+def export_query(template, id, portfolio_name):
+    """Fills in the optional portfolio filter, returns (query, data)"""
+    if portfolio_name is None:
+        return template.format(portfolio_filter=""), (id,)
+    return template.format(portfolio_filter="AND portfolio_name=(%s)"), (id, portfolio_name)
+
+
+def export_records(id, portfolio_name=None):
+    """Yields batches of export records (dicts) for a user's holdings, one portfolio or all of them"""
+
+    # Current prices of every symbol held come from one batched quote lookup up front
+    # instead of one per row while streaming
+    query, data = export_query(EXPORT_SYMBOLS, id, portfolio_name)
+    try:
+        prices = latestprices([row[0] for row in db_select(query, data)])
+    except UpstreamUnavailable:
+        # The download has already started, it goes out without current prices instead of cut short
+        prices = {}
+
+    query, data = export_query(EXPORT_LOTS, id, portfolio_name)
+    for rows in db_stream(query, data, EXPORT_BATCH_SIZE):
+        batch = []
+        for portfolio, symbol, quantity, purchase_date, purchase_price in rows:
+            current_price = prices[symbol]["price"] if symbol in prices else None
+            batch.append({
+                "portfolio": portfolio,
+                "symbol": symbol,
+                "quantity": quantity,
+                "date": purchase_date.isoformat(),
+                "purchase_price": float(purchase_price),
+                "current_price": current_price,
+                "current_value": None if current_price is None else round(current_price * quantity, 2),
+            })
+        yield batch
+
+
+def export_csv(id, portfolio_name=None):
+    """Yields the export as chunks of CSV text, one chunk per batch"""
+
+    # https://docs.python.org/3/library/csv.html#csv.DictWriter
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    for batch in export_records(id, portfolio_name):
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # Header only when there are no holdings
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def export_jsonl(id, portfolio_name=None):
+    """Yields the export as JSON lines, one object per purchase, one chunk per batch"""
+    # https://jsonlines.org/
+    for batch in export_records(id, portfolio_name):
+        yield "".join(json.dumps(record) + "\n" for record in batch)
+
+
+# format -> (generator, mimetype)
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv"),
+    "jsonl": (export_jsonl, "application/x-ndjson"),
+}
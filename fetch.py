@@ -0,0 +1,67 @@
+import os
+import threading
+import contextvars
+
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# https://docs.python.org/3/library/concurrent.futures.html#threadpoolexecutor
+# Upstream calls spend nearly all their time waiting on the network,
+# so independent calls run side by side on a small pool of threads and a request
+# waits as long as its slowest call instead of the sum of all of them
+
+# Threads per process shared by every request
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", 8))
+
+# https://requests.readthedocs.io/en/latest/user/advanced/#timeouts
+# (connect, read) seconds for a single upstream request
+REQUEST_TIMEOUT = (float(os.environ.get("CONNECT_TIMEOUT", 3.05)),
+                   float(os.environ.get("READ_TIMEOUT", 10)))
+
+# Seconds a request waits for a group of concurrent calls before giving up on them
+FETCH_TIMEOUT = float(os.environ.get("FETCH_TIMEOUT", 15))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Returns this process' thread pool, threads don't survive a gunicorn fork so it is rebuilt after one"""
+
+    global _executor, _executor_pid
+
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+def submit(fn, *args):
+    """Runs fn(*args) on the pool, carrying over the caller's context variables"""
+    # https://docs.python.org/3/library/contextvars.html#contextvars.copy_context
+    context = contextvars.copy_context()
+    return get_executor().submit(context.run, fn, *args)
+
+
+def gather(calls, timeout=FETCH_TIMEOUT):
+    """
+    Runs every (fn, args) in calls concurrently
+    Returns their results in the same order, None for calls that failed or didn't finish in time
+    """
+
+    futures = [submit(fn, *args) for fn, args in calls]
+    done, not_done = wait(futures, timeout=timeout)
+
+    # Anything not started yet is dropped, anything running is left to finish on its own
+    for future in not_done:
+        future.cancel()
+
+    results = []
+    for future in futures:
+        if future in done and future.exception() is None:
+            results.append(future.result())
+        else:
+            results.append(None)
+    return results
@@ -1,168 +1,186 @@
-import os
-import requests
-import psycopg2
 import urllib.parse
 
 from flask import redirect, session, render_template 
 from functools import wraps
 from datetime import time, timedelta, datetime, date
+# Database helpers live in db.py, imported here so routes can keep
+# importing everything they need from functions
+from db import db_select, db_commit
+from fetch import gather
+from iex import iex_get, UpstreamUnavailable
+from history import closes, closes_available
+from trading_calendar import get_calendar
+from quotes import cached_quote, cached_quotes, store_quote, store_quotes
+from symbols import known_symbol
+from misses import misses, MISSING, FAILED
 
 def error_page(message, code=400):
     """Returns a message on the error and what the user should do"""
     return render_template("error_page.html", code=code, message=message), code
 
-# https://devcenter.heroku.com/articles/heroku-postgresql#connecting-in-python
-# Stored as a heroku config var
-DATABASE_URL = os.environ['DATABASE_URL']
+# https://iexcloud.io/docs/api/#historical-prices
+# Iexcloud API only offers historical data less than 5 years on paid plans
+# 365 * 5 = 1825
+HISTORY_DAYS = 1825
 
-# https://www.psycopg.org/docs/usage.html
-# https://www.freecodecamp.org/news/connect-python-with-sql/
-
-def db_select(query, data):
-    """Connects to the database using config.py and executes a SELECT query"""
-    
-    # Open connection
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-    # Open a cursor
-    cur = conn.cursor()
-    # Execute SELECT query
-    cur.execute(query, data)
-    # Store the results
-    results = cur.fetchall()
-    # Close the cursor and the connection
-    cur.close()
-    conn.close()
-    # Return the results of the query that was called with db_select()
-    return results
-
-def db_commit(query, data):
+def check_purchase(symbol, purchase_quantity, purchase_date, today):
     """
-    Connects to the database using config.py, executes a query
-    and commits the changes
-    does not return any results 
+    Validates a purchase the way /add does, before any prices are looked up
+    Returns (error, None) where error is (message, code) for error_page
+    or (None, (upper_symbol, quantity, parsed_date)) if the purchase is valid
     """
 
-    conn = psycopg2.connect(DATABASE_URL, sslmode='require')
-    cur = conn.cursor()
-    cur.execute(query, data)
-    # commit changes made from the query (insert, update, delete)
-    conn.commit()
-    cur.close()
-    conn.close()
+    if not purchase_date:
+        return ("Enter a date", 403), None
+
+    try:
+        # Convert string input to a date object so we can compare
+        parsed_date = datetime.strptime(purchase_date, "%Y-%m-%d").date()
+    # Error check mainly for Internet explorer users when having to type a date
+    except ValueError:
+        return ("Date input must be valid and YYYY-MM-DD format", 400), None
+
+    # Prevent the user from entering a date out of these bounds, today and 5 years ago
+    # https://docs.python.org/3/library/datetime.html#timedelta-objects
+    if parsed_date < today - timedelta(days=HISTORY_DAYS):
+        return ("This application is limited to only support historical \
+                price queries up to 5 years (1825 days) past", 403), None
+    if parsed_date > today:
+        return ("You've entered a date in the future", 403), None
+
+    if not symbol:
+        return ("Enter a symbol", 403), None
+    if not purchase_quantity:
+        return ("Enter a quantity", 403), None
+
+    # https://pynative.com/python-check-user-input-is-number-or-string/
+    try:
+        # If casting as int fails we get a value error which means 
+        # the input must be a float or a string
+        # No error means the input was an integer or string of an integer
+        quantity = int(purchase_quantity)
+    except ValueError:
+        try:
+            # cast as float
+            float(purchase_quantity)
+            # No error means the input was a float
+            return ("Quantity must be an integer", 403), None
+        # By elimination the input is a string
+        except ValueError:
+            return ("Quantity must be in decimal digits", 403), None
+
+    if quantity < 1:
+        return ("Quantity must be a non-zero positive number", 403), None
+
+    # A typo is caught against the symbol list in memory instead of costing an IEX call, see symbols.py
+    if not known_symbol(symbol.upper()):
+        return (f"Unknown symbol {symbol.upper()}, please refer to the link for supported symbols", 403), None
+
+    return None, (symbol.upper(), quantity, parsed_date)
 
 def lookup(symbol, date_input):
     """Looks up a symbol on date given"""
 
-    # Contact API
-    try:
-        # https://stackoverflow.com/a/16511493
-        # https://iexcloud.io/docs/api/
-        api_key = os.environ.get("API_KEY")
-        frmt_date = date_input.strftime("%Y%m%d")
-        response = requests.get(f"https://cloud.iexapis.com/v1/stock/{urllib.parse.quote_plus(symbol)}/chart/date/{frmt_date}?token={api_key}&chartByDay=true")
-        response.raise_for_status()
-    except requests.RequestException:
-        return None
+    # Historical closes are read through the local prices table,
+    # IEX is only contacted for dates that haven't been fetched before
+    # https://iexcloud.io/docs/api/
+    price = closes(symbol, [date_input]).get(date_input)
 
-    # Parse response into a json object only extracting the information we need
-    # Response is returning [{ , , , }] instead of { , , , }
-    try:
-        quote = response.json()
-        return {
-            "price": float(quote[0]["close"]),
-            "symbol": quote[0]["symbol"],
-        }
     # Error check so we can return none to the user and display
     # error page if something went wrong
-    except (KeyError, TypeError, ValueError, IndexError):
+    if price is None:
         return None
 
-def scan(symbol, date_input):
-    """Scans nearest days using lookup() for a purchase price"""
+    return {
+        "price": price,
+        "symbol": symbol.upper(),
+    }
+
+def scan_candidates(purchase_date, todays_date):
+    """Sessions whose close can price a purchase on purchase_date, most preferred first"""
 
     # IEX doesn't store historical price info of the current day 
     # or weekends/holidays when exchanges are closed
 
-    todays_date = date.today()
-    purchase_date = date_input
-    
-    # 3 Edge cases
-    # User inputting he bought shares on:
-    
-    # Monday which is today
-    if todays_date == purchase_date and purchase_date.weekday() == 0:
-        # call lookup using the previous Friday
-        scan_date = purchase_date - timedelta(days=3)
-        data = lookup(symbol, scan_date)
-        if not data:
-            # Thursday
-            scan_date = pruchase_date - timedelta(days=1)
-            data = data = lookup(symbol, scan_date)
-    
-    # Saturday which is today
-    if todays_date == purchase_date and purchase_date.weekday() == 6:
-        # Friday
-        scan_date = purchase_date - timedelta(days=1)
-        data = lookup(symbol, scan_date)
-        if not data:
-            # Thursday
-            scan_date = pruchase_date - timedelta(days=2)
-            data = data = lookup(symbol, scan_date)
-    
-    # Sunday which is today
-    if todays_date == purchase_date and purchase_date.weekday() == 5:
-        # Friday
-        scan_date = purchase_date - timedelta(days=2)
-        data = lookup(symbol, scan_date)
-        if not data:
-            # Thursday
-            scan_date = pruchase_date - timedelta(days=3)
-            data = data = lookup(symbol, scan_date)
-
-    # For weekends, lookup the nearest weekday
-
-    # Saturday
-    elif purchase_date.weekday() == 5:
-        scan_date = purchase_date - timedelta(days=1)
-        data = lookup(symbol, scan_date)
-        if not data:
-            scan_date = purchase_date + timedelta(days=3)
-            data = lookup(symbol, scan_date)
-    
-    # Sunday
-    elif purchase_date.weekday() == 6:
-        scan_date = purchase_date + timedelta(days=1)
-        data = lookup(symbol, scan_date)
-        if not data:
-            scan_date = purchase_date - timedelta(days=3)
-            data = lookup(symbol, scan_date)
-    
-    # Monday to Friday
-    # There's a tradeoff between accomodating the user and number of API calls
-    # It's not efficient to have lots of API calls with alot of users
+    # The exchange calendar knows every trading session,
+    # so the nearest one is found without asking IEX
+    calendar = get_calendar(purchase_date)
+
+    # The latest session with a close is the last one before today
+    last_session = calendar.session_on_or_before(todays_date - timedelta(days=1))
+
+    if purchase_date > last_session:
+        # Today or the weekend/holiday just gone, e.g. a Saturday which is today
+        candidates = [last_session]
+
+    elif calendar.is_session(purchase_date):
+        candidates = [purchase_date]
+
     else:
-        # lookup using the date entered
-        data = lookup(symbol, purchase_date)
-        scan_date = purchase_date
-        if not data:
-            # lookup 1 day before date input
-            scan_date = purchase_date - timedelta(days=1)
-            data = lookup(symbol, scan_date)
-            if not data:
-                # lookup 1 day after date input
-                scan_date = purchase_date + timedelta(days=2)
-                data = lookup(symbol, scan_date)
+        # Weekends and holidays, the nearest session either side
+        # with the closest first and the one before winning ties
+        before = calendar.session_on_or_before(purchase_date)
+        after = calendar.session_on_or_after(purchase_date)
+        if (after - purchase_date) < (purchase_date - before):
+            candidates = [after, before]
+        else:
+            candidates = [before, after]
 
-    try:
-        return {
-            "price": data["price"],
-            "symbol": data["symbol"],
-            "date": scan_date
-        }
-    # Error check so we can return none to the user and display
-    # error page if something went wrong
-    except (KeyError, TypeError, ValueError, IndexError):
-        return None
+    # The session after can't be used until it has a close
+    return [candidate for candidate in candidates if candidate <= last_session]
+
+def scan(symbol, date_input):
+    """Scans nearest days in the historical price store for a purchase price"""
+    return scan_many([(symbol, date_input)])[(symbol.upper(), date_input)]
+
+def scan_many(purchases):
+    """
+    scan() for many (symbol, date) purchases at once
+    Returns {(symbol, date): {"price": , "symbol": , "date": } or None}
+    Raises UpstreamUnavailable if some symbols couldn't be fetched
+    """
+
+    results, failed = scan_available(purchases)
+    if failed:
+        raise UpstreamUnavailable(f"Closes of {len(failed)} symbols couldn't be fetched")
+    return results
+
+def scan_available(purchases):
+    """
+    scan_many() that carries on past symbols IEX couldn't be asked about, for imports.
+    Returns (results as scan_many() does, {symbols that couldn't be fetched})
+    """
+
+    todays_date = date.today()
+
+    # Deduplicate, many purchases can share a symbol and date
+    purchases = {(symbol.upper(), purchase_date) for symbol, purchase_date in purchases}
+
+    candidates = {}
+    wanted = {}
+    for symbol, purchase_date in purchases:
+        candidates[(symbol, purchase_date)] = scan_candidates(purchase_date, todays_date)
+        wanted.setdefault(symbol, set()).update(candidates[(symbol, purchase_date)])
+
+    # Every candidate of a symbol is read from the prices table with one query,
+    # any not stored yet are fetched together in a single range request
+    # so this costs at most one upstream call per symbol
+    found, failed = closes_available(wanted)
+
+    results = {}
+    for (symbol, purchase_date), days in candidates.items():
+        results[(symbol, purchase_date)] = None
+        for candidate in days:
+            if found[symbol].get(candidate) is not None:
+                results[(symbol, purchase_date)] = {
+                    "price": found[symbol][candidate],
+                    "symbol": symbol,
+                    "date": candidate
+                }
+                break
+
+    # None lets the caller display an error page if something went wrong
+    return results, failed
 
 # Since my application depended on calling scan
 # Things like /portfolio broke when scan failed to get a current price
@@ -176,24 +194,128 @@ def scan(symbol, date_input):
 
 def latestprice(symbol):
     """Gets the latest close price without needing a date input"""
+
+    # Every user holding this symbol shares the same cached price
+    price = cached_quote(symbol)
+    if price is not None:
+        return {
+            "price": price,
+            "symbol": symbol.upper()
+        }
     
+    # A symbol IEX had no quote for, or couldn't be asked about, a moment ago gets the same answer, see misses.py
+    key = ("quote", symbol.upper())
+    miss = misses.get(key)
+    if miss is not None:
+        misses.avoided("quote", miss[0])
+        if miss[0] == FAILED:
+            raise UpstreamUnavailable(f"The quote of {symbol} failed to fetch recently")
+        return None
+
     # https://iexcloud.io/docs/api/
+    # Raises UpstreamUnavailable if IEX can't answer, None means it has no quote for the symbol
     try:
-        api_key = os.environ.get("API_KEY")
-        response = requests.get(f"https://cloud.iexapis.com/v1/stock/{urllib.parse.quote_plus(symbol)}/quote?token={api_key}")
-        response.raise_for_status()
-    except requests.RequestException:
-        return None
-    
+        quote = iex_get(f"/stock/{urllib.parse.quote_plus(symbol)}/quote")
+    except UpstreamUnavailable:
+        misses.put(key, FAILED)
+        raise
+
     try:
-        quote = response.json()
-        return {
-            "price": float(quote["latestPrice"]),
-            "symbol": quote["symbol"]
-        }
+        price = float(quote["latestPrice"])
+        symbol = quote["symbol"]
     except (KeyError, TypeError, ValueError):
+        misses.put(key, MISSING)
         return None
 
+    store_quote(symbol, price)
+    return {
+        "price": price,
+        "symbol": symbol
+    }
+
+# https://iexcloud.io/docs/api/#batch-requests
+# The batch endpoint returns quotes for up to 100 symbols in one request
+BATCH_SIZE = 100
+
+def batch_quotes(symbols):
+    """Fetches the latest prices of up to BATCH_SIZE symbols in one request, returns {symbol: price}"""
+
+    # Charged per symbol
+    batch = iex_get("/stock/market/batch", {"symbols": ",".join(symbols), "types": "quote"}, cost=len(symbols))
+    if batch is None:
+        return {}
+
+    # Response is {"AAPL": {"quote": { , , , }}, ...}
+    prices = {}
+    for symbol in symbols:
+        try:
+            prices[symbol] = float(batch[symbol]["quote"]["latestPrice"])
+        except (KeyError, TypeError, ValueError):
+            continue
+    return prices
+
+def refresh_quotes(symbols):
+    """
+    Fetches the latest prices of any number of symbols from IEX and stores them, returns {symbol: price}.
+    Raises UpstreamUnavailable if some of them couldn't be fetched, once the rest are stored
+    """
+
+    # Symbols that missed a moment ago aren't asked for again, see misses.py
+    symbols = list(symbols)
+    recently_failed = 0
+    wanted = []
+    for symbol in symbols:
+        miss = misses.get(("quote", symbol))
+        if miss is None:
+            wanted.append(symbol)
+        elif miss[0] == FAILED:
+            recently_failed += 1
+
+    # Chunk into requests of at most BATCH_SIZE symbols, fetched concurrently
+    chunks = [wanted[i:i + BATCH_SIZE] for i in range(0, len(wanted), BATCH_SIZE)]
+
+    # Batches that would have been sent for the symbols left out
+    skipped = -(-len(symbols) // BATCH_SIZE) - len(chunks)
+    if skipped:
+        misses.avoided("quote", FAILED if recently_failed else MISSING, skipped)
+
+    fetched = {}
+    failed = 0
+    # A chunk is None when IEX was unavailable or didn't answer in time
+    for chunk, batch in zip(chunks, gather([(batch_quotes, (chunk,)) for chunk in chunks])):
+        if batch is None:
+            failed += 1
+        else:
+            fetched.update(batch)
+        # The batch leaves out symbols it has no quote for
+        for symbol in chunk:
+            if symbol not in fetched:
+                misses.put(("quote", symbol), FAILED if batch is None else MISSING)
+
+    store_quotes(fetched)
+
+    if failed or recently_failed:
+        raise UpstreamUnavailable(f"Latest prices of {failed} of {len(chunks)} batches couldn't be fetched, "
+                                  f"{recently_failed} symbols failed recently")
+    return fetched
+
+def latestprices(symbols):
+    """
+    Gets the latest prices of many symbols at once
+    Returns {symbol: {"price": , "symbol": }} for every symbol a price was found for.
+    Raises UpstreamUnavailable if IEX couldn't be asked for the ones that aren't cached
+    """
+
+    # Deduplicate, a portfolio can hold many lots of the same symbol
+    symbols = sorted({symbol.upper() for symbol in symbols})
+
+    prices = cached_quotes(symbols)
+    missing = [symbol for symbol in symbols if symbol not in prices]
+
+    prices.update(refresh_quotes(missing))
+
+    return {symbol: {"price": price, "symbol": symbol} for symbol, price in prices.items()}
+
 def login_required(f):
     """
     Decorate routes to require login.
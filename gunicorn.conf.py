@@ -0,0 +1,35 @@
+import os
+
+# https://docs.gunicorn.org/en/20.1.0/settings.html
+# Read by gunicorn from the working directory, the Procfile's `gunicorn application:app` picks it up.
+#
+# WORKER_MODE=sync (default) serves one request at a time per worker process, the worker is
+# blocked while a request waits on IEX or the database so concurrency is the number of workers.
+#
+# WORKER_MODE=gevent serves up to GEVENT_CONNECTIONS requests at once per worker.
+# https://docs.gunicorn.org/en/20.1.0/design.html#async-workers
+# gunicorn's gevent worker patches the standard library (sockets, threads, locks) when it starts,
+# so requests' IEX calls and the fetch thread pool give way to other requests while they wait,
+# and psycogreen does the same for psycopg2's queries and connects. The routes stay as they are.
+
+WORKER_MODE = os.environ.get("WORKER_MODE", "sync")
+
+# Requests each gevent worker serves at once
+GEVENT_CONNECTIONS = int(os.environ.get("GEVENT_CONNECTIONS", 20))
+
+if WORKER_MODE == "gevent":
+    worker_class = "gevent"
+    worker_connections = GEVENT_CONNECTIONS
+
+    # Each request holds a database connection from its first query to its end and the quota and
+    # quote writes on the fetch threads borrow their own briefly, so the pool has a few more than
+    # the requests served at once. Set before the app is imported in the worker, see db.py
+    os.environ.setdefault("DB_POOL_MAX", str(GEVENT_CONNECTIONS + 5))
+
+
+def post_fork(server, worker):
+    """Makes psycopg2 wait for the database cooperatively in gevent workers"""
+    if WORKER_MODE == "gevent":
+        # https://github.com/psycopg/psycogreen
+        from psycogreen.gevent import patch_psycopg
+        patch_psycopg()
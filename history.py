@@ -0,0 +1,259 @@
+import urllib.parse
+
+from datetime import date, datetime, timedelta
+from db import db_select, db_commit, db_commit_many
+from fetch import gather
+from iex import iex_get, UpstreamUnavailable
+from misses import misses, MISSING, FAILED
+
+# Historical daily closes never change once the day is over, so every close
+# fetched from IEX is kept in the prices table and served from there afterwards.
+# price_ranges records which days of a symbol have been fetched, a day inside a fetched
+# range with no price is a day the symbol didn't trade, so it isn't asked for again.
+# A range only counts from the first close IEX returned: ranges are trading sessions, not the
+# calendar days they are picked by, and can start after the day they were fetched for.
+# Days IEX had nothing for, or couldn't be asked about, are remembered for a while in misses.py
+
+# https://iexcloud.io/docs/api/#historical-prices
+# Ranges the chart endpoint accepts with the number of days each one reaches back.
+# On a miss the smallest range covering the date is fetched rather than the single day
+# so neighbouring dates (and the other days scan() tries) are stored by the same call
+CHART_RANGES = [
+    ("5d", 7),
+    ("1m", 28),
+    ("3m", 89),
+    ("6m", 180),
+    ("1y", 364),
+    ("2y", 729),
+    ("5y", 1825),
+]
+
+
+def chart_range(day, today=None):
+    """Returns the smallest chart range reaching back to day"""
+
+    if today is None:
+        today = date.today()
+
+    age = (today - day).days
+    for name, days in CHART_RANGES:
+        if age <= days:
+            return name
+    # add() doesn't allow dates before 5 years ago
+    return CHART_RANGES[-1][0]
+
+
+def range_cost(range_name):
+    """Message credits of a chart range, charged per day returned, about 5 trading days in every 7"""
+    return max(dict(CHART_RANGES)[range_name] * 5 // 7, 1)
+
+
+def fetch_range(symbol, range_name):
+    """
+    Fetches daily closes for a chart range, returns [(date, close), ...], empty if IEX has none for the symbol.
+    Raises UpstreamUnavailable if IEX can't answer
+    """
+
+    chart = iex_get(f"/stock/{urllib.parse.quote_plus(symbol)}/chart/{range_name}", {"chartCloseOnly": "true"},
+                    cost=range_cost(range_name))
+    if chart is None:
+        return []
+
+    # Response is [{"date": "2021-08-09", "close": 146.09, ...}, ...]
+    try:
+        return [(datetime.strptime(bar["date"], "%Y-%m-%d").date(), float(bar["close"]))
+                for bar in chart if bar.get("close") is not None]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return []
+
+
+def next_range(range_name):
+    """The chart range after range_name, None for the longest"""
+    names = [name for name, _ in CHART_RANGES]
+    i = names.index(range_name) + 1
+    return names[i] if i < len(names) else None
+
+
+def save_range(symbol, closes, start=None):
+    """
+    Bulk inserts closes for symbol and records that every day from the first close
+    to the last is now known. start extends that back to a day the symbol is known
+    to have no earlier close from
+    """
+
+    if not closes:
+        return
+
+    db_commit_many("""
+    INSERT INTO prices (symbol, date, close) VALUES %s
+    ON CONFLICT (symbol, date) DO NOTHING;
+    """,
+    [(symbol, day, close) for day, close in closes], sticky=False)
+
+    end = max(day for day, _ in closes)
+    first = min(day for day, _ in closes)
+    start = first if start is None else min(start, first)
+    db_commit("INSERT INTO price_ranges (symbol, start_date, end_date) VALUES (%s, %s, %s);",
+              (symbol, start, end), sticky=False)
+
+
+def stored_closes(symbol, days):
+    """
+    Reads days from the prices table
+    Returns {day: close} for days with a close and {day: None} for days
+    known to have no close, days never fetched are left out
+    """
+
+    known = {}
+
+    rows = db_select("SELECT date, close FROM prices WHERE symbol=(%s) AND date = ANY(%s);",
+                     (symbol, list(days)))
+    for row in rows:
+        known[row[0]] = float(row[1])
+
+    missing = [day for day in days if day not in known]
+    if not missing:
+        return known
+
+    ranges = db_select("SELECT start_date, end_date FROM price_ranges WHERE symbol=(%s) \
+                        AND start_date <= (%s) AND end_date >= (%s);",
+                        (symbol, max(missing), min(missing)))
+    for day in missing:
+        if any(start <= day <= end for start, end in ranges):
+            known[day] = None
+
+    return known
+
+
+def closes(symbol, days):
+    """
+    Returns {day: close or None} for days, reading through the prices table.
+    Days that haven't been fetched before cost one range request between them.
+    Days left out of the result couldn't be fetched.
+    """
+    symbol = symbol.upper()
+    return closes_many({symbol: days})[symbol]
+
+
+def closes_many(wanted):
+    """
+    closes() for many symbols at once, wanted is {symbol: days}
+    Returns {symbol: {day: close or None}}.
+    Symbols with days missing from the table are fetched concurrently, one range request each.
+    Raises UpstreamUnavailable if some symbols couldn't be fetched, once the rest are stored
+    """
+
+    known, failed = closes_available(wanted)
+    if failed:
+        raise UpstreamUnavailable(f"Closes of {len(failed)} symbols couldn't be fetched")
+    return known
+
+
+def closes_available(wanted):
+    """
+    closes_many() that carries on past symbols IEX couldn't be asked about.
+    Returns ({symbol: {day: close or None}}, {symbols that couldn't be fetched})
+    """
+
+    known = {}
+    missing = {}
+    # Symbols that couldn't be fetched, now or moments ago (asked for again only once their miss expires)
+    failed = set()
+    for symbol, days in wanted.items():
+        days = list(days)
+        known[symbol] = stored_closes(symbol, days)
+        not_stored = [day for day in days if day not in known[symbol]]
+        if not not_stored:
+            continue
+
+        # Days IEX recently had nothing for are left out like they were then, see misses.py
+        miss = misses.get(("close", symbol))
+        if miss is not None:
+            kind, missed_days = miss
+            if kind == FAILED:
+                failed.add(symbol)
+                misses.avoided("close", FAILED)
+                continue
+            not_stored = [day for day in not_stored if missed_days is not None and day not in missed_days]
+            if not not_stored:
+                misses.avoided("close", MISSING)
+                continue
+        missing[symbol] = not_stored
+
+    if not missing:
+        return known, failed
+
+    # Only the requests run on the thread pool, the database is read and written from here.
+    # Each round fetches one range per symbol, the smallest reaching back to its earliest day.
+    # A symbol whose range started after some of its days goes again with the next range up
+    ranges = {symbol: chart_range(min(days)) for symbol, days in missing.items()}
+    # symbol -> first close of its previous round's range
+    first_seen = {}
+    while missing:
+        symbols = list(missing)
+        results = gather([(fetch_range, (symbol, ranges[symbol])) for symbol in symbols])
+
+        earlier = {}
+        for symbol, fetched in zip(symbols, results):
+            # Nothing is known about these days yet, IEX has no closes for the symbol
+            # or (when None) it couldn't be fetched
+            if not fetched:
+                if fetched is None:
+                    failed.add(symbol)
+                misses.put(("close", symbol), FAILED if fetched is None else MISSING)
+                continue
+
+            by_day = dict(fetched)
+            first, end = min(by_day), max(by_day)
+
+            # A longer range starting at the same close as the last one means there is
+            # nothing before it, the symbol wasn't trading yet
+            listed = first_seen.get(symbol) == first
+            save_range(symbol, fetched, min(missing[symbol]) if listed else None)
+
+            before = []
+            # Days after the last close returned may just not have happened yet
+            after = []
+            for day in missing[symbol]:
+                if first <= day <= end or (listed and day < first):
+                    known[symbol][day] = by_day.get(day)
+                elif day < first:
+                    before.append(day)
+                else:
+                    after.append(day)
+
+            bigger = next_range(ranges[symbol])
+            if before and bigger:
+                earlier[symbol] = before
+                ranges[symbol] = bigger
+                first_seen[symbol] = first
+            else:
+                after += before
+            if after:
+                misses.put(("close", symbol), MISSING, after)
+        missing = earlier
+
+    # gather() gives None for calls that raised UpstreamUnavailable (or QuotaExceeded) or ran out of time
+    return known, failed
+
+
+def backfill(symbols):
+    """
+    Preloads the prices table with the 5 year window add() allows
+    Returns {symbol: number of closes stored}, None for symbols that couldn't be fetched
+    """
+
+    symbols = sorted({symbol.upper() for symbol in symbols})
+    name = CHART_RANGES[-1][0]
+
+    results = gather([(fetch_range, (symbol, name)) for symbol in symbols])
+
+    counts = {}
+    for symbol, fetched in zip(symbols, results):
+        # gather() gives None when IEX or the quota didn't allow the call, [] when IEX has no closes
+        if not fetched:
+            counts[symbol] = None if fetched is None else 0
+            continue
+        save_range(symbol, fetched)
+        counts[symbol] = len(fetched)
+    return counts
@@ -0,0 +1,243 @@
+import os
+import time
+import random
+import threading
+import requests
+
+from requests.adapters import HTTPAdapter
+from fetch import FETCH_WORKERS, REQUEST_TIMEOUT
+from quota import acquire
+from metrics import timed
+
+# https://iexcloud.io/docs/api/
+# Every call to IEX goes through one client per process which:
+# - keeps connections open in a pooled requests.Session instead of a new TCP + TLS handshake per call
+# - retries rate limits (429) and server errors (5xx) with jittered exponential backoff
+# - stops calling for a while once IEX keeps failing (circuit breaker),
+#   pages fail straight away instead of every request waiting out the timeouts
+# - sends identical calls made at the same time only once (single-flight),
+#   100 users opening the same symbol wait on the one request
+# - spends message credits from the quota shared by every process, see quota.py
+
+# Can point somewhere else, e.g. the sandbox or benchmarks/fake_iex.py
+IEX_BASE_URL = os.environ.get("IEX_BASE_URL", "https://cloud.iexapis.com/v1")
+
+# Retries after the first attempt, and the backoff in seconds before the first retry (doubling after)
+IEX_RETRIES = int(os.environ.get("IEX_RETRIES", 2))
+IEX_BACKOFF = float(os.environ.get("IEX_BACKOFF", 0.25))
+
+# A Retry-After longer than this many seconds isn't waited for, the call fails instead
+IEX_MAX_RETRY_AFTER = float(os.environ.get("IEX_MAX_RETRY_AFTER", 2))
+
+# The breaker opens after this many calls in a row fail (retries included)
+# and lets one trial call through every IEX_BREAKER_COOLDOWN seconds until one succeeds
+IEX_BREAKER_THRESHOLD = int(os.environ.get("IEX_BREAKER_THRESHOLD", 5))
+IEX_BREAKER_COOLDOWN = float(os.environ.get("IEX_BREAKER_COOLDOWN", 30))
+
+# https://developer.mozilla.org/en-US/docs/Web/HTTP/Status#server_error_responses
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# https://iexcloud.io/docs/api/#error-codes
+# Answers meaning IEX has nothing for what was asked (an unknown symbol, a range it can't serve).
+# Any other 4xx, e.g. a bad token (401), no credits left (402) or a forbidden endpoint (403),
+# is the app being refused, not missing data, and fails the call without a retry
+NO_DATA_STATUSES = {400, 404}
+
+
+class UpstreamUnavailable(Exception):
+    """IEX couldn't be reached, kept failing, or the circuit breaker is open"""
+
+
+class QuotaExceeded(UpstreamUnavailable):
+    """The IEX message credit quota doesn't allow the call right now"""
+
+
+class Flight:
+    """A call in progress that other threads asking for the same thing wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class IEXClient:
+    """IEX Cloud API client, one per process, see get_client()"""
+
+    def __init__(self, base_url=IEX_BASE_URL, timeout=REQUEST_TIMEOUT, retries=IEX_RETRIES, backoff=IEX_BACKOFF,
+                 threshold=IEX_BREAKER_THRESHOLD, cooldown=IEX_BREAKER_COOLDOWN):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        # https://requests.readthedocs.io/en/latest/user/advanced/#session-objects
+        # Enough kept-alive connections for every fetch thread to have one
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.failures = 0
+        self.opened_at = 0.0
+
+        # Counters for monitoring
+        self.calls = 0
+        self.coalesced = 0
+        self.rejected = 0
+
+    def get(self, path, params=None, cost=1):
+        """
+        GETs path (e.g. /stock/aapl/quote) and returns the decoded JSON,
+        None if IEX has nothing for it (404 and 400 responses).
+        cost is the message credits IEX charges for the call.
+        Raises UpstreamUnavailable when IEX can't answer, QuotaExceeded when the quota doesn't allow the call
+        """
+
+        params = dict(params or {})
+        key = (path, tuple(sorted(params.items())))
+
+        while True:
+            with self.lock:
+                flight = self.flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self.flights[key] = Flight()
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+
+            # Someone else is already asking IEX for this, wait for their answer
+            with timed("iex_wait", path):
+                flight.done.wait()
+            # Their quota (or their user's) didn't allow the call, IEX wasn't asked.
+            # Ask again on this caller's own quota, leading the next call or following it
+            if isinstance(flight.error, QuotaExceeded):
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = self.fetch(path, params, cost)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def allow(self):
+        """Circuit breaker, False while it is open"""
+        with self.lock:
+            if self.failures < self.threshold:
+                return True
+            # Half open, one trial call per cooldown
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                self.opened_at = time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, ok):
+        with self.lock:
+            if ok:
+                self.failures = 0
+            else:
+                self.failures += 1
+                if self.failures >= self.threshold:
+                    self.opened_at = time.monotonic()
+
+    def fetch(self, path, params, cost):
+        """One call with retries, see get()"""
+
+        if not self.allow():
+            raise UpstreamUnavailable("IEX is failing, not calling it for now")
+
+        # Only whoever makes the call pays for it, calls coalesced onto it are free
+        if not acquire(cost):
+            raise QuotaExceeded(f"Not enough IEX quota left for {path}")
+
+        params["token"] = os.environ.get("API_KEY")
+        url = self.base_url + path
+
+        for attempt in range(self.retries + 1):
+            retry_after = None
+            try:
+                with self.lock:
+                    self.calls += 1
+                with timed("iex", path):
+                    response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                response = None
+
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                if not response.ok and response.status_code not in NO_DATA_STATUSES:
+                    self.record(False)
+                    raise UpstreamUnavailable(f"IEX refused the request for {path} ({response.status_code})")
+
+                # IEX answered, even if there's no data for what was asked
+                self.record(True)
+                if not response.ok:
+                    return None
+                try:
+                    return response.json()
+                except ValueError:
+                    return None
+
+            if response is not None:
+                retry_after = response.headers.get("Retry-After")
+
+            if attempt == self.retries:
+                break
+
+            # https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/
+            # Full jitter so retries from many workers don't arrive together
+            delay = random.uniform(0, self.backoff * 2 ** attempt)
+            if retry_after is not None:
+                try:
+                    delay = max(delay, float(retry_after))
+                except ValueError:
+                    pass
+                if delay > IEX_MAX_RETRY_AFTER:
+                    break
+            time.sleep(delay)
+
+        self.record(False)
+        raise UpstreamUnavailable(f"IEX request for {path} failed")
+
+    def stats(self):
+        """Counters for monitoring the client"""
+        with self.lock:
+            return {"calls": self.calls, "coalesced": self.coalesced, "rejected": self.rejected,
+                    "failures": self.failures, "open": self.failures >= self.threshold}
+
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns this process' IEX client, connections don't survive a gunicorn fork so it is rebuilt after one"""
+
+    global _client, _client_pid
+
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = IEXClient()
+                _client_pid = os.getpid()
+    return _client
+
+
+def iex_get(path, params=None, cost=1):
+    """get() on this process' client"""
+    return get_client().get(path, params, cost)
@@ -0,0 +1,89 @@
+import csv
+
+from datetime import date
+from db import db_commit_many
+from functions import check_purchase, scan_available
+from snapshots import invalidate
+
+# A brokerage history can be thousands of trades, so a CSV of
+# portfolio,symbol,quantity,date rows is imported in one go:
+# rows are checked with the same rules as /add as they are read, the prices of every
+# distinct (symbol, date) are resolved together, then every valid row is inserted
+# with multi-row statements in one transaction
+
+IMPORT_COLUMNS = ("portfolio", "symbol", "quantity", "date")
+
+
+def import_trades(user_id, lines, portfolios, today=None):
+    """
+    Imports trades from lines of CSV text into the user's portfolios
+    Returns (number of purchases inserted, [(line number, error message), ...])
+    """
+
+    if today is None:
+        today = date.today()
+
+    errors = []
+    valid = []
+
+    # https://docs.python.org/3/library/csv.html#csv.DictReader
+    # Rows are parsed one at a time as the file is read
+    reader = csv.DictReader(lines)
+    try:
+        header = [name.strip().lower() for name in (reader.fieldnames or [])]
+        missing = [column for column in IMPORT_COLUMNS if column not in header]
+        if missing:
+            return 0, [(1, f"Missing column(s): {', '.join(missing)}. "
+                           f"The header must be {','.join(IMPORT_COLUMNS)}")]
+        reader.fieldnames = header
+
+        for row in reader:
+            line = reader.line_num
+            portfolio_name = (row["portfolio"] or "").strip().lower()
+
+            if not portfolio_name:
+                errors.append((line, "Choose a portfolio to add shares to"))
+                continue
+            if portfolio_name not in portfolios:
+                errors.append((line, f"You don't have a portfolio called {portfolio_name}"))
+                continue
+
+            error, purchase = check_purchase((row["symbol"] or "").strip(), (row["quantity"] or "").strip(),
+                                             (row["date"] or "").strip(), today)
+            if error:
+                errors.append((line, error[0]))
+                continue
+
+            valid.append((line, portfolio_name, purchase))
+
+    except csv.Error as e:
+        errors.append((reader.line_num, f"Could not read the file: {e}"))
+        return 0, errors
+
+    # Each distinct (symbol, date) is priced once however many rows share it.
+    # A symbol IEX couldn't be asked about only fails its own rows, the rest are still imported
+    prices, failed = scan_available((symbol, purchase_date) for _, _, (symbol, _, purchase_date) in valid)
+
+    rows = []
+    for line, portfolio_name, (symbol, quantity, purchase_date) in valid:
+        data = prices[(symbol, purchase_date)]
+        if not data and symbol in failed:
+            errors.append((line, f"Price unavailable for {symbol} right now, retry this row later"))
+            continue
+        if not data:
+            errors.append((line, f"No data found for {symbol} on {purchase_date}, "
+                                 "you may be trying to access a date before the company was listed"))
+            continue
+        rows.append((symbol, quantity, data["price"], data["date"], portfolio_name, user_id))
+
+    if rows:
+        db_commit_many("""
+        INSERT INTO shares
+        (symbol, purchase_quantity, purchase_price, purchase_date, portfolio_name, id)
+        VALUES %s;
+        """,
+        rows)
+        invalidate(user_id, {row[4] for row in rows})
+
+    errors.sort()
+    return len(rows), errors
@@ -0,0 +1,53 @@
+from datetime import datetime, time, timedelta
+from zoneinfo import ZoneInfo
+from trading_calendar import get_calendar
+
+# https://www.nyse.com/markets/hours-calendars
+# Regular trading hours are 9:30am to 4:00pm Eastern time on weekdays
+EXCHANGE_TZ = ZoneInfo("America/New_York")
+MARKET_OPEN = time(9, 30)
+MARKET_CLOSE = time(16, 0)
+
+# The official close is settled by the closing auction a few minutes after 4pm,
+# prices are still treated as moving until then
+CLOSE_SETTLE = timedelta(minutes=20)
+
+
+def exchange_now(now=None):
+    """Returns now (or the aware datetime given) in exchange time"""
+    if now is None:
+        now = datetime.now(EXCHANGE_TZ)
+    return now.astimezone(EXCHANGE_TZ)
+
+
+def is_trading_day(day):
+    """True if the exchange holds a session on the date given"""
+    # Weekdays that aren't exchange holidays
+    return get_calendar(day).is_session(day)
+
+
+def market_open(now=None):
+    """True while prices can still change, regular hours plus the closing auction"""
+
+    now = exchange_now(now)
+
+    if not is_trading_day(now.date()):
+        return False
+
+    opens = datetime.combine(now.date(), MARKET_OPEN, EXCHANGE_TZ)
+    closes = datetime.combine(now.date(), MARKET_CLOSE, EXCHANGE_TZ) + CLOSE_SETTLE
+    return opens <= now < closes
+
+
+def next_open(now=None):
+    """Returns the aware datetime of the next time the market opens after now"""
+
+    now = exchange_now(now)
+    day = now.date()
+
+    # Today's session is still to come
+    if is_trading_day(day) and now.time() < MARKET_OPEN:
+        return datetime.combine(day, MARKET_OPEN, EXCHANGE_TZ)
+
+    day += timedelta(days=1)
+    return datetime.combine(get_calendar(day).session_on_or_after(day), MARKET_OPEN, EXCHANGE_TZ)
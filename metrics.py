@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import logging
+import threading
+import contextvars
+
+from contextlib import contextmanager
+from jinja2 import Template
+
+# Where the time of a request goes: each database query, IEX call and template render
+# is timed and added up for the request it was made for. The totals are
+# - sent back in a Server-Timing header so the browser's dev tools show them
+#   https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing
+# - added to histograms served as Prometheus text from /metrics
+#   https://prometheus.io/docs/instrumenting/exposition_formats/
+# - logged with the query text and IEX path of each step when a request takes longer than SLOW_REQUEST_MS
+#
+# Histograms are per process, each gunicorn worker counts the requests it served
+
+# Requests slower than this many milliseconds are logged step by step, 0 turns the log off
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 0))
+
+# /metrics is only served with this token, as ?token= or an Authorization: Bearer header
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN")
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Steps logged for one slow request at most
+MAX_STEPS = 50
+
+log = logging.getLogger("metrics")
+
+
+class Histogram:
+    """Prometheus style cumulative histograms of seconds, one per set of labels"""
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, seconds, *values):
+        with self.lock:
+            series = self.series.get(values)
+            if series is None:
+                series = self.series[values] = [[0] * len(BUCKETS), 0.0, 0]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for values, (buckets, total, count) in sorted(self.series.items()):
+                labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, values))
+                prefix = labels + "," if labels else ""
+                for bound, bucket in zip(BUCKETS, buckets):
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f"{self.name}_sum{{{labels}}} {total}")
+                lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+request_seconds = Histogram("app_request_duration_seconds", "Time to handle a request",
+                            ("endpoint", "method", "status"))
+step_seconds = Histogram("app_step_duration_seconds", "Time of each database query, IEX call and render",
+                         ("step",))
+steps_per_request = Histogram("app_request_step_seconds", "Time a request spent on each kind of step",
+                              ("step",))
+
+
+class RequestTimings:
+    """Counts and durations of a request's steps, added to from the fetch threads too"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.steps = []
+
+    def add(self, step, seconds, detail):
+        with self.lock:
+            count, total = self.totals.get(step, (0, 0.0))
+            self.totals[step] = (count + 1, total + seconds)
+            if SLOW_REQUEST_MS and detail and len(self.steps) < MAX_STEPS:
+                self.steps.append((step, seconds, detail))
+
+
+# https://docs.python.org/3/library/contextvars.html
+# fetch.submit() copies context variables so calls on the thread pool add to their request
+_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+def record(step, seconds, detail=None):
+    """Adds a step that took seconds to the current request, detail is shown in the slow request log"""
+    step_seconds.observe(seconds, step)
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(step, seconds, detail)
+
+
+@contextmanager
+def timed(step, detail=None):
+    """Times the body of a with block as a step of the current request"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(step, time.perf_counter() - started, detail)
+
+
+class TimedTemplate(Template):
+    """Jinja template whose renders are timed, set as the app's template_class"""
+
+    def render(self, *args, **kwargs):
+        with timed("render", self.name):
+            return super().render(*args, **kwargs)
+
+
+def start_request():
+    """before_request, starts timing the request"""
+    _timings.set(RequestTimings())
+
+
+def finish_request(response):
+    """after_request, adds the Server-Timing header and records the request"""
+
+    from flask import request
+
+    timings = _timings.get()
+    if timings is None:
+        return response
+    elapsed = time.perf_counter() - timings.started
+
+    with timings.lock:
+        totals = dict(timings.totals)
+        steps = list(timings.steps)
+
+    # e.g. db;dur=12.3;desc="4 calls", iex;dur=80.1;desc="1 call", total;dur=105.2
+    entries = []
+    for step, (count, seconds) in sorted(totals.items()):
+        entries.append(f'{step};dur={seconds * 1000:.1f};desc="{count} call{"s" if count != 1 else ""}"')
+        steps_per_request.observe(seconds, step)
+    entries.append(f"total;dur={elapsed * 1000:.1f}")
+    response.headers["Server-Timing"] = ", ".join(entries)
+
+    request_seconds.observe(elapsed, request.endpoint or "none", request.method, response.status_code)
+
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        lines = [f"{step} {seconds * 1000:.1f}ms {detail}" for step, seconds, detail in steps]
+        log.warning("Slow request %s %s %.0fms (%s)\n  %s", request.method, request.full_path.rstrip("?"),
+                    elapsed * 1000, response.headers["Server-Timing"], "\n  ".join(lines))
+    return response
+
+
+def end_request(e=None):
+    """teardown_request, stops anything after the request (e.g. saving the session) adding to it"""
+    _timings.set(None)
+
+
+def query_text(query):
+    """A query on one line for the slow request log"""
+    return re.sub(r"\s+", " ", query).strip()[:200]
+
+
+def authorized(request):
+    """True if the request may read /metrics"""
+    if not METRICS_TOKEN:
+        return False
+    header = request.headers.get("Authorization", "")
+    return request.args.get("token") == METRICS_TOKEN or header == f"Bearer {METRICS_TOKEN}"
+
+
+def exposition(gauges):
+    """Prometheus text of the histograms and gauges, a dict of name -> (help, value)"""
+    lines = []
+    for histogram in (request_seconds, step_seconds, steps_per_request):
+        lines.extend(histogram.exposition())
+    for name, (help, value) in sorted(gauges.items()):
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def init_metrics(app):
+    """Times every request of the app"""
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(end_request)
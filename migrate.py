@@ -0,0 +1,110 @@
+import os
+import re
+import json
+import psycopg2
+
+from db import checkout, checkin
+from queries import HOT_QUERIES
+
+# Versioned schema changes live in migrations/ as NNNN_description.sql files.
+# schema_migrations records which versions have been applied,
+# so `flask migrate` only runs the ones a database hasn't seen yet
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+# Arbitrary key for pg_advisory_lock so two dynos releasing at once don't migrate together
+MIGRATION_LOCK = 50_2021
+
+
+def migrations():
+    """Returns [(version, name, path), ...] of every migration file in version order"""
+    found = []
+    for filename in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r"^(\d{4})_(\w+)\.sql$", filename)
+        if match:
+            found.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return sorted(found)
+
+
+def upgrade():
+    """Applies every pending migration, each in its own transaction. Returns the names applied"""
+
+    conn = checkout()
+    applied = []
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT pg_advisory_lock(%s);", (MIGRATION_LOCK,))
+        cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(200) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        """)
+        conn.commit()
+
+        cur.execute("SELECT version FROM schema_migrations;")
+        done = {row[0] for row in cur.fetchall()}
+
+        for version, name, path in migrations():
+            if version in done:
+                continue
+            with open(path) as f:
+                cur.execute(f.read())
+            cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s);", (version, name))
+            conn.commit()
+            applied.append(f"{version:04d}_{name}")
+
+        cur.execute("SELECT pg_advisory_unlock(%s);", (MIGRATION_LOCK,))
+        conn.commit()
+        cur.close()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        checkin(conn)
+
+    return applied
+
+
+def scan_nodes(plan):
+    """Yields every node of an EXPLAIN (FORMAT JSON) plan tree"""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from scan_nodes(child)
+
+
+def check_plans():
+    """
+    EXPLAINs every hot query with sequential scans discouraged.
+    With enable_seqscan off the planner only picks a Seq Scan when no index can
+    answer the query, so a Seq Scan in the plan means an index is missing
+    however small the tables are. Any index would do to avoid one, so the plan
+    also has to use the indexes each query was written for.
+    Returns [(name, problem), ...], an empty list means every query uses its indexes
+    """
+
+    conn = checkout()
+    failures = []
+    try:
+        cur = conn.cursor()
+        # https://www.postgresql.org/docs/current/runtime-config-query.html
+        cur.execute("SET LOCAL enable_seqscan = off;")
+        for name, query, data, indexes in HOT_QUERIES:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, data)
+            plan = cur.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            nodes = list(scan_nodes(plan[0]["Plan"]))
+            seq_scans = [node.get("Relation Name") for node in nodes if node["Node Type"] == "Seq Scan"]
+            if seq_scans:
+                failures.append((name, f"sequential scan on {', '.join(seq_scans)}"))
+            used = {node["Index Name"] for node in nodes if "Index Name" in node}
+            unused = [index for index in indexes if index not in used]
+            if unused:
+                failures.append((name, f"doesn't use {', '.join(unused)} (uses {', '.join(sorted(used)) or 'no index'})"))
+        cur.close()
+    finally:
+        checkin(conn)
+
+    return failures
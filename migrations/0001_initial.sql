@@ -0,0 +1,22 @@
+-- Users, their portfolios and the shares bought in each portfolio.
+-- IF NOT EXISTS because deployments from before migrations already have these tables
+
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    username VARCHAR(50) UNIQUE NOT NULL,
+    password VARCHAR(200) NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS portfolios (
+    id INT REFERENCES users (id) ON DELETE CASCADE ON UPDATE CASCADE,
+    portfolio_name VARCHAR(50) UNIQUE NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shares (
+    symbol VARCHAR(50) NOT NULL,
+    purchase_quantity INT NOT NULL CHECK (purchase_quantity > 0),
+    purchase_price NUMERIC NOT NULL CHECK (purchase_price > 0),
+    purchase_date DATE NOT NULL,
+    portfolio_name VARCHAR(50) REFERENCES portfolios (portfolio_name) ON DELETE CASCADE ON UPDATE CASCADE,
+    id INT REFERENCES users (id) ON DELETE CASCADE ON UPDATE CASCADE
+);
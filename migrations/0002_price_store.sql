@@ -0,0 +1,23 @@
+-- Latest prices shared by every worker, see quotes.py
+CREATE TABLE IF NOT EXISTS quotes (
+    symbol VARCHAR(50) PRIMARY KEY,
+    price NUMERIC NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+
+-- Historical daily closes, see history.py
+CREATE TABLE IF NOT EXISTS prices (
+    symbol VARCHAR(50) NOT NULL,
+    date DATE NOT NULL,
+    close NUMERIC NOT NULL,
+    PRIMARY KEY (symbol, date)
+);
+
+-- Days of each symbol that have been fetched from IEX
+CREATE TABLE IF NOT EXISTS price_ranges (
+    symbol VARCHAR(50) NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL
+);
+CREATE INDEX IF NOT EXISTS price_ranges_symbol ON price_ranges (symbol, start_date);
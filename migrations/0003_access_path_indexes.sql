@@ -0,0 +1,14 @@
+-- Indexes matching how the routes read shares and portfolios, see queries.py
+
+-- /portfolio, /portfolio/<name>/share and the index page all filter shares by
+-- owner and portfolio, then by symbol and purchase date.
+-- Quantity and price are included so the grouped queries can be answered from the index alone
+CREATE INDEX IF NOT EXISTS shares_owner_portfolio
+    ON shares (id, portfolio_name, symbol, purchase_date)
+    INCLUDE (purchase_quantity, purchase_price);
+
+-- Deleting a portfolio cascades to its shares by portfolio_name alone
+CREATE INDEX IF NOT EXISTS shares_portfolio_name ON shares (portfolio_name);
+
+-- Every logged in page lists the user's portfolio names
+CREATE INDEX IF NOT EXISTS portfolios_owner ON portfolios (id, portfolio_name);
@@ -0,0 +1,9 @@
+-- Server side sessions, see sessions.py
+-- UNLOGGED skips the write-ahead log, sessions are written often and
+-- losing them in a database crash only means logging in again
+CREATE UNLOGGED TABLE IF NOT EXISTS sessions (
+    sid VARCHAR(64) PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires_at ON sessions (expires_at);
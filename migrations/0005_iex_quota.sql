@@ -0,0 +1,9 @@
+-- Token buckets of the IEX message credit quota, see quota.py
+-- 'global' is shared by every process, 'user:<id>' rows are each user's own
+CREATE TABLE IF NOT EXISTS quota_buckets (
+    name VARCHAR(64) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL,
+    granted BIGINT NOT NULL DEFAULT 0,
+    denied BIGINT NOT NULL DEFAULT 0
+);
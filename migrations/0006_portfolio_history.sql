@@ -0,0 +1,11 @@
+-- Daily market value and cost basis of each portfolio, see valuation.py
+-- One entry per trading session from start_date to end_date in each array
+CREATE TABLE IF NOT EXISTS portfolio_history (
+    portfolio_name VARCHAR(50) PRIMARY KEY REFERENCES portfolios (portfolio_name) ON DELETE CASCADE ON UPDATE CASCADE,
+    id INT NOT NULL REFERENCES users (id) ON DELETE CASCADE ON UPDATE CASCADE,
+    fingerprint VARCHAR(64) NOT NULL,
+    start_date DATE NOT NULL,
+    end_date DATE NOT NULL,
+    market_values DOUBLE PRECISION[] NOT NULL,
+    cost_bases DOUBLE PRECISION[] NOT NULL
+);
@@ -0,0 +1,17 @@
+-- The computed /portfolio/<portfolio_name> page of each portfolio, see snapshots.py
+-- holdings_version goes up on every change to a portfolio's shares, a snapshot is only
+-- used while it was built from the current version
+ALTER TABLE portfolios ADD COLUMN IF NOT EXISTS holdings_version BIGINT NOT NULL DEFAULT 0;
+
+CREATE TABLE IF NOT EXISTS portfolio_snapshots (
+    portfolio_name VARCHAR(50) PRIMARY KEY REFERENCES portfolios (portfolio_name) ON DELETE CASCADE ON UPDATE CASCADE,
+    id INT NOT NULL REFERENCES users (id) ON DELETE CASCADE ON UPDATE CASCADE,
+    holdings_version BIGINT NOT NULL,
+    symbols TEXT[] NOT NULL,
+    dates DATE[] NOT NULL,
+    quantities DOUBLE PRECISION[] NOT NULL,
+    cost_bases DOUBLE PRECISION[] NOT NULL,
+    purchase_overall DOUBLE PRECISION NOT NULL,
+    priced_with VARCHAR(64),
+    model TEXT
+);
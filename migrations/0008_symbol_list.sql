@@ -0,0 +1,8 @@
+-- The symbols IEX supports and their company names, see symbols.py
+-- One row replaced as a whole by each refresh so readers never see half a list
+CREATE TABLE IF NOT EXISTS symbol_list (
+    id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+    refreshed_at TIMESTAMPTZ NOT NULL,
+    symbols TEXT[] NOT NULL,
+    names TEXT[] NOT NULL
+);
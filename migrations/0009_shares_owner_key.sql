@@ -0,0 +1,26 @@
+-- The hot queries read shares by owner and portfolio through shares_owner_portfolio, but the
+-- planner preferred the narrower shares_portfolio_name whenever both could answer them.
+-- Shares now reference their portfolio by (owner, name), so deleting or renaming a portfolio
+-- cascades through shares_owner_portfolio too and shares_portfolio_name can go.
+-- portfolio_name is unique on its own, so (id, portfolio_name) is as well
+DROP INDEX IF EXISTS portfolios_owner;
+CREATE UNIQUE INDEX portfolios_owner ON portfolios (id, portfolio_name);
+
+-- /add never checked who owned the portfolio posted, so a purchase can belong to one user and
+-- sit in another's portfolio, where neither of them sees it. Each user gets a portfolio of their
+-- own for those, named after the one they were added to, before the key would reject them
+INSERT INTO portfolios (id, portfolio_name)
+SELECT DISTINCT s.id, left(s.portfolio_name, 40) || ' #' || s.id
+FROM shares s JOIN portfolios p ON p.portfolio_name = s.portfolio_name
+WHERE s.id <> p.id
+ON CONFLICT (portfolio_name) DO NOTHING;
+
+UPDATE shares s SET portfolio_name = left(s.portfolio_name, 40) || ' #' || s.id
+FROM portfolios p
+WHERE p.portfolio_name = s.portfolio_name AND s.id <> p.id;
+
+ALTER TABLE shares DROP CONSTRAINT IF EXISTS shares_portfolio_name_fkey;
+ALTER TABLE shares ADD CONSTRAINT shares_owner_portfolio_fkey FOREIGN KEY (id, portfolio_name)
+    REFERENCES portfolios (id, portfolio_name) ON DELETE CASCADE ON UPDATE CASCADE;
+
+DROP INDEX IF EXISTS shares_portfolio_name;
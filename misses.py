@@ -0,0 +1,100 @@
+import os
+import time
+import threading
+
+from collections import Counter, OrderedDict
+
+# Prices and closes that are found are stored (quotes, prices tables), lookups that found
+# nothing weren't remembered anywhere: a symbol IEX 404s, a day with no close yet or a call
+# that failed was asked for again on the very next request, e.g. every retry of the /add form
+# or every view of a portfolio holding a delisted symbol.
+# Each worker keeps a bounded LRU of recent misses instead, one entry per symbol
+# - ("close", symbol) for closes_many(), which lookup(), scan() and the history page use,
+#   with the days that missed since one range request answers for all of a symbol's days
+# - ("quote", symbol) for latestprice() and latestprices()
+# A miss is one of
+# - MISSING, IEX answered and has nothing (404 or 400, an empty chart), remembered for NEGATIVE_TTL_MISSING
+# - FAILED, IEX couldn't be asked, didn't answer or refused the call (a bad token, no credits left),
+#   remembered for NEGATIVE_TTL_FAILED so a burst of retries gets the same 503 without waiting on IEX again.
+#   A refusal is never MISSING, or every symbol would have no data for an hour once the key is fixed
+# While a miss is remembered the caller gets the result it got the first time without an upstream call.
+# Callers count each upstream call skipped that way with avoided(), for /metrics
+
+MISSING = "missing"
+FAILED = "failed"
+
+# Misses each worker remembers, the least recently used is forgotten first
+NEGATIVE_CACHE_SIZE = int(os.environ.get("NEGATIVE_CACHE_SIZE", 10000))
+
+# Seconds a definitive miss is remembered, symbols start trading and closes get published eventually
+NEGATIVE_TTL_MISSING = float(os.environ.get("NEGATIVE_TTL_MISSING", 60 * 60))
+
+# Seconds a failed call is remembered, short as it may work on the next try
+NEGATIVE_TTL_FAILED = float(os.environ.get("NEGATIVE_TTL_FAILED", 15))
+
+TTLS = {MISSING: NEGATIVE_TTL_MISSING, FAILED: NEGATIVE_TTL_FAILED}
+
+
+class NegativeCache:
+    """Thread safe LRU cache of key -> (MISSING or FAILED, days or None for all of them, expires at)"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # (namespace, kind) -> upstream calls skipped
+        self.skipped = Counter()
+        self.evicted = 0
+
+    def get(self, key):
+        """
+        Returns (MISSING or FAILED, the days that missed or None if all of them) if key missed recently,
+        None if it should be asked for
+        """
+        if self.maxsize <= 0:
+            return None
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[0], entry[1]
+
+    def put(self, key, kind, days=None):
+        """Remembers that key missed (only on days, if given) for the TTL of kind"""
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            entry = self.entries.get(key)
+            # Days missed a moment ago are still missing, the entry grows instead of being replaced
+            if days is not None and entry is not None and entry[0] == kind and entry[1] is not None \
+                    and entry[2] > time.monotonic():
+                days = entry[1] | frozenset(days)
+            elif days is not None:
+                days = frozenset(days)
+            self.entries[key] = (kind, days, time.monotonic() + TTLS[kind])
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evicted += 1
+
+    def avoided(self, namespace, kind, calls=1):
+        """Counts upstream calls of namespace skipped because of a kind of miss"""
+        with self.lock:
+            self.skipped[(namespace, kind)] += calls
+
+    def stats(self):
+        """Counters for monitoring, the upstream calls skipped by namespace and kind of miss"""
+        with self.lock:
+            stats = {f"{namespace}_{kind}_avoided": count for (namespace, kind), count in self.skipped.items()}
+            stats["size"] = len(self.entries)
+            stats["evicted"] = self.evicted
+            return stats
+
+
+misses = NegativeCache(NEGATIVE_CACHE_SIZE)
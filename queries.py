@@ -0,0 +1,68 @@
+# Queries run on every page view, kept in one place so migrate.check_plans()
+# can EXPLAIN exactly what the routes run.
+# Each one is paired with sample parameters used for the EXPLAIN
+# and the indexes its plan has to use, see migrations/
+
+# /portfolio/<portfolio_name>
+# One row per (symbol, price, date) purchase with its cost basis,
+# and the cost basis of the whole portfolio on every row
+PORTFOLIO_LOTS = """
+SELECT symbol, SUM(purchase_quantity) AS sum_shares, purchase_price, purchase_date,
+       SUM(purchase_quantity * purchase_price) AS cost_basis,
+       SUM(SUM(purchase_quantity * purchase_price)) OVER () AS portfolio_cost
+FROM shares WHERE id=(%s) AND portfolio_name=(%s)
+GROUP BY symbol, purchase_price, purchase_date;
+"""
+
+# /portfolio/<portfolio_name>
+# The portfolio's holdings version with its snapshot if one of that version is stored, see snapshots.py.
+# No row means the user has no such portfolio
+PORTFOLIO_SNAPSHOT = """
+SELECT p.holdings_version, s.symbols, s.dates, s.quantities, s.cost_bases, s.purchase_overall,
+       s.priced_with, s.model
+FROM portfolios p
+LEFT JOIN portfolio_snapshots s ON s.portfolio_name = p.portfolio_name AND s.holdings_version = p.holdings_version
+WHERE p.id=(%s) AND p.portfolio_name=(%s);
+"""
+
+# /portfolio/<portfolio_name>/share/<unique_id>
+SHARE_LOT = """
+SELECT symbol, SUM(purchase_quantity), purchase_price, purchase_date,
+       SUM(purchase_quantity * purchase_price) AS cost_basis
+FROM shares
+WHERE id=(%s) AND symbol=(%s) AND purchase_date=(%s) AND portfolio_name=(%s)
+GROUP BY symbol, purchase_price, purchase_date;
+"""
+
+# / POST, checks the portfolio clicked has shares
+PORTFOLIO_HAS_SHARES = """
+SELECT portfolio_name FROM shares WHERE id=(%s) AND portfolio_name=(%s)
+GROUP BY portfolio_name;
+"""
+
+# / GET, every portfolio of the user with the quantity and cost basis of each symbol it holds.
+# Portfolios without shares have one row with a NULL symbol
+PORTFOLIO_HOLDINGS = """
+SELECT p.portfolio_name, s.symbol, SUM(s.purchase_quantity) AS quantity,
+       SUM(s.purchase_quantity * s.purchase_price) AS cost_basis
+FROM portfolios p LEFT JOIN shares s ON s.id = p.id AND s.portfolio_name = p.portfolio_name
+WHERE p.id=(%s)
+GROUP BY p.portfolio_name, s.symbol
+ORDER BY p.portfolio_name;
+"""
+
+# /, /portfolio, /add and /delete
+PORTFOLIO_NAMES = "SELECT portfolio_name FROM portfolios WHERE id=(%s);"
+
+# Every request with a session cookie, see sessions.py
+SESSION_LOAD = "SELECT data, expires_at FROM sessions WHERE sid=(%s) AND expires_at > now();"
+
+HOT_QUERIES = [
+    ("portfolio snapshot", PORTFOLIO_SNAPSHOT, (1, "sample"), ("portfolios_owner", "portfolio_snapshots_pkey")),
+    ("portfolio lots", PORTFOLIO_LOTS, (1, "sample"), ("shares_owner_portfolio",)),
+    ("share lot", SHARE_LOT, (1, "AAPL", "2021-08-09", "sample"), ("shares_owner_portfolio",)),
+    ("portfolio has shares", PORTFOLIO_HAS_SHARES, (1, "sample"), ("shares_owner_portfolio",)),
+    ("portfolio holdings", PORTFOLIO_HOLDINGS, (1,), ("portfolios_owner", "shares_owner_portfolio")),
+    ("portfolio names", PORTFOLIO_NAMES, (1,), ("portfolios_owner",)),
+    ("session load", SESSION_LOAD, ("sample",), ("sessions_pkey",)),
+]
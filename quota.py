@@ -0,0 +1,160 @@
+import os
+import threading
+import contextvars
+import psycopg2
+
+from collections import Counter
+from db import checkout, checkin
+from metrics import timed
+
+# https://en.wikipedia.org/wiki/Token_bucket
+# IEX bills every call in message credits out of a monthly allowance, and every gunicorn worker,
+# dyno and the quote refresher spend from the same one. A token bucket in Postgres is shared by
+# all of them: it refills at the rate the monthly allowance works out to and can hold IEX_QUOTA_BURST_HOURS
+# of it, so spikes are absorbed but a busy day can't spend the month.
+#
+# Calls are made on behalf of a caller (see set_caller):
+# - interactive calls (pages, /add) may empty the bucket
+# - background calls (quote refresher, backfill) stop while less than IEX_QUOTA_RESERVE of it is left,
+#   which keeps that share for people waiting on a page
+# - each logged in user also has a bucket of their own, so one user importing years of
+#   trades can't spend what everyone else needs
+#
+# The buckets are sized for the largest calls made, history.range_cost(): 5 years of closes of
+# one symbol cost 1303 credits, a year 260. With the defaults (5000000 a month)
+# - the shared bucket holds 41667, 31250 above the reserve, so a backfill or a worker catching up
+#   gets 5 years of 23 symbols at once and pages 31
+# - a user's bucket holds 15000, an import or history view going back 5 years for 11 symbols,
+#   and fills again in about 4 hours
+
+# Message credits per month, 0 turns the quota off
+IEX_QUOTA_MONTHLY = int(os.environ.get("IEX_QUOTA_MONTHLY", 5_000_000))
+QUOTA_RATE = IEX_QUOTA_MONTHLY / (30 * 24 * 60 * 60)
+
+# Hours of the monthly allowance the shared bucket holds
+IEX_QUOTA_BURST_HOURS = float(os.environ.get("IEX_QUOTA_BURST_HOURS", 6))
+QUOTA_BURST = QUOTA_RATE * IEX_QUOTA_BURST_HOURS * 60 * 60
+
+# Share of the bucket only interactive calls can spend
+IEX_QUOTA_RESERVE = float(os.environ.get("IEX_QUOTA_RESERVE", 0.25))
+
+# Each user's own bucket, credits per second and the most it holds
+IEX_QUOTA_USER_RATE = float(os.environ.get("IEX_QUOTA_USER_RATE", 1))
+IEX_QUOTA_USER_BURST = float(os.environ.get("IEX_QUOTA_USER_BURST", 15000))
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+# (priority, user_id) of whoever upstream calls are being made for.
+# Scripts, flask commands and the worker are background unless they say otherwise.
+# https://docs.python.org/3/library/contextvars.html
+# fetch.submit() copies context variables so calls on the thread pool keep their caller
+_caller = contextvars.ContextVar("iex_caller", default=(BACKGROUND, None))
+
+# (priority, "granted" or "denied") -> count, for this process
+counters = Counter()
+_counters_lock = threading.Lock()
+
+# https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+# Refills the bucket for the time since it was last used then takes cost from it, in one statement
+# so concurrent callers can't both spend the same tokens. No row comes back when there isn't enough.
+# A call costing more than the whole bucket only needs a full bucket, and leaves it in debt
+TAKE = """
+INSERT INTO quota_buckets AS b (name, tokens, updated_at, granted) VALUES (%(name)s, %(capacity)s - %(cost)s, now(), 1)
+ON CONFLICT (name) DO UPDATE
+SET tokens = LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at) * %(rate)s) - %(cost)s,
+    updated_at = now(),
+    granted = b.granted + 1
+WHERE LEAST(%(capacity)s, b.tokens + EXTRACT(EPOCH FROM now() - b.updated_at) * %(rate)s)
+      >= LEAST(%(cost)s, %(capacity)s) + %(floor)s
+RETURNING tokens;
+"""
+
+DENIED = "UPDATE quota_buckets SET denied = denied + 1 WHERE name = %s;"
+
+
+def set_caller(priority, user_id=None):
+    """Marks upstream calls made from here on (in this context) as being for priority and user_id"""
+    return _caller.set((priority, user_id))
+
+
+def get_caller():
+    """Returns (priority, user_id) upstream calls are currently made for"""
+    return _caller.get()
+
+
+def acquire(cost=1):
+    """
+    Takes cost message credits from the shared quota for the current caller.
+    Returns False if the caller's priority or their own bucket doesn't allow it right now
+    """
+
+    if IEX_QUOTA_MONTHLY <= 0:
+        return True
+
+    priority, user_id = _caller.get()
+
+    buckets = []
+    if user_id is not None:
+        buckets.append({"name": f"user:{user_id}", "cost": cost, "capacity": IEX_QUOTA_USER_BURST,
+                        "rate": IEX_QUOTA_USER_RATE, "floor": 0})
+    buckets.append({"name": "global", "cost": cost, "capacity": QUOTA_BURST, "rate": QUOTA_RATE,
+                    "floor": QUOTA_BURST * IEX_QUOTA_RESERVE if priority == BACKGROUND else 0})
+
+    # A connection of its own, this can run on the fetch threads and
+    # shouldn't commit or roll back anything of the request's
+    conn = checkout()
+    try:
+        cur = conn.cursor()
+        # Every bucket pays or none of them do
+        denied_by = None
+        with timed("quota"):
+            for bucket in buckets:
+                cur.execute(TAKE, bucket)
+                if cur.fetchone() is None:
+                    denied_by = bucket["name"]
+                    break
+
+        if denied_by is None:
+            conn.commit()
+        else:
+            conn.rollback()
+            cur.execute(DENIED, (denied_by,))
+            conn.commit()
+        cur.close()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        checkin(conn)
+
+    with _counters_lock:
+        counters[(priority, "granted" if denied_by is None else "denied")] += 1
+    return denied_by is None
+
+
+def quota_stats():
+    """Counters of this process plus the state of the shared bucket, for monitoring"""
+
+    conn = checkout()
+    try:
+        cur = conn.cursor()
+        cur.execute("""
+        SELECT LEAST(%s, tokens + EXTRACT(EPOCH FROM now() - updated_at) * %s), granted, denied
+        FROM quota_buckets WHERE name = 'global';
+        """, (QUOTA_BURST, QUOTA_RATE))
+        row = cur.fetchone()
+        cur.execute("SELECT count(*) FROM quota_buckets WHERE name LIKE 'user:%' AND denied > 0;")
+        throttled_users = cur.fetchone()[0]
+        cur.close()
+    finally:
+        checkin(conn)
+
+    with _counters_lock:
+        stats = {f"{priority}_{outcome}": count for (priority, outcome), count in counters.items()}
+
+    stats["capacity"] = QUOTA_BURST
+    stats["rate"] = QUOTA_RATE
+    stats["tokens"], stats["granted"], stats["denied"] = (float(row[0]), row[1], row[2]) if row else (QUOTA_BURST, 0, 0)
+    stats["throttled_users"] = throttled_users
+    return stats
@@ -0,0 +1,215 @@
+import os
+import threading
+
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from db import db_select, db_commit, db_commit_many
+from market import market_open, next_open
+
+# Latest prices are the same for every user holding a symbol, so they are cached
+# by symbol instead of per user in the session.
+# Two tiers:
+# 1. An in-process LRU cache so repeat views in a worker skip the database
+# 2. The quotes table which every gunicorn worker (and dyno) reads and writes
+
+# While the market is open quotes are reused for this many seconds
+QUOTE_TTL_OPEN = int(os.environ.get("QUOTE_TTL_OPEN", 60))
+
+# Maximum number of symbols held in each worker's in-process cache
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", 2048))
+
+
+def quote_expiry(now=None):
+    """
+    Returns when a quote fetched now stops being valid.
+    Short while the market is open, until the next open when it is closed
+    because the latest price can't change before then
+    """
+    if now is None:
+        now = datetime.now(timezone.utc)
+
+    if market_open(now):
+        return now + timedelta(seconds=QUOTE_TTL_OPEN)
+    return next_open(now).astimezone(timezone.utc)
+
+
+class QuoteCache:
+    """Thread safe LRU cache of symbol -> (price, fetched_at, expires_at)"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, symbol, now=None):
+        """Returns the cached entry for symbol or None if missing or expired"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        with self.lock:
+            entry = self.entries.get(symbol)
+            if entry is None or entry[2] <= now:
+                self.misses += 1
+                return None
+            # Most recently used moves to the end, the front is evicted first
+            self.entries.move_to_end(symbol)
+            self.hits += 1
+            return entry
+
+    def peek(self, symbol, now=None):
+        """get() without counting towards the hit/miss counters"""
+        if now is None:
+            now = datetime.now(timezone.utc)
+
+        with self.lock:
+            entry = self.entries.get(symbol)
+            if entry is None or entry[2] <= now:
+                return None
+            return entry
+
+    def put(self, symbol, price, fetched_at, expires_at):
+        """Stores a quote, evicting the least recently used symbol when full"""
+        with self.lock:
+            self.entries[symbol] = (price, fetched_at, expires_at)
+            self.entries.move_to_end(symbol)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """Counters for monitoring how well the cache is doing"""
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+quote_cache = QuoteCache(QUOTE_CACHE_SIZE)
+
+# Lookups that missed this worker's cache but were found in the quotes table
+shared_hits = 0
+
+
+def cached_quote(symbol):
+    """Returns a still valid cached price for symbol or None"""
+
+    global shared_hits
+
+    symbol = symbol.upper()
+
+    entry = quote_cache.get(symbol)
+    if entry:
+        return entry[0]
+
+    # Another worker may have fetched it already
+    rows = db_select("SELECT price, fetched_at, expires_at FROM quotes \
+                        WHERE symbol=(%s) AND expires_at > now();", (symbol,))
+    if not rows:
+        return None
+
+    price = float(rows[0][0])
+    quote_cache.put(symbol, price, rows[0][1], rows[0][2])
+    shared_hits += 1
+    return price
+
+
+def cached_quotes(symbols):
+    """Returns {symbol: price} for every symbol with a still valid cached price"""
+
+    global shared_hits
+
+    prices = {}
+    missing = []
+    for symbol in symbols:
+        entry = quote_cache.get(symbol)
+        if entry:
+            prices[symbol] = entry[0]
+        else:
+            missing.append(symbol)
+
+    if not missing:
+        return prices
+
+    # One query for every symbol this worker doesn't have
+    # https://www.psycopg.org/docs/usage.html#lists-adaptation
+    rows = db_select("SELECT symbol, price, fetched_at, expires_at FROM quotes \
+                        WHERE symbol = ANY(%s) AND expires_at > now();", (missing,))
+    for row in rows:
+        price = float(row[1])
+        quote_cache.put(row[0], price, row[2], row[3])
+        prices[row[0]] = price
+        shared_hits += 1
+
+    return prices
+
+
+def quote_versions(symbols):
+    """
+    Returns {symbol: fetched_at as a POSIX timestamp} for every symbol with a still valid
+    cached price without fetching anything, used to tell whether a page priced earlier is still current
+    """
+
+    versions = {}
+    missing = []
+    for symbol in symbols:
+        entry = quote_cache.peek(symbol)
+        if entry:
+            versions[symbol] = entry[1].timestamp()
+        else:
+            missing.append(symbol)
+
+    if missing:
+        # Loads any the quotes table has into this worker's cache
+        cached_quotes(missing)
+        for symbol in missing:
+            entry = quote_cache.peek(symbol)
+            if entry:
+                versions[symbol] = entry[1].timestamp()
+
+    return versions
+
+
+def store_quote(symbol, price):
+    """Saves a freshly fetched price in both cache tiers"""
+
+    symbol = symbol.upper()
+    fetched_at = datetime.now(timezone.utc)
+    expires_at = quote_expiry(fetched_at)
+
+    quote_cache.put(symbol, price, fetched_at, expires_at)
+
+    # https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+    db_commit("""
+    INSERT INTO quotes (symbol, price, fetched_at, expires_at) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (symbol) DO UPDATE
+    SET price = EXCLUDED.price, fetched_at = EXCLUDED.fetched_at, expires_at = EXCLUDED.expires_at;
+    """,
+    (symbol, price, fetched_at, expires_at), sticky=False)
+
+
+def store_quotes(prices):
+    """Saves many freshly fetched {symbol: price} in both cache tiers with one statement"""
+
+    if not prices:
+        return
+
+    fetched_at = datetime.now(timezone.utc)
+    expires_at = quote_expiry(fetched_at)
+
+    rows = []
+    for symbol, price in prices.items():
+        quote_cache.put(symbol, price, fetched_at, expires_at)
+        rows.append((symbol, price, fetched_at, expires_at))
+
+    db_commit_many("""
+    INSERT INTO quotes (symbol, price, fetched_at, expires_at) VALUES %s
+    ON CONFLICT (symbol) DO UPDATE
+    SET price = EXCLUDED.price, fetched_at = EXCLUDED.fetched_at, expires_at = EXCLUDED.expires_at;
+    """,
+    rows, sticky=False)
+
+
+def quote_stats():
+    """Hit/miss counters of the quote cache"""
+    stats = quote_cache.stats()
+    stats["shared_hits"] = shared_hits
+    return stats
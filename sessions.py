@@ -0,0 +1,171 @@
+import os
+import time
+import secrets
+
+from datetime import datetime, timedelta, timezone
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SecureCookieSession, SecureCookieSessionInterface
+from db import db_select, db_commit
+from queries import SESSION_LOAD
+
+# https://flask.palletsprojects.com/en/2.0.x/api/#session-interface
+# The filesystem store of Flask-Session kept a pickle file per session on the dyno's disk,
+# so another dyno (or a restarted one) couldn't see it and files were never cleaned up.
+# SESSION_BACKEND chooses where sessions live instead:
+#   postgres   - a row in the sessions table shared by every worker, the cookie only holds its id
+#   cookie     - Flask's signed cookie, nothing stored server side (needs SECRET_KEY)
+#   filesystem - the old Flask-Session store, for local development
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "postgres")
+
+# Sessions expire after this many seconds without being used
+SESSION_LIFETIME = timedelta(seconds=int(os.environ.get("SESSION_LIFETIME", 7 * 24 * 60 * 60)))
+
+# Expired rows are deleted at most once every this many seconds per worker
+SESSION_SWEEP_INTERVAL = float(os.environ.get("SESSION_SWEEP_INTERVAL", 15 * 60))
+
+# The only keys a session holds, the logged in user and flash messages waiting to be shown.
+# Anything else is dropped on save so sessions stay a few bytes however the app uses them
+SESSION_KEYS = ("user_id", "_flashes")
+
+# Public endpoints answered the same for everyone, their requests aren't given the stored session
+SESSIONLESS_PATHS = ("/symbols",)
+
+
+def compact(session):
+    """Removes every key that isn't in SESSION_KEYS from the session"""
+    for key in [key for key in session if key not in SESSION_KEYS]:
+        del session[key]
+
+
+class DatabaseSession(SecureCookieSession):
+    """A session kept in the sessions table, tracks modified/accessed like Flask's cookie session"""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        # None until the session is first saved
+        self.sid = sid
+        self.expires_at = expires_at
+        # Who the session belonged to when it was loaded, see save_session
+        self.loaded_user = (initial or {}).get("user_id")
+
+
+class PostgresSessionInterface(SessionInterface):
+    """Stores sessions as rows of the sessions table, the cookie holds a random session id"""
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self):
+        self.last_sweep = 0
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+
+        # Static files and the symbol autocomplete never look at the session, don't spend a query on them.
+        # open_session runs before the url is matched so the path is checked instead
+        if not sid or request.path.startswith(app.static_url_path + "/") or request.path in SESSIONLESS_PATHS:
+            return DatabaseSession()
+
+        # From the primary, a session saved by the previous request may not be on a replica yet
+        rows = db_select(SESSION_LOAD, (sid,), primary=True)
+        if not rows:
+            # Unknown or expired, start a new session rather than trust the id
+            return DatabaseSession()
+
+        data, expires_at = rows[0]
+        try:
+            data = self.serializer.loads(data)
+        except ValueError:
+            return DatabaseSession()
+        return DatabaseSession(data, sid, expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        # Logged out with nothing left to show, the row and the cookie go
+        if not session:
+            if session.modified and session.sid:
+                db_commit("DELETE FROM sessions WHERE sid=(%s);", (session.sid,))
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if session.accessed:
+            response.vary.add("Cookie")
+
+        now = datetime.now(timezone.utc)
+
+        # Reading a session is free, it is only written when it changed
+        # or when more than half of its lifetime has gone by
+        if not session.modified and session.sid and session.expires_at - now > SESSION_LIFETIME / 2:
+            return
+
+        compact(session)
+
+        # https://owasp.org/www-community/attacks/Session_fixation
+        # A new id every time the session changes hands, the id someone had before logging in
+        # is no use once they have
+        new_sid = session.sid is None or session.get("user_id") != session.loaded_user
+        if new_sid:
+            if session.sid:
+                db_commit("DELETE FROM sessions WHERE sid=(%s);", (session.sid,))
+            session.sid = secrets.token_urlsafe(32)
+
+        db_commit("""
+        INSERT INTO sessions (sid, data, expires_at) VALUES (%s, %s, %s)
+        ON CONFLICT (sid) DO UPDATE SET data = EXCLUDED.data, expires_at = EXCLUDED.expires_at;
+        """,
+        (session.sid, self.serializer.dumps(dict(session)), now + SESSION_LIFETIME))
+
+        if new_sid:
+            response.set_cookie(name, session.sid,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                domain=domain,
+                                path=path,
+                                secure=self.get_cookie_secure(app),
+                                samesite=self.get_cookie_samesite(app))
+
+        # Only the writes pay for cleaning up, and only every so often
+        if time.monotonic() - self.last_sweep > SESSION_SWEEP_INTERVAL:
+            self.last_sweep = time.monotonic()
+            sweep()
+
+
+class CompactCookieSessionInterface(SecureCookieSessionInterface):
+    """Flask's signed cookie session, limited to SESSION_KEYS"""
+
+    def save_session(self, app, session, response):
+        compact(session)
+        super().save_session(app, session, response)
+
+
+def sweep():
+    """Deletes expired sessions from the sessions table"""
+    db_commit("DELETE FROM sessions WHERE expires_at < now();", (), sticky=False)
+
+
+def init_sessions(app):
+    """Sets up the session backend chosen by SESSION_BACKEND on the app"""
+
+    if SESSION_BACKEND == "postgres":
+        app.session_interface = PostgresSessionInterface()
+
+    elif SESSION_BACKEND == "cookie":
+        # https://flask.palletsprojects.com/en/2.0.x/config/#SECRET_KEY
+        # The cookie is signed with the secret key so it can't be edited to log in as someone else
+        if not os.environ.get("SECRET_KEY"):
+            raise RuntimeError("SECRET_KEY not set")
+        app.secret_key = os.environ["SECRET_KEY"]
+        # A signed cookie older than this is rejected when it is read
+        app.permanent_session_lifetime = SESSION_LIFETIME
+        app.session_interface = CompactCookieSessionInterface()
+
+    elif SESSION_BACKEND == "filesystem":
+        # https://flask-session.readthedocs.io/en/latest/#configuration
+        from flask_session import Session
+        app.config["SESSION_TYPE"] = "filesystem"
+        Session(app)
+
+    else:
+        raise RuntimeError(f"Unknown SESSION_BACKEND {SESSION_BACKEND}")
@@ -0,0 +1,123 @@
+import json
+import hashlib
+import queries
+
+from db import db_select, db_commit
+
+# The /portfolio/<portfolio_name> page is computed from the portfolio's lots and the quotes of
+# the symbols held, and neither changes on most views. Each portfolio keeps a snapshot in
+# portfolio_snapshots of
+# - the lots as column arrays (symbols, dates, quantities, cost bases) and their total cost,
+#   built from PORTFOLIO_LOTS once per change to the holdings
+# - the render model portfolio_model() last returned and the quotes it was priced with
+#
+# A view whose quotes haven't moved renders the stored model without reading the shares table,
+# looking up prices or recomputing anything. When a quote has moved only the market side is
+# computed again, over the stored columns, and the model is replaced.
+#
+# Every write to a portfolio's shares calls invalidate(), which bumps portfolios.holdings_version.
+# A snapshot is only used while it was built from the current version, so one built from lots
+# read just before a purchase was added is never shown after it. Deleting a portfolio or an
+# account removes its snapshot through the foreign keys.
+
+
+def load_snapshot(id, portfolio_name):
+    """
+    Returns None if the user has no such portfolio, else a dict with its 'holdings_version'
+    and, if a snapshot of that version is stored, its 'symbols', 'dates', 'quantities',
+    'cost_bases', 'purchase_overall', 'priced_with' and 'model' ('symbols' is None otherwise)
+    """
+
+    rows = db_select(queries.PORTFOLIO_SNAPSHOT, (id, portfolio_name))
+    if not rows:
+        return None
+
+    version, symbols, dates, quantities, cost_bases, purchase_overall, priced_with, model = rows[0]
+    return {
+        "holdings_version": version,
+        "symbols": symbols,
+        "dates": dates,
+        "quantities": quantities,
+        "cost_bases": cost_bases,
+        "purchase_overall": purchase_overall,
+        "priced_with": priced_with,
+        "model": json.loads(model) if model else None,
+    }
+
+
+def build_snapshot(id, portfolio_name, version):
+    """
+    Reads the portfolio's lots into a snapshot of holdings_version version and stores it.
+    Returns the snapshot as load_snapshot() would or None if the portfolio has no shares
+    """
+
+    # Cost basis of each purchase and of the whole portfolio are summed by the database
+    shares = db_select(queries.PORTFOLIO_LOTS, (id, portfolio_name))
+    if not shares:
+        return None
+
+    snapshot = {
+        "holdings_version": version,
+        "symbols": [row[0] for row in shares],
+        "dates": [row[3] for row in shares],
+        "quantities": [float(row[1]) for row in shares],
+        "cost_bases": [float(row[4]) for row in shares],
+        "purchase_overall": float(shares[0][5]),
+        "priced_with": None,
+        "model": None,
+    }
+
+    # https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+    # A slower view that read older lots can't replace a newer snapshot
+    db_commit("""
+    INSERT INTO portfolio_snapshots
+    (portfolio_name, id, holdings_version, symbols, dates, quantities, cost_bases, purchase_overall)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (portfolio_name) DO UPDATE
+    SET holdings_version = EXCLUDED.holdings_version, symbols = EXCLUDED.symbols, dates = EXCLUDED.dates,
+        quantities = EXCLUDED.quantities, cost_bases = EXCLUDED.cost_bases,
+        purchase_overall = EXCLUDED.purchase_overall, priced_with = NULL, model = NULL
+    WHERE portfolio_snapshots.holdings_version < EXCLUDED.holdings_version;
+    """,
+    (portfolio_name, id, version, snapshot["symbols"], snapshot["dates"], snapshot["quantities"],
+     snapshot["cost_bases"], snapshot["purchase_overall"]), sticky=False)
+
+    return snapshot
+
+
+def pricing_key(symbols, versions):
+    """
+    Identifies the quotes a model is priced with from quote_versions() of its symbols,
+    None if some symbol has no cached quote
+    """
+    held = sorted(set(symbols))
+    if any(symbol not in versions for symbol in held):
+        return None
+    return hashlib.sha256(repr([(symbol, versions[symbol]) for symbol in held]).encode()).hexdigest()
+
+
+def save_model(portfolio_name, snapshot, priced_with, model):
+    """Stores the render model of a snapshot priced with the quotes identified by priced_with"""
+
+    # Dropped if the holdings changed while it was being computed
+    db_commit("""
+    UPDATE portfolio_snapshots SET priced_with = (%s), model = (%s)
+    WHERE portfolio_name = (%s) AND holdings_version = (%s);
+    """,
+    (priced_with, json.dumps(model), portfolio_name, snapshot["holdings_version"]), sticky=False)
+
+
+def invalidate(id, portfolio_names):
+    """Marks the snapshots of the user's portfolio_names out of date, called after every write to shares"""
+
+    # https://www.postgresql.org/docs/current/queries-with.html#QUERIES-WITH-MODIFYING
+    # The stale snapshots are removed in the same statement
+    db_commit("""
+    WITH bumped AS (
+        UPDATE portfolios SET holdings_version = holdings_version + 1
+        WHERE id = (%s) AND portfolio_name = ANY(%s)
+        RETURNING portfolio_name
+    )
+    DELETE FROM portfolio_snapshots WHERE portfolio_name IN (SELECT portfolio_name FROM bumped);
+    """,
+    (id, list(portfolio_names)))
@@ -1,10 +1,71 @@
-// Find every bar on the page
-var bars = document.querySelectorAll(".bar");
-
-// For each bar add eventlistener that changes current window location to the value of the attribute data-link
-// which will link to /portfolio/<portfolio_name>/share/<unique_id>
-for(var i = 0; i < bars.length; i++) {
-    bars[i].addEventListener("click", function(){
-        window.location.href = this.getAttribute("data-link");
-    });
+// One listener on the bar for every bar element in it, rather than one per bar
+// https://developer.mozilla.org/en-US/docs/Learn/JavaScript/Building_blocks/Events#event_delegation
+var fullBar = document.getElementById("full_bar");
+
+// Next page of the lots in the others bar to load, see loadLots()
+var lotsUrl = null;
+var lotsPage = 1;
+
+// Clicking a bar changes current window location to the value of the attribute data-link
+// which will link to /portfolio/<portfolio_name>/share/<unique_id>,
+// the others bar lists the lots it stands for instead
+fullBar.addEventListener("click", function(event) {
+    var bar = event.target.closest(".bar");
+    if (!bar) {
+        return;
+    }
+    if (bar.hasAttribute("data-lots")) {
+        if (lotsUrl === null) {
+            lotsUrl = bar.getAttribute("data-lots");
+            loadLots();
+        }
+        document.getElementById("others_lots").hidden = false;
+        return;
+    }
+    window.location.href = bar.getAttribute("data-link");
+});
+
+// Appends the next page of /portfolio/<portfolio_name>/lots to the table below the bar
+function loadLots() {
+    var more = document.getElementById("more_lots");
+    more.disabled = true;
+
+    fetch(lotsUrl + "?page=" + lotsPage, {credentials: "same-origin"})
+        .then(function(response) {
+            return response.json();
+        })
+        .then(function(data) {
+            var body = document.querySelector("#others_lots tbody");
+            data.lots.forEach(function(lot) {
+                var row = document.createElement("tr");
+                var link = document.createElement("a");
+                link.href = lot.link;
+                link.textContent = lot.symbol;
+
+                var cells = [link, lot.date, lot.net_change_usd, (lot.contribution > 0 ? "+" : "") + lot.contribution + "%"];
+                cells.forEach(function(value) {
+                    var cell = document.createElement("td");
+                    if (typeof value === "string") {
+                        cell.textContent = value;
+                    } else {
+                        cell.appendChild(value);
+                    }
+                    row.appendChild(cell);
+                });
+                row.className = lot.contribution > 0 ? "gain_title" : "loss_title";
+                body.appendChild(row);
+            });
+
+            lotsPage = data.page + 1;
+            more.hidden = lotsPage > data.pages;
+            more.disabled = false;
+        })
+        .catch(function() {
+            more.disabled = false;
+        });
+}
+
+var moreLots = document.getElementById("more_lots");
+if (moreLots) {
+    moreLots.addEventListener("click", loadLots);
 }
\ No newline at end of file
@@ -0,0 +1,41 @@
+// Suggests symbols as they are typed into the /add form, from /symbols?prefix=
+// https://developer.mozilla.org/en-US/docs/Web/HTML/Element/datalist
+var symbolInput = document.getElementById("symbol");
+var symbolList = document.getElementById("symbol_list");
+
+// Only the answer to the latest prefix typed is shown, see showSymbols()
+var latestPrefix = "";
+
+symbolInput.addEventListener("input", function() {
+    var prefix = symbolInput.value.trim().toUpperCase();
+    latestPrefix = prefix;
+    if (!prefix) {
+        symbolList.innerHTML = "";
+        return;
+    }
+
+    fetch("/symbols?prefix=" + encodeURIComponent(prefix))
+        .then(function(response) {
+            return response.json();
+        })
+        .then(function(data) {
+            showSymbols(prefix, data.symbols);
+        })
+        .catch(function() {
+            // No suggestions, the symbol can still be typed in full
+        });
+});
+
+// Replaces the suggestions unless something else has been typed since prefix
+function showSymbols(prefix, symbols) {
+    if (prefix !== latestPrefix) {
+        return;
+    }
+    symbolList.innerHTML = "";
+    symbols.forEach(function(symbol) {
+        var option = document.createElement("option");
+        option.value = symbol.symbol;
+        option.label = symbol.name;
+        symbolList.appendChild(option);
+    });
+}
@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+
+from bisect import bisect_left
+from db import db_select, db_commit
+from iex import iex_get
+
+# https://iexcloud.io/docs/api/#symbols
+# The symbols IEX supports, about 10 000 of them, change a few times a day at most.
+# The list is fetched once a day (worker.py, or flask refresh-symbols) into the single row of
+# symbol_list, which every worker and dyno reads. Each worker process keeps it in memory as two
+# sorted tuples so
+# - /add and imports reject a symbol that doesn't exist before anything is asked of IEX
+# - /symbols?prefix= autocompletes the /add form with a binary search, no query or upstream call
+# The tuples are only ever replaced as a whole, never changed, so requests on any thread read
+# them without a lock. Workers check symbol_list for a newer refresh every SYMBOLS_CHECK_INTERVAL.
+# Until the list has been fetched once every symbol is accepted and IEX decides as before.
+
+# Seconds between refreshes of the list from IEX
+SYMBOLS_REFRESH_INTERVAL = int(os.environ.get("SYMBOLS_REFRESH_INTERVAL", 24 * 60 * 60))
+
+# Seconds a worker uses its copy before checking symbol_list for a newer one
+SYMBOLS_CHECK_INTERVAL = int(os.environ.get("SYMBOLS_CHECK_INTERVAL", 300))
+
+# Suggestions returned for a prefix
+SYMBOLS_LIMIT = 10
+
+# https://iexcloud.io/docs/api/#data-weighting
+SYMBOLS_COST = 100
+
+
+class SymbolIndex:
+    """Sorted symbols and their company names, read only once built"""
+
+    def __init__(self, symbols=(), names=(), refreshed_at=None):
+        pairs = sorted(zip(symbols, names))
+        self.symbols = tuple(pair[0] for pair in pairs)
+        self.names = tuple(pair[1] for pair in pairs)
+        self.refreshed_at = refreshed_at
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, symbol):
+        i = bisect_left(self.symbols, symbol)
+        return i < len(self.symbols) and self.symbols[i] == symbol
+
+    def complete(self, prefix, limit=SYMBOLS_LIMIT):
+        """[(symbol, name), ...] of the first limit symbols starting with prefix, alphabetically"""
+
+        # Every symbol starting with prefix sorts right after where prefix itself would go
+        i = bisect_left(self.symbols, prefix)
+        matches = []
+        while i < len(self.symbols) and len(matches) < limit and self.symbols[i].startswith(prefix):
+            matches.append((self.symbols[i], self.names[i]))
+            i += 1
+        return matches
+
+
+# This process' copy, when it was last checked against symbol_list
+_index = SymbolIndex()
+_checked_at = None
+_lock = threading.Lock()
+
+
+def get_index():
+    """This process' SymbolIndex, reloaded from symbol_list if a newer list was stored since it was last checked"""
+
+    global _index, _checked_at
+
+    if _checked_at is not None and time.monotonic() - _checked_at < SYMBOLS_CHECK_INTERVAL:
+        return _index
+
+    # One check at a time, the others keep using the current copy meanwhile
+    if not _lock.acquire(blocking=False):
+        return _index
+    try:
+        # Only the timestamp unless it changed, the arrays are a few hundred kB
+        rows = db_select("SELECT refreshed_at FROM symbol_list;", ())
+        if rows and rows[0][0] != _index.refreshed_at:
+            rows = db_select("SELECT refreshed_at, symbols, names FROM symbol_list;", ())
+            refreshed_at, symbols, names = rows[0]
+            _index = SymbolIndex(symbols, names, refreshed_at)
+        _checked_at = time.monotonic()
+    finally:
+        _lock.release()
+    return _index
+
+
+def known_symbol(symbol):
+    """False if symbol isn't one IEX supports, True if it is or the list hasn't been fetched yet"""
+    index = get_index()
+    return not index or symbol in index
+
+
+def symbols_stale():
+    """True if the list was never fetched or is older than SYMBOLS_REFRESH_INTERVAL"""
+    rows = db_select("""
+    SELECT refreshed_at < now() - make_interval(secs => %s) FROM symbol_list;
+    """, (SYMBOLS_REFRESH_INTERVAL,), primary=True)
+    return not rows or rows[0][0]
+
+
+def refresh_symbols():
+    """
+    Fetches the symbols IEX supports into symbol_list, returns how many were stored.
+    Raises UpstreamUnavailable if IEX didn't answer, an empty answer leaves the stored list alone
+    """
+
+    listing = iex_get("/ref-data/symbols", cost=SYMBOLS_COST)
+    enabled = {}
+    for row in listing or []:
+        if row.get("symbol") and row.get("isEnabled", True):
+            enabled[row["symbol"].upper()] = row.get("name") or ""
+    if not enabled:
+        return 0
+
+    # https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+    db_commit("""
+    INSERT INTO symbol_list (id, refreshed_at, symbols, names) VALUES (TRUE, now(), %s, %s)
+    ON CONFLICT (id) DO UPDATE
+    SET refreshed_at = EXCLUDED.refreshed_at, symbols = EXCLUDED.symbols, names = EXCLUDED.names;
+    """,
+    (list(enabled), list(enabled.values())), sticky=False)
+
+    return len(enabled)
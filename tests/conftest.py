@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The modules live at the repo root and db.py reads DATABASE_URL on import.
+# These tests never connect, anything needing the database is replaced in the test
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DATABASE_URL", "postgresql://localhost/unused")
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from analytics import portfolio_model, ranked, others_page
+from benchmarks.portfolio_analytics import legacy_model, synthetic
+
+
+def columns(lots):
+    """synthetic() lots as portfolio_model() takes them, with the legacy loop's columns"""
+    symbols, dates, quantities, purchase_prices, current_prices = synthetic(lots)
+    cost_bases = [quantity * price for quantity, price in zip(quantities, purchase_prices)]
+    return (symbols, dates, quantities, purchase_prices, current_prices), \
+        (symbols, dates, quantities, cost_bases, current_prices)
+
+
+def test_matches_the_legacy_loop():
+    legacy_columns, model_columns = columns(500)
+    legacy = legacy_model(*legacy_columns)
+    model = portfolio_model(*model_columns)
+
+    for key in ("net_overall", "current_overall", "purchase_overall"):
+        assert model[key] == pytest.approx(legacy[key])
+    assert model["net_overallpercent"] == legacy["net_overallpercent"]
+    assert model["others"] is None
+
+    # Rounding of exact halves can differ in the last place
+    assert [j["unique_id"] for j in model["x"]] == [j["unique_id"] for j in legacy["x"]]
+    for a, b in zip(model["x"], legacy["x"]):
+        assert a["flex"] == pytest.approx(b["flex"], abs=1e-4)
+        assert a["contribution"] == pytest.approx(b["contribution"], abs=1e-2)
+
+
+@pytest.mark.parametrize("top_n", [1, 5, 20])
+def test_ranked_finds_the_biggest_gains_and_losses(top_n):
+    net_change = np.random.default_rng(top_n).normal(size=300)
+    gainers, losers, rest = ranked(net_change, top_n)
+
+    order = np.argsort(-net_change)
+    assert gainers.tolist() == order[:top_n].tolist()
+    assert losers.tolist() == order[-top_n:].tolist()
+    assert rest.sum() == 300 - 2 * top_n
+    assert not rest[gainers].any() and not rest[losers].any()
+
+
+def test_ranked_sorts_everything_when_there_are_few_lots():
+    net_change = np.array([1.0, -2.0, 3.0, 1.0])
+    gainers, losers, rest = ranked(net_change, 2)
+    # Ties keep the order they were given
+    assert gainers.tolist() == [2, 0, 3, 1]
+    assert losers is None
+    assert not rest.any()
+
+
+def test_others_bar_sums_the_lots_between():
+    _, model_columns = columns(200)
+    full = portfolio_model(*model_columns)
+    top = portfolio_model(*model_columns, top_n=10)
+
+    assert len(top["x"]) == 20
+    assert top["others"]["count"] == 180
+    assert top["others"]["position"] == 10
+    assert [j["unique_id"] for j in top["x"][:10]] == [j["unique_id"] for j in full["x"][:10]]
+    assert [j["unique_id"] for j in top["x"][10:]] == [j["unique_id"] for j in full["x"][-10:]]
+    between = sum(j["contribution"] for j in full["x"][10:-10])
+    assert top["others"]["contribution"] == pytest.approx(between, abs=0.01 * 180)
+
+
+def test_others_page_lists_the_lots_between_in_order():
+    _, model_columns = columns(200)
+    full = portfolio_model(*model_columns)
+    purchase_overall = full["purchase_overall"]
+
+    listed = []
+    for page in (1, 2, 3, 4):
+        lots, total = others_page(*model_columns, purchase_overall, 10, page, 50)
+        assert total == 180
+        listed += lots
+    assert [lot["unique_id"] for lot in listed] == [j["unique_id"] for j in full["x"][10:-10]]
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+import iex
+from iex import IEXClient, UpstreamUnavailable, QuotaExceeded
+
+
+class Response:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.body = body
+        self.headers = {}
+
+    def json(self):
+        return self.body
+
+
+def client(statuses, body=None, threshold=3, cooldown=60, delay=0):
+    """IEXClient answering each call with the next of statuses, and the session's calls so far"""
+    c = IEXClient(base_url="http://iex.invalid", retries=0, backoff=0, threshold=threshold, cooldown=cooldown)
+    statuses = iter(statuses)
+    calls = []
+
+    def get(url, params, timeout):
+        calls.append(url)
+        time.sleep(delay)
+        return Response(next(statuses), body)
+
+    c.session.get = get
+    return c, calls
+
+
+@pytest.fixture(autouse=True)
+def quota(monkeypatch):
+    monkeypatch.setattr(iex, "acquire", lambda cost: True)
+
+
+def test_ok_returns_json():
+    c, _ = client([200], {"latestPrice": 1.5})
+    assert c.get("/stock/aapl/quote") == {"latestPrice": 1.5}
+
+
+@pytest.mark.parametrize("status", [400, 404])
+def test_no_data_is_none(status):
+    c, _ = client([status])
+    assert c.get("/stock/zzzz/quote") is None
+    assert c.failures == 0
+
+
+@pytest.mark.parametrize("status", [401, 402, 403])
+def test_refusals_fail_the_call(status):
+    c, calls = client([status, status])
+    with pytest.raises(UpstreamUnavailable):
+        c.get("/stock/aapl/quote")
+    # Not retried, and counted towards the breaker
+    assert len(calls) == 1
+    assert c.failures == 1
+
+
+def test_breaker_opens_after_threshold_failures():
+    c, calls = client([500] * 3)
+    for _ in range(3):
+        with pytest.raises(UpstreamUnavailable):
+            c.get("/stock/aapl/quote")
+    assert c.stats()["open"]
+
+    # Open, IEX isn't called at all
+    with pytest.raises(UpstreamUnavailable):
+        c.get("/stock/aapl/quote")
+    assert len(calls) == 3
+    assert c.rejected == 1
+
+
+def test_breaker_closes_after_a_trial_call_succeeds():
+    c, calls = client([401, 401, 200], {}, threshold=2, cooldown=0)
+    for _ in range(2):
+        with pytest.raises(UpstreamUnavailable):
+            c.get("/stock/aapl/quote")
+    assert c.stats()["open"]
+
+    assert c.get("/stock/aapl/quote") == {}
+    assert not c.stats()["open"]
+    assert len(calls) == 3
+
+
+def run_together(c, names):
+    """c.get() of the same path on a thread per name, the first one starting first. Returns {name: result}"""
+    results = {}
+
+    def run(name):
+        try:
+            results[name] = c.get("/stock/aapl/quote")
+        except UpstreamUnavailable as e:
+            results[name] = e
+
+    threads = [threading.Thread(target=run, args=(name,), name=name) for name in names]
+    threads[0].start()
+    time.sleep(0.05)
+    for thread in threads[1:]:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_identical_calls_are_sent_once():
+    c, calls = client([200], {"latestPrice": 1.5}, delay=0.2)
+    results = run_together(c, ["a", "b", "c"])
+    assert all(result == {"latestPrice": 1.5} for result in results.values())
+    assert len(calls) == 1
+    assert c.coalesced == 2
+
+
+def test_leader_quota_isnt_shared(monkeypatch):
+    # The first caller's quota is spent, the others still have theirs
+    def acquire(cost):
+        time.sleep(0.2)
+        return threading.current_thread().name != "leader"
+
+    monkeypatch.setattr(iex, "acquire", acquire)
+    c, calls = client([200], {"latestPrice": 1.5})
+    results = run_together(c, ["leader", "a", "b"])
+    assert isinstance(results["leader"], QuotaExceeded)
+    assert results["a"] == results["b"] == {"latestPrice": 1.5}
+    assert len(calls) == 1
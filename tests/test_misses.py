@@ -0,0 +1,101 @@
+from datetime import date
+
+import pytest
+
+import functions
+import misses as misses_module
+from iex import UpstreamUnavailable
+from misses import NegativeCache, MISSING, FAILED
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the clock NegativeCache reads, advance it by setting clock[0]"""
+    now = [1000.0]
+    monkeypatch.setattr(misses_module.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_failed_expires_before_missing(clock):
+    cache = NegativeCache(10)
+    cache.put(("quote", "AAPL"), FAILED)
+    cache.put(("quote", "ZZZZ"), MISSING)
+    assert cache.get(("quote", "AAPL")) == (FAILED, None)
+
+    clock[0] += misses_module.NEGATIVE_TTL_FAILED
+    assert cache.get(("quote", "AAPL")) is None
+    assert cache.get(("quote", "ZZZZ")) == (MISSING, None)
+
+    clock[0] += misses_module.NEGATIVE_TTL_MISSING
+    assert cache.get(("quote", "ZZZZ")) is None
+    assert cache.stats()["size"] == 0
+
+
+def test_days_merge_into_an_unexpired_entry(clock):
+    cache = NegativeCache(10)
+    cache.put(("close", "AAPL"), MISSING, [date(2021, 8, 9)])
+    cache.put(("close", "AAPL"), MISSING, [date(2021, 8, 10)])
+    assert cache.get(("close", "AAPL")) == (MISSING, frozenset({date(2021, 8, 9), date(2021, 8, 10)}))
+
+    # Another kind, or an expired entry, is replaced
+    cache.put(("close", "AAPL"), FAILED, [date(2021, 8, 11)])
+    assert cache.get(("close", "AAPL")) == (FAILED, frozenset({date(2021, 8, 11)}))
+    clock[0] += misses_module.NEGATIVE_TTL_FAILED
+    cache.put(("close", "AAPL"), FAILED, [date(2021, 8, 12)])
+    assert cache.get(("close", "AAPL")) == (FAILED, frozenset({date(2021, 8, 12)}))
+
+
+def test_least_recently_used_is_evicted(clock):
+    cache = NegativeCache(2)
+    cache.put("a", MISSING)
+    cache.put("b", MISSING)
+    cache.get("a")
+    cache.put("c", MISSING)
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evicted"] == 1
+
+
+def test_avoided_counts_by_namespace_and_kind():
+    cache = NegativeCache(10)
+    cache.avoided("quote", FAILED)
+    cache.avoided("quote", FAILED, 2)
+    cache.avoided("close", MISSING)
+    stats = cache.stats()
+    assert stats["quote_failed_avoided"] == 3
+    assert stats["close_missing_avoided"] == 1
+
+
+@pytest.fixture
+def latestprice(monkeypatch):
+    """functions.latestprice() with no stored quote and a cache of its own, set answer to what IEX does"""
+    cache = NegativeCache(10)
+    monkeypatch.setattr(functions, "misses", cache)
+    monkeypatch.setattr(functions, "cached_quote", lambda symbol: None)
+    monkeypatch.setattr(functions, "store_quote", lambda symbol, price: None)
+    answer = []
+
+    def iex_get(path, params=None, cost=1):
+        if isinstance(answer[0], Exception):
+            raise answer[0]
+        return answer[0]
+
+    monkeypatch.setattr(functions, "iex_get", iex_get)
+    return cache, answer
+
+
+def test_refused_quote_is_failed_not_missing(latestprice):
+    cache, answer = latestprice
+    # What IEXClient raises for a 401 or 402
+    answer.append(UpstreamUnavailable("IEX refused the request for /stock/AAPL/quote (402)"))
+    with pytest.raises(UpstreamUnavailable):
+        functions.latestprice("AAPL")
+    assert cache.get(("quote", "AAPL")) == (FAILED, None)
+
+
+def test_unknown_symbol_is_missing(latestprice):
+    cache, answer = latestprice
+    # What IEXClient returns for a 404
+    answer.append(None)
+    assert functions.latestprice("ZZZZ") is None
+    assert cache.get(("quote", "ZZZZ")) == (MISSING, None)
@@ -0,0 +1,105 @@
+import pytest
+
+import quota
+from history import range_cost
+
+
+class Cursor:
+    """Stands in for the database, each bucket named in granted has enough tokens"""
+
+    def __init__(self, granted):
+        self.granted = granted
+        self.taken = []
+        self.row = None
+
+    def execute(self, query, params):
+        if query == quota.TAKE:
+            self.taken.append(params)
+            self.row = (0,) if params["name"] in self.granted else None
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class Connection:
+    def __init__(self, cursor):
+        self.cur = cursor
+        self.committed = 0
+        self.rolled_back = 0
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.committed += 1
+
+    def rollback(self):
+        self.rolled_back += 1
+
+
+@pytest.fixture(autouse=True)
+def caller():
+    """Tests set a caller, the ones after start from the default again"""
+    yield
+    quota.set_caller(quota.BACKGROUND)
+
+
+@pytest.fixture
+def buckets(monkeypatch):
+    """The TAKE parameters of each acquire(), with the buckets named in granted allowing it"""
+
+    def use(granted):
+        cursor = Cursor(granted)
+        monkeypatch.setattr(quota, "IEX_QUOTA_MONTHLY", 5_000_000)
+        monkeypatch.setattr(quota, "checkout", lambda: Connection(cursor))
+        monkeypatch.setattr(quota, "checkin", lambda conn: None)
+        return cursor
+
+    return use
+
+
+def test_range_costs():
+    assert range_cost("5y") == 1303
+    assert range_cost("1y") == 260
+    assert range_cost("5d") == 5
+
+
+def test_user_bucket_holds_an_import_of_5_year_ranges():
+    assert quota.IEX_QUOTA_USER_BURST >= 11 * range_cost("5y")
+
+
+def test_shared_bucket_holds_more_than_a_user_can_spend():
+    assert quota.QUOTA_BURST >= quota.IEX_QUOTA_USER_BURST
+    # What a backfill or the refresher may spend above the reserve
+    assert quota.QUOTA_BURST * (1 - quota.IEX_QUOTA_RESERVE) >= 20 * range_cost("5y")
+
+
+def test_interactive_pays_from_own_and_shared_bucket(buckets):
+    cursor = buckets({"user:7", "global"})
+    quota.set_caller(quota.INTERACTIVE, 7)
+    assert quota.acquire(range_cost("5y"))
+    assert [params["name"] for params in cursor.taken] == ["user:7", "global"]
+    assert all(params["floor"] == 0 for params in cursor.taken)
+
+
+def test_background_stops_at_the_reserve(buckets):
+    cursor = buckets({"global"})
+    quota.set_caller(quota.BACKGROUND)
+    assert quota.acquire(1)
+    assert cursor.taken[0]["floor"] == quota.QUOTA_BURST * quota.IEX_QUOTA_RESERVE
+
+
+def test_denied_by_the_user_bucket(buckets):
+    cursor = buckets({"global"})
+    quota.set_caller(quota.INTERACTIVE, 7)
+    assert not quota.acquire(1)
+    # The shared bucket isn't charged for a call that isn't made
+    assert [params["name"] for params in cursor.taken] == ["user:7"]
+
+
+def test_off_without_a_monthly_quota(monkeypatch):
+    monkeypatch.setattr(quota, "IEX_QUOTA_MONTHLY", 0)
+    assert quota.acquire(10 ** 9)
@@ -0,0 +1,58 @@
+from datetime import date
+
+import pytest
+
+from trading_calendar import TradingCalendar, easter, nyse_holidays
+
+# https://www.nyse.com/markets/hours-calendars
+PUBLISHED = {
+    2021: ["01-01", "01-18", "02-15", "04-02", "05-31", "07-05", "09-06", "11-25", "12-24"],
+    2022: ["01-17", "02-21", "04-15", "05-30", "06-20", "07-04", "09-05", "11-24", "12-26"],
+    2023: ["01-02", "01-16", "02-20", "04-07", "05-29", "06-19", "07-04", "09-04", "11-23", "12-25"],
+    2024: ["01-01", "01-15", "02-19", "03-29", "05-27", "06-19", "07-04", "09-02", "11-28", "12-25"],
+    2025: ["01-01", "01-20", "02-17", "04-18", "05-26", "06-19", "07-04", "09-01", "11-27", "12-25"],
+    2026: ["01-01", "01-19", "02-16", "04-03", "05-25", "06-19", "07-03", "09-07", "11-26", "12-25"],
+    2027: ["01-01", "01-18", "02-15", "03-26", "05-31", "06-18", "07-05", "09-06", "11-25", "12-24"],
+}
+
+
+@pytest.mark.parametrize("year", sorted(PUBLISHED))
+def test_holidays_match_the_published_calendar(year):
+    expected = {date.fromisoformat(f"{year}-{day}") for day in PUBLISHED[year]}
+    assert nyse_holidays(year) == expected
+
+
+def test_easter():
+    assert easter(2021) == date(2021, 4, 4)
+    assert easter(2024) == date(2024, 3, 31)
+    assert easter(2027) == date(2027, 3, 28)
+
+
+@pytest.fixture(scope="module")
+def calendar():
+    return TradingCalendar(2020, 2027)
+
+
+def test_weekends_holidays_and_closures_arent_sessions(calendar):
+    assert calendar.is_session(date(2021, 8, 9))
+    assert not calendar.is_session(date(2021, 8, 8))
+    assert not calendar.is_session(date(2021, 11, 25))
+    # President Carter's national day of mourning
+    assert not calendar.is_session(date(2025, 1, 9))
+
+
+def test_nearest_sessions(calendar):
+    # Good Friday, then a weekend
+    assert calendar.session_on_or_before(date(2021, 4, 4)) == date(2021, 4, 1)
+    assert calendar.session_on_or_after(date(2021, 4, 2)) == date(2021, 4, 5)
+    assert calendar.session_on_or_before(date(2021, 8, 9)) == date(2021, 8, 9)
+    assert calendar.session_on_or_before(date(2020, 1, 1)) is None
+    # New Year's Day 2028 is a Saturday, the Friday before stays open
+    assert calendar.session_on_or_after(date(2027, 12, 31)) == date(2027, 12, 31)
+    assert calendar.session_on_or_after(date(2028, 1, 1)) is None
+
+
+def test_sessions_between(calendar):
+    assert calendar.sessions_between(date(2021, 12, 23), date(2021, 12, 28)) == [
+        date(2021, 12, 23), date(2021, 12, 27), date(2021, 12, 28)]
+    assert len(calendar.sessions_between(date(2023, 1, 1), date(2023, 12, 31))) == 250
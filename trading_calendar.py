@@ -0,0 +1,188 @@
+import threading
+
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+
+# https://www.nyse.com/markets/hours-calendars
+# The exchange is closed on weekends and on the NYSE holidays below.
+# Sessions for a range of years are generated once and kept in a sorted list,
+# so "nearest trading day" is a binary search instead of guessing with weekdays
+# and probing IEX until a day has a price.
+
+# Unscheduled closures that no holiday rule produces
+SPECIAL_CLOSURES = {
+    date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14),
+    # President Reagan's funeral
+    date(2004, 6, 11),
+    # President Ford's national day of mourning
+    date(2007, 1, 2),
+    # Hurricane Sandy
+    date(2012, 10, 29), date(2012, 10, 30),
+    # President George H.W. Bush's national day of mourning
+    date(2018, 12, 5),
+    # President Carter's national day of mourning
+    date(2025, 1, 9),
+}
+
+
+def easter(year):
+    """Returns Easter Sunday of year (Anonymous Gregorian algorithm)"""
+    # https://en.wikipedia.org/wiki/Date_of_Easter#Anonymous_Gregorian_algorithm
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return date(year, month, day + 1)
+
+
+def nth_weekday(year, month, weekday, n):
+    """Returns the nth (1 based) weekday (0 is Monday) of month"""
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def last_weekday(year, month, weekday):
+    """Returns the last weekday (0 is Monday) of month"""
+    if month == 12:
+        last = date(year, 12, 31)
+    else:
+        last = date(year, month + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+
+def observed(holiday):
+    """Holidays on a Saturday are observed the Friday before, on a Sunday the Monday after"""
+    if holiday.weekday() == 5:
+        return holiday - timedelta(days=1)
+    if holiday.weekday() == 6:
+        return holiday + timedelta(days=1)
+    return holiday
+
+
+def nyse_holidays(year):
+    """Returns the set of weekdays the exchange is closed in year"""
+
+    holidays = set()
+
+    # New Year's Day, when it falls on a Saturday the exchange stays open the Friday before
+    new_year = date(year, 1, 1)
+    if new_year.weekday() == 6:
+        holidays.add(new_year + timedelta(days=1))
+    elif new_year.weekday() != 5:
+        holidays.add(new_year)
+
+    # Martin Luther King Jr. Day, third Monday in January since 1998
+    if year >= 1998:
+        holidays.add(nth_weekday(year, 1, 0, 3))
+
+    # Washington's Birthday, third Monday in February
+    holidays.add(nth_weekday(year, 2, 0, 3))
+
+    # Good Friday
+    holidays.add(easter(year) - timedelta(days=2))
+
+    # Memorial Day, last Monday in May
+    holidays.add(last_weekday(year, 5, 0))
+
+    # Juneteenth, since 2022
+    if year >= 2022:
+        holidays.add(observed(date(year, 6, 19)))
+
+    # Independence Day
+    holidays.add(observed(date(year, 7, 4)))
+
+    # Labor Day, first Monday in September
+    holidays.add(nth_weekday(year, 9, 0, 1))
+
+    # Thanksgiving Day, fourth Thursday in November
+    holidays.add(nth_weekday(year, 11, 3, 4))
+
+    # Christmas Day
+    holidays.add(observed(date(year, 12, 25)))
+
+    return holidays
+
+
+class TradingCalendar:
+    """Sorted trading sessions between two years (inclusive) with O(log n) nearest session queries"""
+
+    def __init__(self, start_year, end_year):
+        self.start_year = start_year
+        self.end_year = end_year
+
+        closed = set(SPECIAL_CLOSURES)
+        for year in range(start_year, end_year + 1):
+            closed |= nyse_holidays(year)
+
+        sessions = []
+        day = date(start_year, 1, 1)
+        last = date(end_year, 12, 31)
+        while day <= last:
+            if day.weekday() < 5 and day not in closed:
+                sessions.append(day)
+            day += timedelta(days=1)
+
+        self.sessions = sessions
+        self.session_set = frozenset(sessions)
+
+    def covers(self, day):
+        """True if day is inside the years this calendar was generated for"""
+        return self.start_year <= day.year <= self.end_year
+
+    def is_session(self, day):
+        """True if the exchange trades on day"""
+        return day in self.session_set
+
+    def session_on_or_before(self, day):
+        """Returns the last session on or before day, None if there isn't one in range"""
+        i = bisect_right(self.sessions, day)
+        if i == 0:
+            return None
+        return self.sessions[i - 1]
+
+    def session_on_or_after(self, day):
+        """Returns the first session on or after day, None if there isn't one in range"""
+        i = bisect_left(self.sessions, day)
+        if i == len(self.sessions):
+            return None
+        return self.sessions[i]
+
+    def sessions_between(self, start, end):
+        """Returns every session from start to end inclusive"""
+        return self.sessions[bisect_left(self.sessions, start):bisect_right(self.sessions, end)]
+
+
+_calendar = None
+_calendar_lock = threading.Lock()
+
+
+def get_calendar(day=None):
+    """
+    Returns the process' calendar, generated for 10 years either side of today.
+    It is regenerated wider if asked about a day outside of it
+    """
+
+    global _calendar
+
+    if day is None:
+        day = date.today()
+
+    calendar = _calendar
+    if calendar is not None and calendar.covers(day):
+        return calendar
+
+    with _calendar_lock:
+        if _calendar is None or not _calendar.covers(day):
+            start = date.today().year - 10
+            end = date.today().year + 10
+            if _calendar is not None:
+                start = min(start, _calendar.start_year)
+                end = max(end, _calendar.end_year)
+            _calendar = TradingCalendar(min(start, day.year - 1), max(end, day.year + 1))
+        return _calendar
@@ -0,0 +1,137 @@
+import hashlib
+import numpy as np
+
+from bisect import bisect_left, bisect_right
+from datetime import date, timedelta
+from db import db_select, db_commit
+from history import closes_many
+from analytics import value_series
+from trading_calendar import get_calendar
+
+# A portfolio's market value on every trading day since its first purchase, for /portfolio/<name>/history.
+# Past closes never change, so the series is stored in portfolio_history and each view only computes
+# the sessions that closed since it was last extended. The stored series belongs to a fingerprint
+# of the lots it was computed from, adding or deleting a purchase changes the fingerprint and the
+# series is computed again from the start.
+# A session is only stored once every symbol held has its close for it, the sessions at the end
+# that carry a close forward (published late, or not yet) are computed again on each view.
+# A symbol that hasn't closed for CLOSE_GRACE_SESSIONS has stopped trading, its last close stands
+
+# Sessions a close can be late by before the close before it is stored in its place
+CLOSE_GRACE_SESSIONS = 5
+
+
+def lots_fingerprint(lots):
+    """Hash of (symbol, quantity, price, date) of every lot, independent of their order"""
+    canonical = sorted((symbol, int(quantity), str(price), day.isoformat()) for symbol, quantity, price, day in lots)
+    return hashlib.sha256(repr(canonical).encode()).hexdigest()
+
+
+def compute(lots, sessions):
+    """
+    value_series() of lots over sessions, reading (and if need be fetching) the closes it needs.
+    Returns (market_values, cost_bases, settled) where the first settled sessions have a close
+    for every symbol held and the rest carry one forward
+    """
+
+    if not sessions:
+        return np.zeros(0), np.zeros(0), 0
+
+    # Each symbol only needs closes from the first session it was held
+    first_held = {}
+    for symbol, _, _, day in lots:
+        first_held[symbol] = min(day, first_held.get(symbol, day))
+    wanted = {}
+    for symbol, day in first_held.items():
+        held_sessions = sessions[bisect_left(sessions, day):]
+        if held_sessions:
+            wanted[symbol] = held_sessions
+
+    closes = closes_many(wanted)
+
+    # The last session every symbol held has a close for
+    settled = len(sessions)
+    for symbol, held_sessions in wanted.items():
+        closed = [day for day, close in closes.get(symbol, {}).items() if close is not None]
+        last = max(closed) if closed else None
+        # Counts of sessions up to its last close, or up to the one before it was first held
+        settled = min(settled, bisect_right(sessions, last) if last else bisect_left(sessions, held_sessions[0]))
+    settled = max(settled, len(sessions) - CLOSE_GRACE_SESSIONS)
+
+    values, costs = value_series(symbols=[lot[0] for lot in lots],
+                                 dates=[lot[3] for lot in lots],
+                                 quantities=[lot[1] for lot in lots],
+                                 cost_bases=[float(lot[1]) * float(lot[2]) for lot in lots],
+                                 sessions=sessions,
+                                 closes=closes)
+    return values, costs, settled
+
+
+def portfolio_series(id, portfolio_name, lots, today=None):
+    """
+    lots is [(symbol, quantity, purchase price, purchase date), ...] of the portfolio.
+    Returns (sessions, market_values, cost_bases) from the first purchase to the last closed session
+    """
+
+    if today is None:
+        today = date.today()
+
+    # Today's close isn't in the prices table until the day is over
+    calendar = get_calendar(today)
+    end = calendar.session_on_or_before(today - timedelta(days=1))
+    start = calendar.session_on_or_after(min(lot[3] for lot in lots))
+    sessions = calendar.sessions_between(start, end)
+    fingerprint = lots_fingerprint(lots)
+
+    rows = db_select("""
+    SELECT fingerprint, start_date, end_date, market_values, cost_bases FROM portfolio_history
+    WHERE portfolio_name=(%s) AND id=(%s);
+    """, (portfolio_name, id))
+
+    if rows and rows[0][0] == fingerprint and rows[0][1] == start and rows[0][2] <= end:
+        _, _, stored_end, values, costs = rows[0]
+        values = np.array(values, dtype=np.float64)
+        costs = np.array(costs, dtype=np.float64)
+
+        # Only the sessions since the stored series ended. The last stored session is computed again
+        # as a lead in so a symbol without a close on the first new day carries its last one forward
+        new_sessions = calendar.sessions_between(stored_end, end)[1:]
+        if new_sessions:
+            new_values, new_costs, settled = compute(lots, [stored_end] + new_sessions)
+            new_values, new_costs, settled = new_values[1:], new_costs[1:], settled - 1
+            # Appended only if no one else extended it meanwhile
+            if settled > 0:
+                db_commit("""
+                UPDATE portfolio_history
+                SET market_values = market_values || (%s)::double precision[],
+                    cost_bases = cost_bases || (%s)::double precision[],
+                    end_date = (%s)
+                WHERE portfolio_name=(%s) AND fingerprint=(%s) AND end_date=(%s);
+                """,
+                (new_values[:settled].tolist(), new_costs[:settled].tolist(), new_sessions[settled - 1],
+                 portfolio_name, fingerprint, stored_end), sticky=False)
+            values = np.concatenate([values, new_values])
+            costs = np.concatenate([costs, new_costs])
+
+        return sessions, values, costs
+
+    # Everything was bought today, there's no closed session to value yet
+    if not sessions:
+        return sessions, np.zeros(0), np.zeros(0)
+
+    values, costs, settled = compute(lots, sessions)
+    if not settled:
+        return sessions, values, costs
+
+    # https://www.postgresql.org/docs/current/sql-insert.html#SQL-ON-CONFLICT
+    db_commit("""
+    INSERT INTO portfolio_history (portfolio_name, id, fingerprint, start_date, end_date, market_values, cost_bases)
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (portfolio_name) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, start_date = EXCLUDED.start_date, end_date = EXCLUDED.end_date,
+        market_values = EXCLUDED.market_values, cost_bases = EXCLUDED.cost_bases;
+    """,
+    (portfolio_name, id, fingerprint, start, sessions[settled - 1], values[:settled].tolist(),
+     costs[:settled].tolist()), sticky=False)
+
+    return sessions, values, costs
@@ -0,0 +1,92 @@
+import os
+import sys
+import time
+import logging
+
+from db import db_select
+from functions import refresh_quotes
+from market import exchange_now, market_open, next_open
+from quotes import QUOTE_TTL_OPEN
+from symbols import symbols_stale, refresh_symbols
+
+# https://devcenter.heroku.com/articles/background-jobs-queueing
+# Runs as its own Procfile process (worker: python worker.py) and keeps the quotes table
+# fresh for every symbol someone holds, so portfolio pages read prices that are
+# already there instead of the first viewer waiting on IEX for them.
+#
+# While the market is open quotes are refreshed a little more often than they expire.
+# Once it closes they are refreshed one last time, which stores the closing prices
+# until the next open (see quotes.quote_expiry), then the worker sleeps until then.
+# The list of supported symbols is fetched again whenever it is a day old, see symbols.py
+
+# Seconds between refreshes while the market is open, less than QUOTE_TTL_OPEN
+# so cached quotes are replaced before they expire
+QUOTE_REFRESH_INTERVAL = float(os.environ.get("QUOTE_REFRESH_INTERVAL", QUOTE_TTL_OPEN * 0.75))
+
+log = logging.getLogger("worker")
+
+
+def held_symbols():
+    """Every symbol held in any portfolio"""
+    return [row[0] for row in db_select("SELECT DISTINCT symbol FROM shares;", ())]
+
+
+def refresh():
+    """Fetches the latest price of every held symbol into the quotes table, returns how many were stored"""
+
+    # Raises UpstreamUnavailable if IEX didn't answer for some of them, the rest are stored
+    symbols = held_symbols()
+    prices = refresh_quotes(symbols)
+
+    if len(prices) < len(symbols):
+        log.warning("No price for %d of %d symbols", len(symbols) - len(prices), len(symbols))
+    return len(prices)
+
+
+def refresh_symbol_list():
+    """Fetches the symbol list if it is due, every worker and dyno shares the one stored"""
+
+    if symbols_stale():
+        log.info("Stored %d symbols", refresh_symbols())
+
+
+def run():
+    """Refreshes quotes on the market hours schedule forever"""
+
+    while True:
+        try:
+            refresh_symbol_list()
+        except Exception:
+            log.exception("Symbol list refresh failed")
+
+        started = time.monotonic()
+        try:
+            count = refresh()
+            log.info("Refreshed %d quotes in %.2fs", count, time.monotonic() - started)
+        except Exception:
+            # A database or network hiccup shouldn't stop the worker, the next refresh tries again
+            log.exception("Quote refresh failed")
+
+        now = exchange_now()
+        if market_open(now):
+            # The interval is measured from the start of the refresh so slow fetches don't push it back
+            time.sleep(max(QUOTE_REFRESH_INTERVAL - (time.monotonic() - started), 1))
+        else:
+            opens = next_open(now)
+            log.info("Market closed, sleeping until %s", opens.isoformat())
+            time.sleep(max((opens - now).total_seconds(), 1))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+
+    # Need the API_KEY for the worker to function
+    if not os.environ.get("API_KEY"):
+        raise RuntimeError("API_KEY not set")
+
+    # python worker.py --once refreshes a single time, e.g. from the Heroku scheduler
+    if "--once" in sys.argv[1:]:
+        refresh_symbol_list()
+        log.info("Refreshed %d quotes", refresh())
+    else:
+        run()